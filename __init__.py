@@ -23,7 +23,7 @@ import bpy  # pylint: disable=import-error
 
 from . import addon_updater_ops
 from . import common, library, assets, morphing, randomize, file_io, hair, finalize, rig, rigify, pose, prefs, cmedit
-from .lib import charlib
+from .lib import charlib, utils
 
 logger = logging.getLogger(__name__)
 
@@ -86,6 +86,11 @@ def select_handler(_):
     on_select()
 
 
+@bpy.app.handlers.persistent
+def mesh_update_handler(_, depsgraph):
+    utils.update_mesh_versions(depsgraph)
+
+
 classes: list[type] = [None, prefs.CharMorphPrefs, VIEW3D_PT_CharMorph]
 
 uiprops = [bpy.types.PropertyGroup]
@@ -117,6 +122,7 @@ def register():
     bpy.app.handlers.undo_post.append(undoredo_post)
     bpy.app.handlers.redo_post.append(undoredo_post)
     bpy.app.handlers.depsgraph_update_post.append(select_handler)
+    bpy.app.handlers.depsgraph_update_post.append(mesh_update_handler)
 
     cmedit.register()
 
@@ -130,10 +136,9 @@ def unregister():
     for hlist in bpy.app.handlers:
         if not isinstance(hlist, list):
             continue
-        for handler in hlist:
-            if handler in (load_handler, select_handler):
+        for handler in list(hlist):
+            if handler in (load_handler, select_handler, mesh_update_handler):
                 hlist.remove(handler)
-                break
 
     bpy.msgbus.clear_by_owner(owner)
     del bpy.types.WindowManager.charmorph_ui
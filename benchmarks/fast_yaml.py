@@ -0,0 +1,161 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Fast yaml loader conformance check and benchmark. Runs outside of Blender:
+#   python benchmarks/fast_yaml.py [yaml files or directories]
+# Every document is loaded with the fast loader and with the bundled SafeLoader, results must be equal
+# including types. Directories are searched for .yaml files, the library data directory is checked
+# by default. Built-in edge cases and generated Rigify-sized bones and tweaks files are always checked.
+# Exits with status 1 if any result differs.
+
+import os, sys, time, random
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from lib import fast_yaml  # pylint: disable=wrong-import-position
+from lib.yaml import load, dump, SafeLoader, YAMLError  # pylint: disable=wrong-import-position
+
+edge_cases = [
+    "", "# only comment\n", "a: 1\n", "a:\n", "a: ~\nb: null\nc: Null\n",
+    "a: yes\nb: No\nc: on\nd: OFF\ne: y\nf: n\ng: true\n",
+    "a: 1\nb: -2\nc: +3\nd: 0\ne: 010\nf: 0x1F\ng: 1_000\nh: 1:30\n",
+    "a: 1.5\nb: -0.25\nc: 1.\nd: .5\ne: -.5\nf: 1e5\ng: 1.5e-3\nh: 1.5e3\ni: .inf\nj: .NaN\n",
+    "a: 2001-12-14\nb: <<\nc: =\n",
+    "a: hello world\nb: it's\nc: x # comment\nd: x#y\ne: 'quoted # not comment'\nf: \"dq\"\n",
+    "a: 'it''s'\nb: \"esc\\n\"\nc: 'multi\n  line'\n",
+    "a: plain\n  continued\n",
+    "list: [1, 2.5, a, 'b', \"c\", [x, y], {k: v}]\nempty: []\nemap: {}\ntrail: [a, b,]\n",
+    "flow: {a: 1, b: [1, 2], 'c': d}\nbad: {a, b}\npair: [a: b]\n",
+    "multi: [a,\n  b]\n",
+    "seq:\n- a\n- b\nseq2:\n  - c\n  -\n  - - d\n    - e\n",
+    "- a: 1\n  b: 2\n- c: 3\n-\n  d: 4\n- - x\n  - y\n",
+    "- bone: x\n  set:\n    influence: 0.5\n    targets: {a: 1}\n- bone: y\n",
+    "a:\n  b:\n    c: 1\n  d: 2\ne: 3\n",
+    "a:\n- 1\n- 2\nb: 3\n",
+    "1: int key\nyes: bool key\n~: null key\n'q': quoted key\n\"dq\": key\nwith space: v\n",
+    "a: 1\na: 2\n",
+    "a: &x 1\nb: *x\n", "a: !!str 1\n", "a: |\n  block\n", "a: >\n  folded\n",
+    "? complex\n: key\n", "--- \na: 1\n", "%YAML 1.1\n---\na: 1\n", "a: 1\n...\n",
+    "a:\tb\n", "a: 1\r\nb: 2\r\n", "\ufeffa: 1\n", "a: \u00e9\u4e2d\n",
+    "a: 1\n b: 2\n", "  a: 1\nb: 2\n", "a: b: c\n", "a: - b\n", "a: [1, 2] x\n", "key: 'unterminated\n",
+    "a: -b\nb: +c\nc: .d\nd: -\n", "a: @x\n", "a: `x\n", "a: %x\n",
+    "joint_upper_arm.L_head: [0.1, -0.2, 0.3]\n",
+]
+
+
+def generated():
+    rnd = random.Random(1)
+    bones = {f"bone{j}.{side}": {
+        "axis_z": [round(rnd.uniform(-1, 1), 5) for _ in range(3)],
+        "offs_head": [round(rnd.uniform(-0.01, 0.01), 5) for _ in range(3)],
+        "connected": rnd.random() < 0.5,
+        "align": f"bone{rnd.randrange(150)}.{side}",
+    } for j in range(150) for side in "LR"}
+    tweaks = [{
+        "bone": f"bone{j}.L", "select": "constraint", "type": "COPY_ROTATION",
+        "set": {"influence": round(rnd.random(), 3), "mix_mode": "ADD", "subtarget": f"ORG-bone{j}.L"},
+    } for j in range(300)]
+    for data in (bones, tweaks):
+        yield dump(data)
+        yield dump(data, default_flow_style=False)
+
+
+def yaml_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for dirpath, _, files in os.walk(path):
+            for file in sorted(files):
+                if file.endswith(".yaml"):
+                    yield os.path.join(dirpath, file)
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def full_load(text):
+    return load(text, Loader=SafeLoader)
+
+
+def same(a, b):
+    if type(a) is not type(b):  # pylint: disable=unidiomatic-typecheck
+        return False
+    if isinstance(a, dict):
+        return list(a) == list(b) and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return a == b or a != a and b != b
+
+
+def check(name, text):
+    """Returns (fast path is used, result is correct)"""
+    try:
+        expected = full_load(text)
+    except YAMLError:
+        expected = YAMLError
+    try:
+        got = fast_yaml.parse(text)
+    except fast_yaml.Unsupported:
+        return False, True
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"{name}: fast loader failed with {e!r}")
+        return True, False
+    if not same(expected, got):
+        print(f"{name}: fast loader result differs\n  expected: {expected!r}\n  got: {got!r}")
+        return True, False
+    return True, True
+
+
+def bench(docs, func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for text in docs:
+            func(text)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    paths = sys.argv[1:] or [os.path.join(root, "data")]
+    docs = [(f"edge case {i}", text) for i, text in enumerate(edge_cases)]
+    docs += [(f"generated {i}", text) for i, text in enumerate(generated())]
+    docs += [(path, read(path)) for path in yaml_files(paths)]
+
+    fast = failed = 0
+    for name, text in docs:
+        used, ok = check(name, text)
+        fast += used
+        failed += not ok
+    print(f"{len(docs)} documents, {fast} on fast path, {len(docs) - fast} fall back, {failed} failed")
+
+    texts = [text for name, text in docs if not name.startswith("edge case")]
+    t_full = bench(texts, full_load)
+    t_fast = bench(texts, lambda text: fast_yaml.load(text, full_load))
+    size = sum(len(text) for text in texts)
+    print(f"{len(texts)} files, {size / 1024:.0f} KiB: SafeLoader {t_full:.3f}s, fast loader {t_fast:.3f}s, "
+          f"speedup {t_full / t_fast:.1f}x")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Fitting benchmark on synthetic characters and garments, doesn't need Blender.
+#   python benchmarks/fitting.py [-o results.json] [--res small,medium] [--compare old.json]
+#   blender -b --python benchmarks/fitting.py -- --orig
+# Body is a surface of revolution, garments are shells around parts of it with their own resolution.
+# Every case records time and peak memory of every binding stage. Memory is traced with tracemalloc,
+# it slows things down a bit, use --no-trace for timing only. Results from different commits
+# can be compared with --compare. With --orig the original per-vertex binders are run too,
+# they need mathutils KDTree and BVHTree, so run them inside Blender.
+
+import os, sys, json, time, argparse, platform, subprocess, tracemalloc
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import binding  # pylint: disable=wrong-import-position
+
+try:
+    from mathutils import bvhtree, interpolate, kdtree  # pylint: disable=import-error
+except ImportError:
+    bvhtree = None
+
+resolutions = {
+    "small": 48,
+    "medium": 96,
+    "large": 192,
+}
+
+# name: z range, offset from body, flare, resolution factor relative to the body
+garments = {
+    "shirt": (-0.1, 0.45, 0.01, 0, 1.5),
+    "skirt": (-0.7, -0.05, 0.02, 0.15, 1),
+    "coat": (-0.6, 0.5, 0.04, 0.05, 0.5),
+}
+
+
+def profile(z):
+    # torso, neck and head
+    return 0.17 + 0.03 * numpy.sin(4 * z) - 0.1 * numpy.exp(-((z - 0.55) / 0.05) ** 2) \
+        + 0.02 * numpy.exp(-((z - 0.68) / 0.08) ** 2)
+
+
+def revolution(nu, z, radius, closed):
+    u = numpy.linspace(0, 2 * numpy.pi, nu, endpoint=False)
+    verts = numpy.stack((
+        radius[None, :] * numpy.cos(u)[:, None],
+        radius[None, :] * numpy.sin(u)[:, None],
+        numpy.broadcast_to(z, (nu, len(z))),
+    ), -1).reshape(-1, 3)
+    nv = len(z)
+    faces = []
+    for i in range(nu):
+        for j in range(nv - 1):
+            a = i * nv + j
+            b = ((i + 1) % nu) * nv + j
+            faces.append((a, b, b + 1, a + 1))
+    if closed:
+        verts = numpy.concatenate((verts, ((0, 0, z[0]), (0, 0, z[-1]))))
+        bottom, top = len(verts) - 2, len(verts) - 1
+        for i in range(nu):
+            a = i * nv
+            b = ((i + 1) % nu) * nv
+            faces.append((bottom, b, a))
+            faces.append((top, a + nv - 1, b + nv - 1))
+    # jitter avoids exact ties in nearest point searches on the symmetric mesh
+    verts = verts + numpy.random.default_rng(nu * nv).normal(0, 1e-4, verts.shape)
+    return verts, faces
+
+
+def body(res):
+    z = numpy.linspace(-0.8, 0.8, res * 2)
+    return binding.Geometry(*revolution(res, z, profile(z), True))
+
+
+def garment(res, zmin, zmax, offset, flare, factor):
+    nu = max(8, int(res * factor))
+    z = numpy.linspace(zmin, zmax, max(4, int(res * 2 * factor * (zmax - zmin) / 1.6)))
+    radius = profile(z) + offset + flare * ((zmax - z) / (zmax - zmin)) ** 2
+    return binding.Geometry(*revolution(nu, z, radius, False))
+
+
+def morph(verts):
+    x, y, z = verts.T
+    return numpy.stack((0.15 * x * (1 + z), 0.1 * y + 0.02 * numpy.sin(8 * z), 0.05 * z + 0.03 * x * x), -1)
+
+
+class StageRecorder:
+    """Collects time and peak memory of stages, can be used as timer for binding functions"""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.stages = {}
+        self.start()
+
+    def start(self):
+        if self.trace:
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.t = time.perf_counter()
+
+    def time(self, name):
+        t = time.perf_counter() - self.t
+        peak = tracemalloc.get_traced_memory()[1] - self.base if self.trace else 0
+        stage = self.stages.setdefault(name, {"time": 0, "peak_mb": 0})
+        stage["time"] += t
+        stage["peak_mb"] = max(stage["peak_mb"], peak / 1048576)
+        self.start()
+
+    def result(self, **kwargs):
+        return {
+            "stages": self.stages,
+            "time": sum(s["time"] for s in self.stages.values()),
+            "peak_mb": max((s["peak_mb"] for s in self.stages.values()), default=0),
+            **kwargs,
+        }
+
+
+class OrigBinder:
+    """The original per-vertex binders with mathutils trees, stage names match the batched ones"""
+
+    def __init__(self, binder, char, asset_verts):
+        self.hard = binder == "HARD"
+        self.char = char
+        self.asset_verts = asset_verts
+        self.bindings = []
+        self.dists_asset = []
+        self.revset = set()
+
+    @staticmethod
+    def trees(geom):
+        kd = kdtree.KDTree(len(geom.verts))
+        for i, v in enumerate(geom.verts):
+            kd.insert(v, i)
+        kd.balance()
+        return kd, bvhtree.BVHTree.FromPolygons(geom.verts.tolist(), geom.faces)
+
+    def soft_kd(self, kd):
+        for v in self.asset_verts:
+            pdata = kd.find_n(v.tolist(), 16)
+            dists = [p[2] for p in pdata]
+            mindist = min(dists)
+            maxdist = max(dists)
+            if mindist < binding.epsilon2:
+                self.dists_asset.append(-1)
+                self.bindings.append({item[1]: binding.bigval for item in pdata if item[2] < binding.epsilon2})
+            else:
+                self.dists_asset.append(mindist)
+                self.revset.update(p[1] for p in pdata)
+                self.bindings.append({idx: (1 - (dist / maxdist)) / (max(dist, binding.epsilon))
+                                      for _, idx, dist in pdata})
+
+    def soft_direct(self, bvh):
+        if max(self.dists_asset) < binding.epsilon2:
+            return
+        verts = self.char.verts
+        for i, (v, bdist, b) in enumerate(zip(self.asset_verts, self.dists_asset, self.bindings)):
+            if bdist < binding.epsilon2:
+                continue
+            bdist *= 0.75
+            for loc, _, idx, fdist in bvh.find_nearest_range(v.tolist(), bdist):
+                face = self.char.faces[idx]
+                self.dists_asset[i] = min(self.dists_asset[i], fdist)
+                fdist = (1 - fdist / bdist) / max(fdist, binding.epsilon)
+                for vi, bw in zip(face, interpolate.poly_3d_calc(verts[list(face)].tolist(), loc)):
+                    b[vi] = max(b.get(vi, 0), bw * fdist)
+
+    def hard_direct(self, bvh):
+        verts = self.char.verts
+        for v in self.asset_verts:
+            loc, _, idx, fdist = bvh.find_nearest(v.tolist())
+            face = self.char.faces[idx]
+            self.revset.update(face)
+            self.dists_asset.append(fdist)
+            fdist = 1 / max(fdist, binding.epsilon)
+            self.bindings.append({vi: bw * fdist for vi, bw in zip(
+                face, interpolate.poly_3d_calc(verts[list(face)].tolist(), loc))})
+
+    def hard_kd(self, kd):
+        for v, fdist, b in zip(self.asset_verts, self.dists_asset, self.bindings):
+            if fdist < binding.epsilon2:
+                continue
+            fdist = min(fdist * 1.5, fdist + binding.dist_thresh)
+            kdata = kd.find_range(v, fdist)[:24]
+            if len(kdata) < 2:
+                continue
+            coeff = 2 / (fdist - min(item[2] for item in kdata))
+            for _, idx, dist in kdata:
+                self.revset.add(idx)
+                b[idx] = max(b.get(idx, 0), (fdist - dist) * coeff / max(dist, binding.epsilon))
+
+    def reverse(self, asset):
+        dthresh = min(max(self.dists_asset), binding.dist_thresh)
+        if dthresh < binding.epsilon2:
+            return
+        _, bvh = self.trees(asset)
+        for i in self.revset:
+            loc, _, idx, fdist = bvh.find_nearest(self.char.verts[i].tolist(), dthresh)
+            if idx is None:
+                continue
+            face = asset.faces[idx]
+            coeff = (1 - fdist / dthresh) / max(fdist, binding.epsilon2)
+            for vi, bw in zip(face, interpolate.poly_3d_calc(asset.verts[list(face)].tolist(), loc)):
+                if self.dists_asset[vi] > fdist:
+                    d = self.bindings[vi]
+                    d[i] = max(d.get(i, 0), bw * coeff)
+
+    def run(self, asset, t):
+        kd, bvh = self.trees(self.char)
+        t.time("trees")
+        if self.hard:
+            self.hard_direct(bvh)
+            t.time("bvh direct")
+            self.hard_kd(kd)
+            t.time("kdtree")
+        else:
+            self.soft_kd(kd)
+            t.time("kdtree")
+            self.soft_direct(bvh)
+            t.time("bvh direct")
+        self.reverse(asset)
+        t.time("bvh reverse")
+        return len(self.asset_verts), sum(len(b) for b in self.bindings)
+
+
+def orig_rigger(char, asset, t):
+    """The original RiggerFitCalculator binding with mathutils trees, stage names match calc_binding_rigger"""
+    kd, _ = OrigBinder.trees(char)
+    asset_kd, asset_bvh = OrigBinder.trees(asset)
+    t.time("trees")
+    bindings = []
+    for v in asset.verts:
+        pdata = kd.find_n(v.tolist(), 16)
+        maxdist = max(p[2] for p in pdata)
+        bindings.append({idx: (1 - (dist / maxdist)) / (max(dist, 1e-5)) for _, idx, dist in pdata})
+    t.time("rigger kd")
+    for i, v in enumerate(char.verts):
+        for _, vi, dist in asset_kd.find_n(v.tolist(), 4):
+            d = bindings[vi]
+            d[i] = d.get(i, 0) + 1 / max(dist ** 2, 1e-5)
+    t.time("rigger kd reverse")
+    for i, v in enumerate(char.verts):
+        loc, _, idx, fdist = asset_bvh.find_nearest(v.tolist(), binding.dist_thresh)
+        if idx is None:
+            continue
+        face = asset.faces[idx]
+        fdist = (1 - fdist / binding.dist_thresh) / max(fdist, binding.epsilon2)
+        for vi, bw in zip(face, interpolate.poly_3d_calc(asset.verts[list(face)].tolist(), loc)):
+            d = bindings[vi]
+            d[i] = d.get(i, 0) + bw * fdist
+    t.time("rigger reverse")
+    return sum(len(b) for b in bindings)
+
+
+def best_time(func, repeat, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - t)
+    return result, best
+
+
+def run_case(res, garment_name, trace, repeat, orig=False):
+    results = {}
+    char = body(res)
+    asset_template = garment(res, *garments[garment_name])
+    diff = morph(char.verts)
+
+    r = StageRecorder(trace)
+    char.prepare()
+    r.time("char geometry")
+    results["geometry"] = r.result(char_verts=len(char.verts), asset_verts=len(asset_template.verts))
+
+    for binder in binding.binders:
+        asset = asset_template.copy()
+        r = StageRecorder(trace)
+        asset.prepare()
+        r.time("asset geometry")
+        fb = binding.FitBinding(binding.calc_binding(binder, char, asset.verts, asset, r))
+        fit, t = best_time(fb.fit, repeat, diff)
+        r.stages["fit"] = {"time": t, "peak_mb": fit.nbytes / 1048576}
+        results[binder] = r.result(entries=len(fb[0][1]), binding_mb=fb.nbytes / 1048576)
+        if orig:
+            r = StageRecorder(trace)
+            _, entries = OrigBinder(binder, char, asset.verts).run(asset, r)
+            results["ORIG_" + binder] = r.result(entries=entries)
+
+    # binding used by RiggerFitCalculator for joint transfer to alternative topology
+    asset = asset_template.copy()
+    r = StageRecorder(trace)
+    asset.prepare()
+    r.time("asset geometry")
+    fb = binding.FitBinding(binding.calc_binding_rigger(char, asset, r))
+    results["RIGGER"] = r.result(entries=len(fb[0][1]), binding_mb=fb.nbytes / 1048576)
+    if orig:
+        r = StageRecorder(trace)
+        results["ORIG_RIGGER"] = r.result(entries=orig_rigger(char, asset, r))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ("git", "rev-parse", "--short", "HEAD"), capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results, path):
+    with open(path, encoding="utf-8") as f:
+        old = json.load(f)
+    print(f"\ncompared with {old['meta'].get('commit') or path}:")
+    for case, items in results.items():
+        for name, item in items.items():
+            old_item = old["results"].get(case, {}).get(name)
+            if old_item and old_item["time"] > 0:
+                print(f"  {case} {name}: {item['time'] / old_item['time']:.2f}x time, "
+                      f"{item['peak_mb'] - old_item['peak_mb']:+.1f} MiB peak")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CharMorph fitting benchmark")
+    parser.add_argument("-o", "--output", help="JSON file for results")
+    parser.add_argument("--res", default="small,medium", help="comma separated resolutions: " + ",".join(resolutions))
+    parser.add_argument("--garments", default=",".join(garments), help="comma separated garments")
+    parser.add_argument("--repeat", type=int, default=5, help="repeat count for FitBinding.fit timing")
+    parser.add_argument("--no-trace", action="store_true", help="don't trace memory")
+    parser.add_argument("--compare", help="JSON file with previous results")
+    parser.add_argument("--orig", action="store_true", help="run the original mathutils binders too")
+    args = parser.parse_args(sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else None)
+
+    if args.orig and bvhtree is None:
+        parser.error("--orig needs mathutils with KDTree and BVHTree, run it inside Blender")
+    trace = not args.no_trace
+    if trace:
+        tracemalloc.start()
+    results = {}
+    for res_name in args.res.split(","):
+        for garment_name in args.garments.split(","):
+            case = f"{res_name}/{garment_name}"
+            results[case] = run_case(resolutions[res_name], garment_name, trace, args.repeat, args.orig)
+            geom = results[case]["geometry"]
+            print(f"{case}: character {geom['char_verts']} verts, asset {geom['asset_verts']} verts")
+            for name, item in results[case].items():
+                stages = ", ".join(f"{k} {v['time']:.3f}s" for k, v in item["stages"].items())
+                print(f"  {name}: {item['time']:.3f}s, peak {item['peak_mb']:.1f} MiB ({stages})")
+
+    meta = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "memory_traced": trace,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
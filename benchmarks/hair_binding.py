@@ -0,0 +1,101 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Accuracy report for strand root hair binding against binding of every hair point.
+#   python benchmarks/hair_binding.py [strands] [points per strand]
+# Strands grow from a sphere and bend down, the sphere is deformed by a smooth morph.
+
+import os, sys, time
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import binding  # pylint: disable=wrong-import-position
+
+
+def sphere(nu, nv, r):
+    u = numpy.linspace(0, 2 * numpy.pi, nu, endpoint=False)
+    v = numpy.linspace(0.05, numpy.pi - 0.05, nv)
+    u, v = numpy.meshgrid(u, v, indexing="ij")
+    verts = numpy.stack((r * numpy.sin(v) * numpy.cos(u), r * numpy.sin(v) * numpy.sin(u), r * numpy.cos(v)), -1)
+    faces = []
+    for i in range(nu):
+        for j in range(nv - 1):
+            a = i * nv + j
+            b = ((i + 1) % nu) * nv + j
+            faces.append((a, b, b + 1, a + 1))
+    verts = verts.reshape(-1, 3) + numpy.random.default_rng(nu).normal(0, r * 1e-3, (nu * nv, 3))
+    return verts, faces
+
+
+def hairstyle(strands, points, r, seed=0):
+    rng = numpy.random.default_rng(seed)
+    d = rng.normal(size=(strands, 3))
+    d[:, 2] = numpy.abs(d[:, 2])
+    d /= numpy.linalg.norm(d, axis=1)[:, None]
+    cnts = rng.integers(points // 2, points + 1, strands)
+    t = numpy.concatenate([numpy.arange(1, c + 1) / points for c in cnts])
+    s = numpy.repeat(numpy.arange(strands), cnts)
+    data = d[s] * (r + 0.01 + 0.1 * t[:, None])
+    data[:, 2] -= 0.3 * t * t
+    return cnts, data
+
+
+def morph(verts):
+    x, y, z = verts.T
+    return numpy.stack((0.1 * x + 0.02 * numpy.sin(6 * z), 0.05 * y * z, 0.08 * z + 0.03 * x * y), -1)
+
+
+def timed(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t
+
+
+def main():
+    args = sys.argv[1:]
+    strands = int(args[0]) if args else 5000
+    points = int(args[1]) if len(args) > 1 else 20
+    char_verts, char_faces = sphere(160, 80, 0.5)
+    cnts, data = hairstyle(strands, points, 0.5)
+    char_geom = binding.Geometry(char_verts, char_faces)
+    diff = morph(char_verts)
+    print(f"character: {len(char_verts)} verts, hair: {strands} strands, {len(data)} points")
+
+    full, t_bind = timed(lambda: binding.FitBinding(binding.calc_binding("SOFT", char_geom, data)))
+    ref, t_fit = timed(full.fit, diff)
+    print(f"{'mode':<16}{'binding MiB':>12}{'bind s':>8}{'fit s':>8}{'max err':>10}{'mean err':>10}")
+    print(f"{'full':<16}{full.nbytes / 1048576:>12.2f}{t_bind:>8.3f}{t_fit:>8.3f}{0:>10.2e}{0:>10.2e}")
+    scale = numpy.linalg.norm(ref, axis=1).mean()
+
+    for guides in (0, 1, 2, 3):
+        samples = binding.strand_samples(cnts, guides + 1)
+        sample_binding, t_bind = timed(lambda: binding.FitBinding(
+            binding.calc_binding("SOFT", char_geom, data[samples.reshape(-1)])))
+        for rigid in (True, False):
+            b = binding.StrandBinding(sample_binding, cnts, data, samples, rigid)
+            result, t_fit = timed(b.fit, diff)
+            err = numpy.linalg.norm(result - ref, axis=1)
+            name = f"{'rigid' if rigid else 'affine'}+{guides}"
+            print(f"{name:<16}{b.nbytes / 1048576:>12.2f}{t_bind:>8.3f}{t_fit:>8.3f}"
+                  f"{err.max():>10.2e}{err.mean():>10.2e}")
+    print(f"mean displacement: {scale:.2e}")
+
+
+if __name__ == "__main__":
+    main()
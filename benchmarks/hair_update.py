@@ -0,0 +1,92 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Hair write-back benchmark: per-particle loop against the bulk buffer path of hair.update_hair.
+# Run inside Blender with a hair object active, the add-on must be installed and enabled:
+#   blender file.blend --python benchmarks/hair_update.py -- [repeat]
+# Current hair keys are written back, so the hairstyle stays unchanged.
+
+import os, sys, time, importlib
+import numpy
+
+import bpy  # pylint: disable=import-error
+
+addon = importlib.import_module(os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+hair = addon.lib.hair
+
+
+# Original algorithm: root is read and keys are set for every particle separately
+def update_hair_loop(obj, cnts, morphed):
+    addon.lib.utils.np_matrix_transform(morphed[1:], obj.matrix_world)
+    psys = obj.particle_systems.active
+    with bpy.context.temp_override(object=obj):
+        bpy.ops.particle.disconnect_hair()
+    try:
+        pos = 0
+        for p, cnt in zip(psys.particles, cnts):
+            if len(p.hair_keys) != cnt + 1:
+                continue
+            marr = morphed[pos:pos + cnt + 1]
+            marr[0] = p.hair_keys[0].co_local
+            pos += cnt
+            p.hair_keys.foreach_set("co_local", marr.reshape(-1))
+    finally:
+        with bpy.context.temp_override(object=obj):
+            bpy.ops.particle.connect_hair()
+
+
+def current_keys(obj):
+    psys = obj.particle_systems.active
+    with bpy.context.temp_override(object=obj):
+        bpy.ops.particle.disconnect_hair()
+    data = hair.np_particles_data(obj, psys.particles)
+    with bpy.context.temp_override(object=obj):
+        bpy.ops.particle.connect_hair()
+    return data
+
+
+def run(func, obj, data, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        morphed = numpy.concatenate((((0, 0, 0),), data["data"]))
+        t = time.perf_counter()
+        func(obj, data["cnt"], morphed)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    repeat = int(argv[0]) if argv else 3
+    obj = bpy.context.object
+    if obj is None or not obj.particle_systems.active:
+        print("Active object has no particle system")
+        return
+    data = current_keys(obj)
+    print(f"{len(data['cnt'])} strands, {len(data['data'])} keys")
+
+    t_loop = run(update_hair_loop, obj, data, repeat)
+    after_loop = current_keys(obj)["data"]
+    t_bulk = run(hair.update_hair, obj, data, repeat)
+    after_bulk = current_keys(obj)["data"]
+
+    print(f"loop: {t_loop:.3f}s, bulk: {t_bulk:.3f}s, speedup {t_loop / t_bulk:.2f}x")
+    print("max key difference:", float(numpy.abs(after_loop - after_bulk).max(initial=0)))
+
+
+main()
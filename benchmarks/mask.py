@@ -0,0 +1,139 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Cloth mask benchmark: batched numpy ray casting against the original per-vertex algorithm.
+#   python benchmarks/mask.py [resolution]
+#   blender -b --python benchmarks/mask.py -- [resolution]
+# Inside Blender the original algorithm runs with mathutils BVHTree, outside of it
+# per-vertex rays are tested against all triangles, so use small resolution there.
+
+import os, sys, time
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import binding, masking, spatial  # pylint: disable=wrong-import-position
+
+try:
+    import mathutils  # pylint: disable=import-error
+except ImportError:
+    mathutils = None
+
+
+def sphere(nu, nv, r, vmax=numpy.pi - 0.05):
+    u = numpy.linspace(0, 2 * numpy.pi, nu, endpoint=False)
+    v = numpy.linspace(0.05, vmax, nv)
+    u, v = numpy.meshgrid(u, v, indexing="ij")
+    verts = numpy.stack((r * numpy.sin(v) * numpy.cos(u), r * numpy.sin(v) * numpy.sin(u), r * numpy.cos(v)), -1)
+    faces = []
+    for i in range(nu):
+        for j in range(nv - 1):
+            a = i * nv + j
+            b = ((i + 1) % nu) * nv + j
+            faces.append((a, b, b + 1, a + 1))
+    # jitter avoids rays passing exactly through edges of the symmetric mesh
+    verts = verts.reshape(-1, 3) + numpy.random.default_rng(nu).normal(0, r * 1e-3, (nu * nv, 3))
+    return verts, faces
+
+
+class BruteTree:
+    def __init__(self, verts, faces):
+        tris, _ = spatial.triangulate(spatial.polygons(faces))
+        self.v = [verts[tris[:, i]] for i in range(3)]
+
+    def ray_cast(self, co, direction, max_dist):
+        direction = numpy.asarray(direction) / numpy.linalg.norm(direction)
+        d = numpy.broadcast_to(direction, self.v[0].shape)
+        if spatial.segments_intersect(numpy.asarray(co), d, *self.v, max_dist).any():
+            return None, None, 0, None
+        return None, None, None, None
+
+    def find_nearest(self, co, max_dist):
+        co = numpy.asarray(co)[None]
+        d = spatial.closest_point_on_triangles(co.repeat(len(self.v[0]), 0), *self.v) - co
+        return None, None, 0 if (d * d).sum(1).min() <= max_dist * max_dist else None, None
+
+
+def make_tree(verts, faces):
+    if mathutils:
+        return mathutils.bvhtree.BVHTree.FromPolygons(verts.tolist(), faces)
+    return BruteTree(verts, faces)
+
+
+# The original implementation, one vertex at a time
+def calculate_mask_orig(char_verts, char_faces, bvh_asset, match):
+    cast_points = masking.get_cast_points(char_verts.min(0), char_verts.max(0))
+    bvh_char = make_tree(char_verts, char_faces)
+    result = set()
+    for i, co in enumerate(char_verts):
+        if not match[i]:
+            continue
+        if bvh_asset.find_nearest(co, 0.001)[2] is not None:
+            result.add(i)
+            continue
+        has_cloth = False
+        cnt = 0
+        for cast_point in cast_points:
+            direction = co - cast_point
+            max_dist = numpy.linalg.norm(direction)
+            if bvh_asset.ray_cast(cast_point, direction, max_dist)[2] is None:
+                if bvh_char.ray_cast(cast_point, direction, max_dist * 0.99)[2] is None:
+                    cnt += 1
+                    if cnt == 2:
+                        has_cloth = False
+                        break
+            else:
+                has_cloth = True
+        if has_cloth:
+            result.add(i)
+
+    boundary_verts = set()
+    for f in char_faces:
+        for i in f:
+            if i not in result:
+                boundary_verts.update(f)
+    result.difference_update(boundary_verts)
+    return result
+
+
+def main():
+    args = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    res = int(args[0]) if args else (200 if mathutils else 40)
+    char_verts, char_faces = sphere(res, res // 2, 0.5)
+    asset_verts, asset_faces = sphere(res * 3 // 4, res // 3, 0.52, numpy.pi * 0.6)
+    print(f"character: {len(char_verts)} verts, asset: {len(asset_verts)} verts")
+
+    char_geom = binding.Geometry(char_verts, char_faces)
+    asset_geom = binding.Geometry(asset_verts, asset_faces)
+    match = masking.bbox_mask(char_verts, asset_geom.bbox)
+
+    t = time.perf_counter()
+    mask = masking.calculate_mask(char_geom, asset_geom.tree, match)
+    t_new = time.perf_counter() - t
+
+    t = time.perf_counter()
+    orig = calculate_mask_orig(char_verts, char_faces, make_tree(asset_verts, asset_faces), match)
+    t_orig = time.perf_counter() - t
+
+    new = set(mask.nonzero()[0].tolist())
+    print(f"masked vertices: {len(new)} batched, {len(orig)} original, {len(new ^ orig)} differ")
+    print(f"batched: {t_new:.3f}s, original ({'BVHTree' if mathutils else 'brute force'}): {t_orig:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Weight transfer benchmark. Runs outside of Blender:
+#   python benchmarks/weight_transfer.py [npz weights file]
+# Without arguments a synthetic Rigify-sized weight set (~160 deform groups) is used.
+# If a character weights npz is given, its vertex count is taken from the largest index in it.
+
+import os, sys, time
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import binding  # pylint: disable=wrong-import-position
+from lib.pyutils import vg_add_bulk  # pylint: disable=wrong-import-position
+
+
+class CountingVG:
+    def __init__(self):
+        self.calls = 0
+
+    def add(self, _idx, _weight, _mode):
+        self.calls += 1
+
+
+def sphere(nu, nv, r):
+    u = numpy.linspace(0, 2 * numpy.pi, nu, endpoint=False)
+    v = numpy.linspace(0.05, numpy.pi - 0.05, nv)
+    u, v = numpy.meshgrid(u, v, indexing="ij")
+    verts = numpy.stack((r * numpy.sin(v) * numpy.cos(u), r * numpy.sin(v) * numpy.sin(u), r * numpy.cos(v)), -1)
+    faces = []
+    for i in range(nu):
+        for j in range(nv - 1):
+            a = i * nv + j
+            b = ((i + 1) % nu) * nv + j
+            faces.append((a, b, b + 1, a + 1))
+    return verts.reshape(-1, 3), faces
+
+
+def synthetic_groups(verts, count=160, influences=4, seed=0):
+    rng = numpy.random.default_rng(seed)
+    centers = verts[rng.choice(len(verts), count, replace=False)]
+    d = numpy.linalg.norm(verts[:, None, :] - centers[None, :, :], axis=-1)
+    nearest = numpy.argpartition(d, influences, axis=1)[:, :influences]
+    w = 1 / (numpy.take_along_axis(d, nearest, 1) + 1e-3) ** 2
+    w /= w.sum(axis=1, keepdims=True)
+    result = []
+    for g in range(count):
+        vi, col = (nearest == g).nonzero()
+        result.append((f"DEF-bone.{g:03}", vi, w[vi, col]))
+    return result
+
+
+def npz_groups(path):
+    z = numpy.load(path)
+    names = [n.decode("utf-8") for n in bytes(z["names"]).split(b"\0")]
+    idx = z["idx"]
+    weights = z["weights"]
+    result = []
+    i = 0
+    for name, cnt in zip(names, z["cnt"]):
+        result.append((name, idx[i:i + cnt], weights[i:i + cnt]))
+        i += int(cnt)
+    return result
+
+
+# Original algorithm: dense buffer and binding.fit() for every group
+def transfer_dense(fit_binding, nverts, groups, cutoff=1e-4):
+    buf = numpy.empty(nverts)
+    for name, idx, weights in groups:
+        buf.fill(0)
+        buf.put(idx, weights)
+        weights = fit_binding.fit(buf, True)
+        idx = (weights > cutoff).nonzero()[0]
+        if len(idx) > 0:
+            yield name, idx, weights[idx]
+
+
+def main():
+    char_verts, char_faces = sphere(200, 100, 0.5)
+    asset_verts, asset_faces = sphere(150, 80, 0.51)
+    if len(sys.argv) > 1:
+        groups = npz_groups(sys.argv[1])
+        nverts = max(int(idx.max()) + 1 for _, idx, _ in groups if len(idx))
+        if nverts > len(char_verts):
+            char_verts, char_faces = sphere(nverts // 100 + 1, 100, 0.5)
+    else:
+        groups = synthetic_groups(char_verts)
+    nverts = len(char_verts)
+    print(f"character: {nverts} verts, asset: {len(asset_verts)} verts, groups: {len(groups)}")
+
+    fit_binding = binding.FitBinding(binding.calc_binding(
+        "SOFT", binding.Geometry(char_verts, char_faces), asset_verts, binding.Geometry(asset_verts, asset_faces)))
+
+    t = time.perf_counter()
+    dense = list(transfer_dense(fit_binding, nverts, groups))
+    t_dense = time.perf_counter() - t
+
+    t = time.perf_counter()
+    sparse = list(binding.transfer_weights(fit_binding, nverts, groups))
+    t_sparse = time.perf_counter() - t
+
+    assert [g[0] for g in dense] == [g[0] for g in sparse]
+    err = 0
+    for (_, idx1, w1), (_, idx2, w2) in zip(dense, sparse):
+        assert numpy.array_equal(idx1, idx2)
+        err = max(err, numpy.abs(w1 - w2).max())
+
+    calls = sum(len(idx) for _, idx, _ in sparse)
+    vg = CountingVG()
+    t = time.perf_counter()
+    for _, idx, weights in sparse:
+        vg_add_bulk(vg, idx, weights)
+    t_bulk = time.perf_counter() - t
+
+    print(f"dense per-group fit: {t_dense:.3f}s")
+    print(f"sparse product:      {t_sparse:.3f}s (max weight difference {err:.2e})")
+    print(f"VertexGroup.add calls: {calls} per-vertex, {vg.calls} grouped ({t_bulk:.3f}s grouping)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Yaml parse cache benchmark: cold and warm loads of library yaml files.
+#   python benchmarks/yaml_cache.py [library dir] [characters]
+#   blender -b --python benchmarks/yaml_cache.py -- [library dir]
+# Outside of Blender all yaml files under library dir are loaded through the cache,
+# without arguments a synthetic library with Rigify-sized bones and tweaks files is generated.
+# Inside Blender the whole character library is loaded with charlib.Library.
+
+import os, sys, time, shutil, random, tempfile, importlib
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from lib.manifest import Manifest  # pylint: disable=wrong-import-position
+from lib.yaml import load, dump, SafeLoader  # pylint: disable=wrong-import-position
+
+try:
+    import bpy  # pylint: disable=import-error, unused-import
+except ImportError:
+    bpy = None
+
+
+def make_library(path, chars):
+    rnd = random.Random(1)
+    for i in range(chars):
+        d = os.path.join(path, "characters", f"char{i}")
+        os.makedirs(d)
+        bones = {f"bone{j}.{side}": {
+            "axis_z": [round(rnd.uniform(-1, 1), 5) for _ in range(3)],
+            "offs_head": [round(rnd.uniform(-0.01, 0.01), 5) for _ in range(3)],
+            "connected": rnd.random() < 0.5,
+        } for j in range(150) for side in "LR"}
+        tweaks = [{
+            "bone": f"bone{j}.L", "select": "constraint", "type": "COPY_ROTATION",
+            "set": {"influence": round(rnd.random(), 3), "mix_mode": "ADD", "owner_space": "LOCAL"},
+        } for j in range(300)]
+        with open(os.path.join(d, "config.yaml"), "w", encoding="utf-8") as f:
+            dump({"title": f"Character {i}", "armature": [
+                {"title": "Rigify", "type": "rigify", "bones": "bones.yaml", "tweaks": "tweaks.yaml"}]}, f)
+        with open(os.path.join(d, "bones.yaml"), "w", encoding="utf-8") as f:
+            dump(bones, f)
+        with open(os.path.join(d, "tweaks.yaml"), "w", encoding="utf-8") as f:
+            dump(tweaks, f)
+
+
+def yaml_files(path):
+    for dirpath, _, files in os.walk(path):
+        for file in sorted(files):
+            if file.endswith(".yaml"):
+                yield os.path.join(dirpath, file)
+
+
+def read_yaml(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return load(f, Loader=SafeLoader)
+
+
+def load_files(files, cache_file):
+    cache = Manifest(None, cache_file).load()
+    t = time.perf_counter()
+    for file in files:
+        cache.get(file, read_yaml)
+    result = time.perf_counter() - t
+    cache.save(False)
+    return result, cache
+
+
+def run_files(path):
+    files = list(yaml_files(path))
+    size = sum(os.path.getsize(f) for f in files)
+    print(f"{len(files)} yaml files, {size / 1024:.0f} KiB")
+    cache_file = os.path.join(tempfile.mkdtemp(), ".yaml_cache")
+    try:
+        t_cold, _ = load_files(files, cache_file)
+        t_warm, cache = load_files(files, cache_file)
+    finally:
+        shutil.rmtree(os.path.dirname(cache_file))
+    print(f"cold: {t_cold:.3f}s, warm: {t_warm:.3f}s, speedup: {t_cold / t_warm:.1f}x")
+    print(f"cache: {cache.stats()}")
+
+
+def run_blender(path):
+    addon = importlib.import_module(os.path.basename(root))
+    charlib, utils = addon.lib.charlib, addon.lib.utils
+    for name in (".manifest", ".yaml_cache"):
+        if os.path.isfile(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    for title in ("cold", "warm"):
+        utils.yaml_cache = addon.lib.manifest.Manifest(None, "")
+        lib = charlib.Library(path)
+        t = time.perf_counter()
+        lib.load()
+        for char in lib.chars.values():
+            for conf in char.armature.values():
+                _ = conf.bones, conf.mixin_bones
+            _ = char.morphs_meta
+        print(f"{title}: {time.perf_counter() - t:.3f}s, {len(lib.chars)} characters, "
+              f"yaml cache: {utils.yaml_cache.stats()}")
+
+
+def main():
+    args = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    if bpy is not None:
+        run_blender(args[0] if args else os.path.join(root, "data"))
+        return
+    if args and os.path.isdir(args[0]):
+        run_files(args[0])
+        return
+    path = tempfile.mkdtemp()
+    try:
+        make_library(path, int(args[0]) if args else 4)
+        run_files(path)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,12 +18,14 @@
 #
 # Copyright (C) 2020-2022 Michael Vigovsky
 
-import numpy
+import os, logging, numpy
 
 import bpy, bpy_extras, bmesh  # pylint: disable=import-error
 
 from . import file_io
-from ..lib import morpher_cores, fit_calc, utils
+from ..lib import charlib, morpher_cores, fit_calc, fold, utils
+
+logger = logging.getLogger(__name__)
 
 class CMEDIT_PT_Assets(bpy.types.Panel):
     bl_label = "Assets"
@@ -44,6 +46,7 @@ class CMEDIT_PT_Assets(bpy.types.Panel):
         l.operator("cmedit.retarget")
         l.operator("cmedit.final_to_sk")
         l.operator("cmedit.fold_export")
+        l.operator("cmedit.fold_generate")
 
 
 def get_shape_keys(obj):
@@ -180,16 +183,8 @@ class OpExportFold(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         else:
             verts = f.geom.verts
 
-        faces = numpy.array(f.geom.faces, dtype=numpy.uint32)
-        faces = faces.astype(file_io.get_bits(faces.reshape(-1)), casting="same_kind")
-
-        data = {
-            "verts": verts.astype(file_io.float_dtype(self.precision), casting="same_kind"),
-            "faces": faces,
-            "pos": binding[0],
-            "idx": binding[1].astype(file_io.get_bits(binding[1]), casting="same_kind"),
-            "weights": binding[2].astype(numpy.float32, casting="same_kind"),
-        }
+        data = fold.fold_data(verts, numpy.array(f.geom.faces, dtype=numpy.uint32), binding,
+                              file_io.float_dtype(self.precision))
 
         if self.sk_weights.startswith("sk_"):
             diff = get_sk_verts(ui, self.sk_weights) - verts
@@ -201,6 +196,60 @@ class OpExportFold(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         return {"FINISHED"}
 
 
+class OpGenerateFolds(bpy.types.Operator):
+    bl_idname = "cmedit.fold_generate"
+    bl_label = "Generate fitting data"
+    bl_description = "Generate fold.npz with decimated proxy mesh for every dense asset in the assets directory"
+
+    directory: bpy.props.StringProperty(subtype='DIR_PATH')
+    filter_folder: bpy.props.BoolProperty(default=True, options={'HIDDEN'})
+    precision: file_io.prop_precision
+    min_verts: bpy.props.IntProperty(
+        name="Minimal vertices",
+        description="Only generate fitting data for assets with at least this count of vertices",
+        default=20000, min=0)
+    proxy_verts: bpy.props.IntProperty(
+        name="Proxy vertices",
+        description="Approximate vertex count of proxy mesh",
+        default=4000, min=100)
+    overwrite: bpy.props.BoolProperty(
+        name="Overwrite",
+        description="Regenerate fitting data of assets that already have it. "
+        "Existing fold.npz files can have manually made proxies and weights morphs, so they are skipped by default")
+
+    def invoke(self, context, _):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, _context):
+        assets = charlib.load_assets_dir(self.directory)
+        cnt = 0
+        for asset in assets.values():
+            path = os.path.join(asset.dirpath, "fold.npz") if asset.dirpath else ""
+            if not path or (os.path.exists(path) and not self.overwrite):
+                continue
+            obj = utils.import_obj(asset.blend_file, asset.name, link=False)
+            if obj is None:
+                continue
+            mesh = obj.data
+            try:
+                if len(mesh.vertices) < self.min_verts:
+                    continue
+                t = utils.Timer()
+                data = fold.generate_fold(fit_calc.geom_mesh(mesh), self.proxy_verts,
+                                          dtype=file_io.float_dtype(self.precision))
+                numpy.savez(path, **data)
+                t.time("fold " + asset.name)
+                logger.info("%s: %d vertices, proxy %d vertices", asset.name, len(mesh.vertices), len(data["verts"]))
+                cnt += 1
+            finally:
+                bpy.data.objects.remove(obj)
+                if mesh.users == 0:
+                    bpy.data.meshes.remove(mesh)
+        self.report({"INFO"}, f"Fitting data generated for {cnt} assets")
+        return {"FINISHED"}
+
+
 class UIProps:
     asset_obj: bpy.props.PointerProperty(
         name="Asset",
@@ -220,4 +269,4 @@ class UIProps:
     )
 
 
-classes = OpRetarget, OpFinalToSk, OpExportFold, CMEDIT_PT_Assets
+classes = OpRetarget, OpFinalToSk, OpExportFold, OpGenerateFolds, CMEDIT_PT_Assets
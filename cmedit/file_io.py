@@ -22,7 +22,7 @@ import os, re, json, numpy
 import bpy, bpy_extras, bmesh, idprop  # pylint: disable=import-error
 
 from ..lib import morphs, utils
-from ..lib.hair import update_hair, export_hair
+from ..lib import hair
 
 prop_precision = bpy.props.EnumProperty(
     name="Precision",
@@ -35,6 +35,27 @@ prop_precision = bpy.props.EnumProperty(
 )
 
 
+prop_hair_precision = bpy.props.EnumProperty(
+    name="Precision",
+    description="Floating point precision for hair npz files",
+    default="32",
+    items=[
+        ("16", "16 bits", "IEEE Half precision floating point, use with delta encoding"),
+        ("32", "32 bits", "IEEE Single precision floating point"),
+        ("64", "64 bits", "IEEE Double precision floating point"),
+    ]
+)
+prop_hair_delta = bpy.props.BoolProperty(
+    name="Delta encoding",
+    description="Store differences between successive hair points, improves accuracy of 16-bit precision",
+)
+prop_hair_compress = bpy.props.BoolProperty(
+    name="Compress",
+    description="Compress npz file. Uncompressed files are larger but load faster",
+    default=True,
+)
+
+
 def float_dtype(value):
     return numpy.float64 if value == "64" else numpy.float32
 
@@ -46,14 +67,19 @@ class OpHairExport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
     filename_ext = ".npz"
 
     filter_glob: bpy.props.StringProperty(default="*.npz", options={'HIDDEN'})
-    precision: prop_precision
+    precision: prop_hair_precision
+    delta: prop_hair_delta
+    compress: prop_hair_compress
 
     @classmethod
     def poll(cls, context):
         return context.object and context.object.particle_systems.active
 
     def execute(self, context):
-        export_hair(context.object, context.object.particle_systems.active_index, self.filepath, float_dtype(self.precision))
+        error = hair.export_hair(
+            context.object, context.object.particle_systems.active_index, self.filepath,
+            hair.hair_dtypes[self.precision], self.delta, self.compress)
+        self.report({"INFO"}, f"Hair exported, max error {error:.3g}")
         return {"FINISHED"}
 
 
@@ -70,8 +96,8 @@ class OpHairImport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         return context.object and context.object.particle_systems.active
 
     def execute(self, context):
-        z = numpy.load(self.filepath)
-        update_hair(context.object, z["cnt"], numpy.concatenate((((0, 0, 0),), z["data"])))
+        cnt, data = hair.load_hair(self.filepath)
+        hair.update_hair(context.object, cnt, numpy.concatenate((((0, 0, 0),), data)))
         return {"FINISHED"}
 
 
@@ -96,9 +122,17 @@ class OpAllHairExport(DirExport):
     bl_label = "Export all hair"
     bl_description = "Export all hairstyles to .npz files"
 
+    precision: prop_hair_precision
+    delta: prop_hair_delta
+    compress: prop_hair_compress
+
     def execute(self, context):
+        error = 0
         for i, psys in enumerate(context.object.particle_systems):
-            export_hair(context.object, i, os.path.join(self.directory, psys.name + ".npz"), float_dtype(self.precision))
+            error = max(error, hair.export_hair(
+                context.object, i, os.path.join(self.directory, psys.name + ".npz"),
+                hair.hair_dtypes[self.precision], self.delta, self.compress))
+        self.report({"INFO"}, f"Hair exported, max error {error:.3g}")
         return {"FINISHED"}
 
 
@@ -313,14 +347,7 @@ class MorphExporter:
         m2 = self.morphed.reshape(-1, 3)
 
         if sk.vertex_group:
-            vg = self.obj.vertex_groups[sk.vertex_group].index
-            for i, v in enumerate(self.obj.data.vertices):
-                for e in v.groups:
-                    if e.group == vg:
-                        m2[i] *= e.weight
-                        break
-                else:
-                    m2[i] = (0, 0, 0)
+            m2 *= utils.read_vertex_groups(self.obj).column(sk.vertex_group)[:, None]
 
         export_morph(m2, path, self.epsilon, self.dtype)
 
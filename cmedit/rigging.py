@@ -174,26 +174,14 @@ class OpRigifyTweaks(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         return context.object and context.object.type == "ARMATURE"
 
     def execute(self, context):  # pylint: disable=no-self-use
-        with open(self.filepath, "r", encoding="utf-8") as f:
-            tweaks = utils.load_yaml(f)
-        pre_tweaks, editmode_tweaks, post_tweaks = rigging.unpack_tweaks(os.path.dirname(self.filepath), tweaks)
+        tweaks = utils.load_yaml_file(self.filepath)
+        stages = rigging.unpack_tweaks(os.path.dirname(self.filepath), tweaks)
         old_mode = context.mode
         if old_mode.startswith("EDIT_"):
             old_mode = "EDIT"
-        if len(pre_tweaks) > 0:
-            bpy.ops.object.mode_set(mode="OBJECT")
-            for tweak in pre_tweaks:
-                rigging.apply_tweak(context.object, tweak)
-
-        if len(editmode_tweaks) > 0:
-            bpy.ops.object.mode_set(mode="EDIT")
-            for tweak in editmode_tweaks:
-                rigging.apply_editmode_tweak(context, tweak)
-
-        if len(post_tweaks) > 0:
-            bpy.ops.object.mode_set(mode="OBJECT")
-            for tweak in post_tweaks:
-                rigging.apply_tweak(context.object, tweak)
+        t = utils.StageTimer("Rigify tweaks")
+        rigging.TweakEngine(context, context.object).run(stages, t)
+        t.report()
         bpy.ops.object.mode_set(mode=old_mode)
         return {"FINISHED"}
 
@@ -18,31 +18,39 @@
 #
 # Copyright (C) 2021 Michael Vigovsky
 
+import numpy
 import bpy, mathutils  # pylint: disable=import-error
 
-from ..lib import utils
+from ..lib import symmetry, utils
+from ..lib.symmetry import swap_l_r
 
 
-def is_deform(group_name):
-    return group_name.startswith("DEF-") or group_name.startswith("MCH-") or group_name.startswith("ORG-")
+def mirror_map(mesh):
+    return symmetry.get_mirror_map(utils.verts_to_numpy(mesh.vertices))
 
 
-def swap_l_r(name):
-    new_name = name.replace(".L", ".R").replace("_L_", "_R_").replace(".l", ".r").replace("_l_", "_r_")
-    if new_name != name:
-        return new_name
-    return name.replace(".R", ".L").replace("_R_", "_L_").replace(".r", ".l").replace("_r_", "_l_")
+def mirror_pairs(mesh, mm, rows):
+    rows, m, failed = mm.pairs(rows)
+    for i in failed.tolist():
+        v = mesh.vertices[i]
+        print(i, v.co, "no counterpart" if mm.mirror[i] == -1 else "multiple counterparts")
+    return rows, m
 
 
-def counterpart_vertex(verts, kd, v):
-    counterparts = kd.find_range(mathutils.Vector((-v.co[0], v.co[1], v.co[2])), 0.00001)
-    if len(counterparts) == 0:
-        print(v.index, v.co, "no counterpart")
-        return None
-    if len(counterparts) > 1:
-        print(v.index, v.co, "multiple counterparts:", counterparts)
-        return None
-    return verts[counterparts[0][1]]
+def read_weights(obj):
+    vgm = utils.read_vertex_groups(obj)
+    return (vgm.names, *vgm.dense())
+
+
+def write_weights(obj, old_w, old_member, w, member):
+    for i, vg in enumerate(obj.vertex_groups):
+        removed = (old_member[:, i] & ~member[:, i]).nonzero()[0]
+        if len(removed):
+            vg.remove(removed.tolist())
+        changed = (member[:, i] & (~old_member[:, i] | (w[:, i] != old_w[:, i]))).nonzero()[0]
+        if len(changed):
+            utils.vg_add_bulk(vg, changed, w[changed, i], None)
+    utils.vg_changed(obj)
 
 
 class OpCheckSymmetry(bpy.types.Operator):
@@ -57,48 +65,26 @@ class OpCheckSymmetry(bpy.types.Operator):
     def execute(self, context):  # pylint: disable=no-self-use
         obj = context.object
         mesh = obj.data
-        kd = utils.kdtree_from_verts(mesh.vertices)
-
-        def groups_to_list(group):
-            return [(obj.vertex_groups[g.group].name, g.weight) for g in group]
-        for v in mesh.vertices:
-            if v.co[0] == 0 or v.co[0] == -0:
-                continue
-            v2 = counterpart_vertex(mesh.vertices, kd, v)
-            if v2 is None:
-                continue
-            if len(v.groups) != len(v2.groups):
-                print(v.index, v.co, "vg mismatch:", groups_to_list(v.groups), groups_to_list(v2.groups))
-
-            gdict = {obj.vertex_groups[g.group].name: (obj.vertex_groups[g.group], g.weight) for g in v2.groups}
-
-            wgt = 0
-
-            for g in v.groups:
-                g1 = obj.vertex_groups[g.group]
-                if is_deform(g1.name):
-                    wgt += g.weight
-                g2_name = swap_l_r(g1.name)
-                g2, g2_weight = gdict.get(g2_name, (None, None))
-                if not g2:
-                    print(v.index, v.co, g1.name, g.weight, "vg counterpart not found")
-                    continue
-                if abs(g.weight - g2_weight) >= 0.01:
-                    print(v.index, v.co, g1.name, "vg weight mismatch:", g.weight, g2_weight)
-                    continue
-
-            if abs(wgt - 1) >= 0.0001:
-                print(v.index, v.co, "not normalized:", wgt)
+        mm = mirror_map(mesh)
+        names, w, member = read_weights(obj)
+        rows, m = mirror_pairs(mesh, mm, (~mm.center).nonzero()[0])
+        cnt_mismatch, missing, mismatch, (bad, wsum) = symmetry.check(
+            w, member, symmetry.deform_mask(names), symmetry.group_mirror(names), rows, m)
+
+        def groups_to_list(i):
+            return [(names[g], w[i, g]) for g in member[i].nonzero()[0]]
+        for r in cnt_mismatch:
+            print(rows[r], mesh.vertices[rows[r]].co, "vg mismatch:", groups_to_list(rows[r]), groups_to_list(m[r]))
+        for r, g in missing:
+            print(rows[r], mesh.vertices[rows[r]].co, names[g], w[rows[r], g], "vg counterpart not found")
+        gmap = symmetry.group_mirror(names)
+        for r, g in mismatch:
+            print(rows[r], mesh.vertices[rows[r]].co, names[g], "vg weight mismatch:", w[rows[r], g], w[m[r], gmap[g]])
+        for r, wgt in zip(bad, wsum):
+            print(rows[r], mesh.vertices[rows[r]].co, "not normalized:", wgt)
         return {"FINISHED"}
 
 
-def get_group_weight(v, idx):
-    for g in v.groups:
-        if g.group == idx:
-            return g.weight
-    return 0
-
-
 class OpSymmetrizeVG(bpy.types.Operator):
     bl_idname = "cmedit.symmetrize_vg"
     bl_label = "Symmetrize current VG"
@@ -112,20 +98,17 @@ class OpSymmetrizeVG(bpy.types.Operator):
     def execute(self, context):  # pylint: disable=no-self-use
         obj = context.object
         vg = obj.vertex_groups.active
-        idx = vg.index
         mesh = obj.data
-        kd = utils.kdtree_from_verts(mesh.vertices)
-        for v in mesh.vertices:
-            if v.co[0] < 1e-30:
-                continue
-            v2 = counterpart_vertex(mesh.vertices, kd, v)
-            if v2 is None:
-                continue
-            w = (get_group_weight(v, idx) + get_group_weight(v2, idx)) / 2
-            if w >= 1e-5:
-                vg.add([v.index, v2.index], w, "REPLACE")
-            else:
-                vg.remove([v.index, v2.index])
+        mm = mirror_map(mesh)
+        w = utils.read_vertex_groups(obj).column(vg.name).astype(numpy.float64)
+        rows, m = mirror_pairs(mesh, mm, (utils.verts_to_numpy(mesh.vertices)[:, 0] >= 1e-30).nonzero()[0])
+        wr = numpy.tile((w[rows] + w[m]) / 2, 2)
+        rows = numpy.concatenate((rows, m))
+        keep = wr >= 1e-5
+        utils.vg_add_bulk(vg, rows[keep], wr[keep], None)
+        if not keep.all():
+            vg.remove(rows[~keep].tolist())
+        utils.vg_changed(obj)
         return {"FINISHED"}
 
 
@@ -142,80 +125,25 @@ class OpSymmetrizeWeights(bpy.types.Operator):
     def execute(self, context):
         obj = context.object
         mesh = obj.data
-        if mesh.is_editmode:
-            obj.update_from_editmode()
-        kd = utils.kdtree_from_verts(mesh.vertices)
-        for v in mesh.vertices:
-            if not v.select:
-                continue
-
-            def normalize(v):
-                groups = []
-                wgt = 0
-                for ge in v.groups:
-                    if is_deform(obj.vertex_groups[ge.group].name):
-                        wgt += ge.weight
-                        groups.append(ge)
-                if abs(wgt - 1) < 0.0001:
-                    return
-                for ge in groups:
-                    ge.weight /= wgt
-            if v.co[0] == 0 or v.co[0] == -0:
-                normalize(v)
-                continue
-            v2 = counterpart_vertex(mesh.vertices, kd, v)
-            if v2 is None:
-                print("no counterpart", v.index)
-                continue
-            gdict = {obj.vertex_groups[g.group].name: g for g in v2.groups}
-
-            wgt2 = 0
-            # cleanup groups without counterparts before normalizing
-            for g in v.groups:
-                if g.group > len(obj.vertex_groups) or g.group < 0:
-                    print("bad vg id", v.index, g.group)
-                    continue
-                vg = obj.vertex_groups[g.group]
-                g2e = gdict.get(swap_l_r(vg.name))
-                if g2e:
-                    if is_deform(vg.name):
-                        wgt2 += g2e.weight
-                elif not vg.lock_weight:
-                    if not is_deform(vg.name):
-                        print("removing non-deform vg", v.index, v2.index, v.co, vg.name)
-                    vg.remove([v.index])
-
-            if wgt2 < 0.0001:
-                print(v.index, v2.index, "situation is too bad, please check")
-                continue
-            if abs(wgt2 - 1) < 0.0001:
-                wgt2 = 1
-
-            normalize(v)
-
-            for g1e in v.groups:
-                vg = obj.vertex_groups[g1e.group]
-                if vg.lock_weight:
-                    continue
-                g2name = swap_l_r(vg.name)
-                g2e = gdict[g2name]
-                g2w = g2e.weight
-                if is_deform(g2name):
-                    g2w /= wgt2
-                if g2w > 1:
-                    print(v.index, v2.index, g2name, g2e.group, g2e.weight, g2w, wgt2)
-                    self.report({'ERROR'}, "Bad g2 weight!")
-                    return {"FINISHED"}
-
-                if abs(g1e.weight - g2w) >= 0.00001:
-                    if v2.select:
-                        wgt = (g1e.weight + g2w) / 2
-                        g1e.weight = wgt
-                        g2e.weight = wgt
-                    else:
-                        g1e.weight = g2w
-
-            normalize(v)
+        editmode = mesh.is_editmode
+        if editmode:
+            bpy.ops.object.mode_set(mode="OBJECT")
+        try:
+            selected = numpy.empty(len(mesh.vertices), dtype=bool)
+            mesh.vertices.foreach_get("select", selected)
+            names, w, member = read_weights(obj)
+            locked = numpy.array([vg.lock_weight for vg in obj.vertex_groups], dtype=bool)
+            sym = symmetry.WeightSymmetrizer(w.copy(), member.copy(), names, locked)
+            ok = sym.run(mirror_map(mesh), selected)
+            for msg in sym.messages:
+                print(msg)
+            if not ok:
+                self.report({'ERROR'}, sym.messages[-1])
+                return {"FINISHED"}
+            write_weights(obj, w, member, sym.w, sym.member)
+        finally:
+            if editmode:
+                bpy.ops.object.mode_set(mode="EDIT")
         return {"FINISHED"}
 
 
@@ -232,39 +160,20 @@ class OpSymmetrizeJoints(bpy.types.Operator):
     def execute(self, context):  # pylint: disable=no-self-use
         obj = context.object
         mesh = obj.data
-        kd = utils.kdtree_from_verts(mesh.vertices)
-        vg_map = {}
-        new_vg = set()
-        for vg in obj.vertex_groups:
-            if not vg.name.startswith("joint_"):
+        mm = mirror_map(mesh)
+        names, w, member = read_weights(obj)
+        gmap = symmetry.group_mirror(names)
+
+        for i, name in enumerate(names):
+            if not name.startswith("joint_"):
                 continue
-            cname = swap_l_r(vg.name)
-            if cname in obj.vertex_groups:
-                cvg = obj.vertex_groups[cname]
-            else:
-                cvg = obj.vertex_groups.new(name=cname)
-                new_vg.add(cvg.index)
-            vg_map[vg.index] = cvg
-
-        for v in mesh.vertices:
-            for g in v.groups:
-                if g.group in new_vg:
-                    continue
-                cvg = vg_map.get(g.group)
-                if cvg is None:
-                    continue
-                v2 = counterpart_vertex(mesh.vertices, kd, v)
-                if v2 is None:
-                    continue
-                if cvg.index in new_vg:
-                    cvg.add([v2.index], g.weight, "REPLACE")
-                else:
-                    try:
-                        w2 = cvg.weight(v2.index)
-                    except RuntimeError:
-                        w2 = 0
-                    if abs(g.weight - w2) >= 1e-5:
-                        print("assymetry:", cvg.name, v.index, g.weight, v2.index, w2)
+            rows, m = mirror_pairs(mesh, mm, member[:, i].nonzero()[0])
+            if gmap[i] < 0:
+                utils.vg_add_bulk(obj.vertex_groups.new(name=swap_l_r(name)), m, w[rows, i], None)
+                continue
+            w2 = w[m, gmap[i]]
+            for r in (numpy.abs(w[rows, i] - w2) >= 1e-5).nonzero()[0]:
+                print("assymetry:", names[gmap[i]], rows[r], w[rows[r], i], m[r], w2[r])
 
         return {"FINISHED"}
 
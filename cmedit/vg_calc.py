@@ -19,29 +19,11 @@
 # Copyright (C) 2021 Michael Vigovsky
 
 import math
+import numpy
 import bpy, mathutils  # pylint: disable=import-error
 
-from ..lib import utils
-
-
-def closest_point_on_face(face, co):
-    if len(face) == 3:
-        return mathutils.geometry.closest_point_on_tri(co, face[0], face[1], face[2])
-    results = []
-    for _ in range(len(face)):
-        results.append(mathutils.geometry.closest_point_on_tri(co, face[0], face[1], face[2]))
-        face = face[1:] + face[:1]
-    results.sort(key=lambda elem: (elem - co).length)
-    return (results[0] + results[1]) / 2
-
-
-def dist_edge(co, v1, v2):
-    co2, dist = mathutils.geometry.intersect_point_line(co, v1, v2)
-    if dist <= 0:
-        return (v1 - co).length
-    if dist >= 1:
-        return (v2 - co).length
-    return (co2 - co).length
+from ..lib import joint_vg, utils
+from ..lib.binding import Geometry
 
 
 def barycentric_weight_calc(veclist, co):
@@ -51,21 +33,18 @@ def barycentric_weight_calc(veclist, co):
     return result
 
 
-def vg_full_to_avg(group):
+def vg_full_to_avg(verts, group):
     if group is None:
         return None
-    total = 0
-    vec = mathutils.Vector()
-    for co, _, weight in group:
-        total += weight
-        vec += co * weight
+    idx, weights = group
+    total = weights.sum()
     if total < 0.1:
         return None
-    return vec / total
+    return mathutils.Vector(weights @ verts[idx] / total)
 
 
 def vg_full_to_dict(group):
-    return {tup[1]: tup[2] for tup in group}
+    return dict(zip(group[0].tolist(), group[1].tolist()))
 
 
 def vg_mult(vg, coeff):
@@ -123,17 +102,11 @@ def overwrite_vg(vertex_groups, name):
     return vertex_groups.new(name=name)
 
 
-def calc_lst(co, lst):
-    if lst is None or len(lst) == 0:
-        return "No vertices were found by the calc method"
-    return dict(zip([tup[1] for tup in lst], barycentric_weight_calc([tup[0] for tup in lst], co)))
-
-
-def calc_group_weights(groups, co):
+def calc_group_weights(verts, groups, co):
     groups2 = []
     coords = []
     for g in groups:
-        co2 = vg_full_to_avg(g)
+        co2 = vg_full_to_avg(verts, g)
         if co2 is not None:
             groups2.append(vg_full_to_dict(g))
             coords.append(co2)
@@ -150,54 +123,67 @@ class VGCalculator:
         self.cur_bone = None
         self.cur_attr = ""
         self.cur_name = ""
+        self.cur_joints = ()
 
         self.kdj_groups = None
 
+        # Batched calc functions take (n, 3) array of joint positions and return joint_vg.JointGroups
+        self.batch_lambdas = {
+            "NP": lambda co: joint_vg.nearest_verts(self.geom, co, self.ui.vg_n),
+            "NR": lambda co: joint_vg.verts_in_range(self.geom, co, self.ui.vg_radius),
+            "NF": lambda co: joint_vg.nearest_face(self.geom, co, self.ui.vg_snap),
+            "NE": lambda co: joint_vg.nearest_edge(self.geom, self.edges, co),
+            "XL": lambda co: joint_vg.cross_lines(self.geom, co, self.ui.vg_xl_vn, self.ui.vg_xl_n),
+            "BB": lambda co: joint_vg.bbox_corners(self.verts, co),
+            "CU": lambda co: joint_vg.group_tour(
+                self.verts, [self.vg_full.get(name, (None,))[0] for name, _ in self.cur_joints], co),
+            "RB": lambda co: self._calc_rays(co, self._rays_bone),
+            "RG": lambda co: self._calc_rays(co, self._rays_global),
+        }
+        # Per joint calc functions take joint position as Vector and return {vertex index: weight} dict
         self.calc_lambdas = {
-            "NP": lambda co: calc_lst(co, self.kd_verts.find_n(co, self.ui.vg_n)),
-            "NR": lambda co: calc_lst(co, self.kd_verts.find_range(co, self.ui.vg_radius)),
             "NC": lambda co: self._calc_nc_nw(co, False),
             "NW": lambda co: self._calc_nc_nw(co, True),
-            "RB": lambda co: self._calc_rays(co, self._rays_bone),
-            "RG": lambda co: self._calc_rays(co, self._rays_global),
         }
 
     def get_calc_func(self, typ=None):
         if not typ:
             typ = self.ui.vg_calc
-        return self.calc_lambdas.get(typ) or getattr(self, "calc_" + typ.lower())
+        result = self.batch_lambdas.get(typ)
+        if result is not None:
+            return result
+        func = self.calc_lambdas.get(typ) or getattr(self, "calc_" + typ.lower())
+        return lambda co: self._calc_per_joint(func, co)
+
+    def _iter_joints(self, co):
+        for (name, (bone, attr)), co1 in zip(self.cur_joints, co):
+            self.cur_name = name
+            self.cur_bone = bone
+            self.cur_attr = attr
+            yield mathutils.Vector(co1)
 
-    @utils.lazyproperty
-    def vg_full(self):
-        return utils.get_vg_data(
-            self.char, lambda: [],
-            lambda data_item, v, co, gw: data_item.append((co, v.index, gw.weight)))
+    def _calc_per_joint(self, func, co):
+        return joint_vg.JointGroups.from_dicts([func(co1) for co1 in self._iter_joints(co)])
 
     @utils.lazyproperty
-    def vg_avg(self):
-        return utils.get_vg_avg(self.char)
+    def verts(self):
+        return utils.verts_to_numpy(self.char.data.vertices)
 
     @utils.lazyproperty
-    def kd_verts(self):
-        return utils.kdtree_from_verts(self.char.data.vertices)
+    def geom(self):
+        return Geometry(self.verts, utils.mesh_polys(self.char.data))
 
     @utils.lazyproperty
-    def bvh(self):
-        return mathutils.bvhtree.BVHTree.FromPolygons(
-            [v.co for v in self.char.data.vertices],
-            [f.vertices for f in self.char.data.polygons])
+    def edges(self):
+        return utils.mesh_edges(self.char.data)
 
     @utils.lazyproperty
-    def emap(self):
-        result = {}
-        for edge in self.char.data.edges:
-            for vert in edge.vertices:
-                item = result.get(vert)
-                if item is None:
-                    item = []
-                    result[vert] = item
-                item.append(edge.index)
-        return result
+    def vg_full(self):
+        names, idx, weights = utils.vg_weights_to_arrays(self.char, lambda name: name.startswith("joint_"))
+        return {
+            name: (i, w.astype(numpy.float64))
+            for name, i, w in zip(names, idx, weights) if len(i) > 0
+        }
 
     @utils.lazyproperty
     def kd_joints(self):
@@ -205,7 +191,7 @@ class VGCalculator:
         kd = mathutils.kdtree.KDTree(len(all_groups))
         self.kdj_groups = []
         for name, group in all_groups.items():
-            co = vg_full_to_avg(group)
+            co = vg_full_to_avg(self.verts, group)
             if co is not None:
                 kd.insert(co, len(self.kdj_groups))
                 self.kdj_groups.append((name, group))
@@ -214,153 +200,22 @@ class VGCalculator:
 
     # Calc functions
 
-    def calc_bb(self, co):
-        lst = [(None, None, None) for _ in range(8)]
-        for idx, vert in enumerate(self.char.data.vertices):
-            vco = vert.co
-            for bv in range(8):
-                for coord in range(3):
-                    if bv >> coord & 1 != (1 if vco[coord] > co[coord] else 0):
-                        break
-                else:
-                    dist = sum(abs(vco[coord] - co[coord]) for coord in range(3))
-                    if lst[bv][2] is None or lst[bv][2] > dist:
-                        lst[bv] = (vco, idx, dist)
-                    break
-        for item in lst:
-            if item[0] is None:
-                return "Not all bbox points was found"
-
-        front_face = [item[0] for item in lst[:4]]
-        back_face = [item[0] for item in lst[4:]]
-
-        front_face[2], front_face[3] = front_face[3], front_face[2]
-        back_face[2], back_face[3] = back_face[3], back_face[2]
-
-        weights_front = barycentric_weight_calc(front_face, closest_point_on_face(front_face, co))
-        weights_back = barycentric_weight_calc(back_face, closest_point_on_face(back_face, co))
-
-        avg_front = sum((co * weight for co, weight in zip(front_face, weights_front)), mathutils.Vector())
-        avg_back = sum((co * weight for co, weight in zip(back_face, weights_back)), mathutils.Vector())
-        axis = avg_back - avg_front
-        offs = min(max((co - avg_front).dot(axis) / axis.dot(axis), 0), 1)
-
-        weights_front[2], weights_front[3] = weights_front[3], weights_front[2]
-        weights_back[2], weights_back[3] = weights_back[3], weights_back[2]
-
-        weights = [w * (1 - offs) for w in weights_front] + [w * offs for w in weights_back]
-
-        return {item[1]: weight for item, weight in zip(lst, weights)}
-
-    def calc_cu(self, co):
-        lst = self.vg_full.get(self.cur_name)
-        if lst is None or len(lst) == 0:
-            return "No vertices in current group"
-
-        if len(lst) > 256:
-            return "Too many vertices in current group"
-
-        # Solving travelling salesman problem by nearest neighbour algorithm
-        slst = [lst[0]]
-        co1 = lst[0][0]
-        lst = lst[1:]
-        while len(lst) > 0:
-            idx = 0
-            dist = (lst[0][0] - co1).length
-            for i, item in enumerate(lst[1:]):
-                dist2 = (item[0] - co1).length
-                if dist2 < dist:
-                    idx = i + 1
-                    dist = dist2
-            slst.append(lst[idx])
-            co1 = lst[idx][0]
-            del lst[idx]
-
-        return calc_lst(co, slst)
-
-    def calc_ne(self, co):
-        verts = self.char.data.vertices
-        edges = self.char.data.edges
-        lst = None
-        mindist = 1e30
-        for _, vert, _ in self.kd_verts.find_n(co, 32):
-            for edge in self.emap[vert]:
-                v1, v2 = tuple((verts[i].co, i) for i in edges[edge].vertices)
-                dist = dist_edge(co, v1[0], v2[0])
-                if dist < mindist:
-                    mindist = dist
-                    lst = [v1, v2]
-
-        return calc_lst(co, lst)
-
-    def calc_face(self, co, idx):
-        if idx is None:
-            return "Face not found"
-        verts = [(self.char.data.vertices[i].co, i) for i in self.char.data.polygons[idx].vertices]
-        if self.ui.vg_snap > 1e-30:
-            for co2, idx1 in verts:
-                if (co2 - co).length < self.ui.vg_snap:
-                    return {idx1: 1}
-
-            for i, (co2, idx2) in enumerate(verts):
-                co1, idx1 = verts[i - 1]
-                co3, p = mathutils.geometry.intersect_point_line(co, co1, co2)
-                if (co3 - co).length < self.ui.vg_snap and 0 <= p <= 1:
-                    return {idx1: 1 - p, idx2: p}
-
-        return calc_lst(co, verts)
-
-    def calc_nf(self, co):
-        co2, _, idx, _ = self.bvh.find_nearest(co)
-        return self.calc_face(co2, idx)
-
-    def calc_xl(self, co):
-        verts = self.kd_verts.find_n(co, self.ui.vg_xl_vn)
-        lns = []
-        for i in range(len(verts) - 1):
-            for j in range(i + 1, len(verts)):
-                co1 = verts[i][0]
-                co2 = verts[j][0]
-                co3, p = mathutils.geometry.intersect_point_line(co, co1, co2)
-                if p < 0 or p > 1:
-                    continue
-                d = (co3 - co).length
-                if d < (co2 - co1).length / 2:
-                    lns.append((verts[i][1], verts[j][1], d, p))
-
-        lns.sort(key=lambda tup: tup[2])
-        lns = lns[:self.ui.vg_xl_n]
-        if len(lns) == 0:
-            return "No cross lines found"
-
-        return vg_add({}, (tup for i, j, _, p in lns for tup in ((i, 1 - p), (j, p))))
-
-    def _cast_rays(self, co, d):
-        b = self.bvh
-        co1, _, idx1, _ = b.ray_cast(co, d)
-        co2, _, idx2, _ = b.ray_cast(co, -d)
-        if idx1 is None or idx2 is None:
-            return None
-        _, p = mathutils.geometry.intersect_point_line(co, co1, co2)
-        p = min(max(p, 0), 1)
-        return vg_mix2(self.calc_face(co1, idx1), self.calc_face(co2, idx2), p)
-
     def _calc_rays(self, co, callback):
         if not self.ui.vg_x and not self.ui.vg_y and not self.ui.vg_z:
-            return "No axes selected"
-        result = {}
-
-        def cast(d):
-            vg = self._cast_rays(co, d)
-            if vg is not None:
-                vg_add(result, vg)
-
-        callback(cast, co)
+            result = joint_vg.JointGroups(len(co))
+            result.fail(numpy.arange(len(co)), "No axes selected")
+            return result
 
-        if not result:
-            return "Ray cast failed"
+        rows = []
+        dirs = []
+        for i, co1 in enumerate(self._iter_joints(co)):
+            cnt = len(dirs)
+            callback(dirs.append, co1)
+            rows += [i] * (len(dirs) - cnt)
 
-        return result
+        return joint_vg.ray_pairs(
+            self.geom, co, numpy.array(rows, dtype=numpy.int64), numpy.array(dirs, dtype=numpy.float64).reshape(-1, 3),
+            self.ui.vg_snap)
 
     def _rays_bone(self, cast, _):
         def cast_perp(axis, y):
@@ -444,7 +299,7 @@ class VGCalculator:
 
         groups = (g for g in groups if g is not None)
         if is_nw:
-            groups = calc_group_weights(groups, co)
+            groups = calc_group_weights(self.verts, groups, co)
         else:
             groups = [(vg_full_to_dict(g), 1) for g in groups]
         if len(groups) < 2:
@@ -497,61 +352,42 @@ class VGCalculator:
             offsets = {k: v[0].tail - v[0].head for k, v in joints.items()}
 
         char = self.char
-        verts = char.data.vertices
+        self.cur_joints = list(joints.items())
+        names = [name for name, _ in self.cur_joints]
 
-        calc_func = self.get_calc_func()
-
-        for name, (bone, attr) in joints.items():
-            co = getattr(bone, attr)
-            self.cur_name = name
-            self.cur_bone = bone
-            self.cur_attr = attr
-
-            co1 = co.copy()
+        co = numpy.empty((len(names), 3))
+        for i, (name, (bone, attr)) in enumerate(self.cur_joints):
+            co1 = getattr(bone, attr).copy()
             if self.ui.vg_offs == "S":
                 co1 -= get_offs(bone, attr)
 
             if self.ui.vg_shift > 1e-6:
-                group = self.vg_full.get(name)
-                if group is not None:
-                    co2 = vg_full_to_avg(group)
-                    if co2 is not None:
-                        co1 += (co1 - co2) * self.ui.vg_shift
-
-            vg_data = calc_func(co1)
-            if isinstance(vg_data, str):
-                return name + ": " + vg_data
-
-            if self.ui.vg_mix < 1:
-                group = self.vg_full.get(name)
-                if group is not None:
-                    vg_mix2(vg_data, vg_full_to_dict(group), 1 - self.ui.vg_mix)
-
-            coeff = max(vg_data.values())
-            if coeff < 1e-30:
-                return name + ": empty vg returned"
-
-            coeff = 1 / coeff
-            co2 = mathutils.Vector()
-            wsum = 0.0
-
-            vg = overwrite_vg(char.vertex_groups, name)
+                co2 = vg_full_to_avg(self.verts, self.vg_full.get(name))
+                if co2 is not None:
+                    co1 += (co1 - co2) * self.ui.vg_shift
+            co[i] = co1
+
+        result = self.get_calc_func()(co)
+        if self.ui.vg_mix < 1:
+            result = result.mix(
+                joint_vg.JointGroups.from_groups([self.vg_full.get(name) for name in names]), 1 - self.ui.vg_mix)
+        result.normalize()
+        if result.errors:
+            i = min(result.errors)
+            return names[i] + ": " + result.errors[i]
+
+        centers = result.centers(self.verts)
+        for i, (name, (bone, attr)) in enumerate(self.cur_joints):
+            idx, weights = result.group(i)
+            # bone offsets are calculated from exact weights, so joint groups must not be quantized
+            utils.vg_add_bulk(overwrite_vg(char.vertex_groups, name), idx, weights, None)
             if self.ui.vg_widgets:
-                vgt = overwrite_vg(char.vertex_groups, "joint_" + bone.name + "_tail")
-
-            for idx, weight in vg_data.items():
-                weight *= coeff
-                vg.add([idx], weight, 'REPLACE')
-                if self.ui.vg_widgets:
-                    vgt.add([idx], weight, 'REPLACE')
-                co2 += verts[idx].co * weight
-                wsum += weight
-
-            co2 /= wsum
+                utils.vg_add_bulk(
+                    overwrite_vg(char.vertex_groups, "joint_" + bone.name + "_tail"), idx, weights, None)
 
             k = "charmorph_offs_" + attr
             if self.ui.vg_offs == "R":
-                offs = co - co2
+                offs = getattr(bone, attr) - mathutils.Vector(centers[i])
                 if offs.length >= self.ui.vg_snap:
                     bone[k] = list(offs)
                 elif k in bone:
@@ -563,6 +399,7 @@ class VGCalculator:
             if self.ui.vg_widgets:
                 bone["charmorph_offs_tail"] = get_offs(bone, "head") + offsets.get(name, mathutils.Vector())
 
+        utils.vg_changed(char)
         return True
 
 
@@ -90,11 +90,10 @@ def attach_scalp(char, obj):
 def create_scalp(name, char, vgi):
     vmap = {}
     verts = []
-    for mv, bv in zip(char.data.vertices, common.manager.get_basis(char)):
-        for g in mv.groups:
-            if g.group == vgi:
-                vmap[mv.index] = len(verts)
-                verts.append(bv)
+    basis = common.manager.get_basis(char)
+    for i in utils.read_vertex_groups(char).group(vgi)[0].tolist():
+        vmap[i] = len(verts)
+        verts.append(basis[i])
     edges = [(v1, v2) for v1, v2 in ((vmap.get(e.vertices[0]), vmap.get(e.vertices[1])) for e in char.data.edges) if v1 is not None and v2 is not None]
     faces = []
     for f in char.data.polygons:
@@ -154,12 +153,18 @@ def fit_all_hair(char):
     fitter = assets.get_fitter(char)
     has_fit = False
     has_fit |= fitter.fit_obj_hair(char)
-    for asset in fitter.get_assets():
-        has_fit |= fitter.fit_obj_hair(asset)
+    for afd in fitter.get_assets():
+        has_fit |= fitter.fit_obj_hair(afd.obj)
     t.time("hair_fit")
     return has_fit
 
 
+def do_refit_hair(_ui, _ctx):
+    obj = common.manager.morpher.core.obj
+    if obj:
+        fit_all_hair(obj)
+
+
 def make_scalp(obj, name):
     vg = obj.vertex_groups.get("scalp_" + name)
     if not vg:
@@ -361,6 +366,21 @@ class UIProps:
     hair_deform: bpy.props.BoolProperty(
         name="Live deform",
         description="Refit hair in real time (slower than clothing)")
+    hair_binding: bpy.props.EnumProperty(
+        name="Hair binding",
+        description="How hair follows the character",
+        default="FULL",
+        items=[
+            ("FULL", "Full", "Bind every hair point, most accurate"),
+            ("AFFINE", "Strand affine", "Bind a few points of every strand, strands can stretch and bend as a whole"),
+            ("RIGID", "Strand rigid", "Bind a few points of every strand, strands are only moved and rotated"),
+        ],
+        update=do_refit_hair)
+    hair_guides: bpy.props.IntProperty(
+        name="Guide points",
+        description="Count of bound points along every strand in addition to its root",
+        default=2, min=0, max=8,
+        update=do_refit_hair)
     hair_color: bpy.props.EnumProperty(
         name="Hair color",
         description="Hair color",
@@ -387,7 +407,8 @@ class CHARMORPH_PT_Hair(bpy.types.Panel):
         l = self.layout
         for prop in UIProps.__annotations__:  # pylint: disable=no-member
             if (prop == "hair_shrinkwrap" and not char.hair_shrinkwrap) or (
-                    prop == "hair_scalp" and char.force_hair_scalp):
+                    prop == "hair_scalp" and char.force_hair_scalp) or (
+                    prop == "hair_guides" and ui.hair_binding == "FULL"):
                 continue
             l.prop(ui, prop)
         l.operator("charmorph.hair_create")
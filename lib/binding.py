@@ -0,0 +1,670 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Binding calculation. This module doesn't use bpy, so bindings can be calculated in worker threads.
+
+import numpy
+
+from . import spatial
+from .pyutils import lazyproperty, array_digest
+
+dist_thresh = 0.125
+epsilon = 1e-30
+epsilon2 = 1e-15
+bigval = 1/epsilon
+
+# rough memory usage of a face list item
+face_nbytes = 96
+
+
+def row_counts(pos, cnt):
+    """Get entry count for every row of sparse matrix given row positions and total entry count"""
+    return numpy.diff(numpy.append(pos, cnt).astype(numpy.int64))
+
+
+def _row_entries(pos, cnt, rows):
+    """Get entry indices and positions of a sub-binding containing only specified rows"""
+    starts = pos[rows].astype(numpy.int64)
+    lengths = row_counts(pos, cnt)[rows]
+    new_pos = numpy.zeros(len(rows), dtype=numpy.int64)
+    numpy.cumsum(lengths[:-1], out=new_pos[1:])
+    entries = numpy.arange(lengths.sum()) + numpy.repeat(starts - new_pos, lengths)
+    return entries, new_pos
+
+
+class FitBinding(tuple):
+    __slots__ = ()
+
+    def __new__(cls, *args):
+        return super().__new__(cls, args)
+
+    def fit(self, arr: numpy.ndarray, is_weights=False):
+        for pos, idx, weights in self:
+            if is_weights:
+                weights = weights.reshape(-1)
+            arr = numpy.add.reduceat(arr[idx] * weights, pos)
+        return arr
+
+    def affected(self, changed: numpy.ndarray) -> numpy.ndarray:
+        """Get boolean mask of result rows that depend on changed source rows"""
+        for pos, idx, _ in self:
+            changed = numpy.logical_or.reduceat(changed[idx], pos)
+        return changed
+
+    def fit_rows(self, arr: numpy.ndarray, rows: numpy.ndarray):
+        """Same as fit(arr)[rows], but only needed rows are calculated. Rows must be sorted and unique"""
+        needed = [rows]
+        for pos, idx, _ in reversed(self[1:]):
+            entries, _ = _row_entries(pos, len(idx), needed[-1])
+            needed.append(numpy.unique(idx[entries]))
+        needed.reverse()
+
+        prev_rows = None
+        for (pos, idx, weights), cur_rows in zip(self, needed):
+            entries, sub_pos = _row_entries(pos, len(idx), cur_rows)
+            sub_idx = idx[entries]
+            if prev_rows is not None:
+                sub_idx = numpy.searchsorted(prev_rows, sub_idx)
+            arr = numpy.add.reduceat(arr[sub_idx] * weights[entries], sub_pos)
+            prev_rows = cur_rows
+        return arr
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for stage in self for arr in stage)
+
+    def digest(self):
+        return array_digest(*(arr for stage in self for arr in stage))
+
+    def matrix(self):
+        """Combine all binding stages into single sparse matrix"""
+        result = self[0]
+        for stage in self[1:]:
+            result = binding_from_coo(len(stage[0]), *csr_matmul(stage, result), cut=False, ufunc=numpy.add)
+        return result
+
+
+def strand_samples(cnts: numpy.ndarray, count: int):
+    """
+    Get rows of points evenly spaced along every non-empty strand, the first point is always included.
+    Strands are stored in flat array of points, cnts contains point count of every strand
+    """
+    cnts = numpy.asarray(cnts, dtype=numpy.int64)
+    starts = numpy.zeros(len(cnts), dtype=numpy.int64)
+    numpy.cumsum(cnts[:-1], out=starts[1:])
+    valid = cnts > 0
+    steps = numpy.linspace(0, 1, count) if count > 1 else numpy.zeros(1)
+    return starts[valid, None] + numpy.rint(steps * (cnts[valid, None] - 1)).astype(numpy.int64)
+
+
+class StrandBinding:
+    """
+    Hair binding where only a few sample points of every strand are bound to the character.
+    All points of a strand follow a rigid or affine transform estimated from its samples,
+    so the binding is much smaller than binding of every point.
+    """
+
+    # transforms are regularized towards identity, it keeps them stable for straight strands and single samples
+    regularization = 1e-2
+
+    def __init__(self, fit_binding: FitBinding, cnts: numpy.ndarray, data: numpy.ndarray,
+                 samples: numpy.ndarray, rigid=True):
+        self.binding = fit_binding
+        self.rigid = rigid
+        self.data = data
+        cnts = numpy.asarray(cnts, dtype=numpy.int64)
+        self.counts = cnts[cnts > 0]
+        self.nsamples = samples.shape[1]
+
+        x = data[samples]
+        self.center = x.mean(axis=1)
+        self.xc = x - self.center[:, None]
+        cxx = numpy.einsum("sgi,sgj->sij", self.xc, self.xc)
+        self.reg = self.regularization * numpy.trace(cxx, axis1=1, axis2=2) / 3 + epsilon2
+        cxx += self.reg[:, None, None] * numpy.eye(3)
+        self.cxx_inv = numpy.linalg.inv(cxx)
+
+    @property
+    def nbytes(self):
+        return self.binding.nbytes + sum(arr.nbytes for arr in (
+            self.counts, self.center, self.xc, self.reg, self.cxx_inv))
+
+    def transforms(self, arr: numpy.ndarray):
+        """Get linear part and new centers of strand transforms"""
+        y = self.xc + self.binding.fit(arr).reshape(len(self.xc), self.nsamples, 3)
+        center = self.center + y.mean(axis=1)
+        y -= y.mean(axis=1)[:, None]
+        cyx = numpy.einsum("sgi,sgj->sij", y, self.xc)
+        cyx += self.reg[:, None, None] * numpy.eye(3)
+        mat = numpy.matmul(cyx, self.cxx_inv)
+        if self.rigid:
+            u, _, vt = numpy.linalg.svd(mat)
+            u[:, :, 2] *= numpy.sign(numpy.linalg.det(numpy.matmul(u, vt)))[:, None]
+            mat = numpy.matmul(u, vt)
+        return mat, center
+
+    def fit(self, arr: numpy.ndarray):
+        """Get displacement of all strand points like FitBinding.fit()"""
+        mat, center = self.transforms(arr)
+        result = self.data - numpy.repeat(self.center, self.counts, axis=0)
+        result = numpy.einsum("pij,pj->pi", numpy.repeat(mat, self.counts, axis=0), result)
+        result += numpy.repeat(center, self.counts, axis=0)
+        result -= self.data
+        return result
+
+
+class Geometry:
+    def __init__(self, verts: numpy.ndarray, faces: list):
+        self.verts = verts
+        self.faces = faces
+
+    def copy(self):
+        return Geometry(self.verts, self.faces)
+
+    def verts_cnt(self):
+        return len(self.verts)
+
+    def verts_enum(self):
+        return enumerate(self.verts)
+
+    def verts_filter_set(self, _vset):
+        pass
+
+    def verts_filter(self, idx: numpy.ndarray):
+        return idx
+
+    @lazyproperty
+    def polys(self):
+        return spatial.polygons(self.faces)
+
+    def digest(self):
+        return array_digest(self.verts, self.polys)
+
+    @lazyproperty
+    def ptree(self):
+        return spatial.PointTree(self.verts)
+
+    @lazyproperty
+    def tree(self):
+        return spatial.TriTree(self.verts, self.polys)
+
+    @lazyproperty
+    def bbox(self):
+        return self.verts.min(axis=0), self.verts.max(axis=0)
+
+    # approximate memory usage including search structures that are already built
+    @property
+    def nbytes(self):
+        result = self.verts.nbytes + len(self.faces) * face_nbytes
+        d = self.__dict__
+        for name in ("polys", "ptree", "tree"):
+            if name in d:
+                result += d[name].nbytes
+        return result
+
+    # build search structures beforehand so worker threads don't do it concurrently
+    def prepare(self):
+        return self.ptree, self.tree
+
+
+class SubsetGeometry(Geometry):
+    def __init__(self, verts, faces, subset):
+        super().__init__(verts, faces)
+        self.subset = subset
+
+    def copy(self):
+        return SubsetGeometry(self.verts, self.faces, self.subset)
+
+    def verts_cnt(self):
+        return len(self.subset)
+
+    def verts_enum(self):
+        return ((i, self.verts[i]) for i in self.subset)
+
+    def verts_filter_set(self, vset: set):
+        vset.intersection_update(self.subset)
+
+    def verts_filter(self, idx: numpy.ndarray):
+        return numpy.intersect1d(idx, self.subset, assume_unique=True)
+
+    @lazyproperty
+    def ptree(self):
+        subset = numpy.asarray(self.subset, dtype=numpy.int64)
+        return spatial.PointTree(self.verts[subset], subset)
+
+
+def coo_reduce(rows, cols, vals, ufunc=numpy.maximum):
+    """Merge duplicate (row, col) entries of sparse matrix, result is sorted by row and col"""
+    order = numpy.lexsort((cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+    vals = vals[order]
+    if len(rows) == 0:
+        return rows, cols, vals
+    start = numpy.ones(len(rows), dtype=bool)
+    start[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    start = start.nonzero()[0]
+    return rows[start], cols[start], ufunc.reduceat(vals, start)
+
+
+def binding_from_coo(nrows, rows, cols, vals, cut=True, ufunc=numpy.maximum):
+    """Convert sparse binding matrix to (positions, idx, weights) triple, every row must be non-empty"""
+    rows, cols, vals = coo_reduce(rows, cols, vals, ufunc)
+    positions = numpy.searchsorted(rows, numpy.arange(nrows)).astype(numpy.uint32)
+    if cut:
+        thresh = numpy.maximum.reduceat(vals, positions) / 32
+        mask = vals >= thresh[rows]
+        rows = rows[mask]
+        cols = cols[mask]
+        vals = vals[mask]
+        positions = numpy.searchsorted(rows, numpy.arange(nrows)).astype(numpy.uint32)
+    return positions, cols.astype(numpy.uint32), vals
+
+
+def csr_matmul(a, b):
+    """Multiply two sparse matrices in (positions, idx, weights) format, result is returned in COO format"""
+    a_pos, a_idx, a_val = a
+    b_pos, b_idx, b_val = b
+    rows = numpy.arange(len(a_pos)).repeat(row_counts(a_pos, len(a_idx)))
+    entries, _ = _row_entries(b_pos, len(b_idx), a_idx)
+    cnt = row_counts(b_pos, len(b_idx))[a_idx]
+    return rows.repeat(cnt), b_idx[entries], a_val.reshape(-1).repeat(cnt) * b_val.reshape(-1)[entries]
+
+
+def groups_to_csr(nrows, groups):
+    """Convert (name, idx, weights) vertex groups to sparse vertex x group matrix"""
+    names = []
+    rows = []
+    cols = []
+    vals = []
+    for name, idx, weights in groups:
+        cols.append(numpy.full(len(idx), len(names), dtype=numpy.uint32))
+        names.append(name)
+        rows.append(numpy.asarray(idx, dtype=numpy.int64))
+        vals.append(numpy.asarray(weights, dtype=numpy.float64).reshape(-1))
+    if not names:
+        return names, None
+    return names, binding_from_coo(
+        nrows, numpy.concatenate(rows), numpy.concatenate(cols), numpy.concatenate(vals), cut=False)
+
+
+class VGroups(list):
+    """List of (name, idx, weights) vertex groups with content digest and memory accounting for caching"""
+
+    def __init__(self, groups=(), digest=None):
+        super().__init__(groups)
+        self._digest = digest
+
+    @property
+    def names(self):
+        return [name for name, _, _ in self]
+
+    @property
+    def nbytes(self):
+        return sum(numpy.asarray(idx).nbytes + numpy.asarray(weights).nbytes for _, idx, weights in self)
+
+    def digest(self):
+        if self._digest is None:
+            self._digest = array_digest(
+                numpy.frombuffer("\0".join(self.names).encode("utf-8"), dtype=numpy.uint8),
+                *(arr for _, idx, weights in self for arr in (idx, weights)))
+        return self._digest
+
+
+def transfer_weights(fit_binding: FitBinding, nverts: int, groups, cutoff=1e-4):
+    """
+    Transfer vertex groups through the binding as a single sparse product
+    of asset x character binding matrix and character x group weights matrix.
+    Yields (name, idx, weights) for every non-empty resulting group.
+    """
+    names, weights = groups_to_csr(nverts, groups)
+    if not names:
+        return
+    rows, cols, vals = coo_reduce(*csr_matmul(fit_binding.matrix(), weights), ufunc=numpy.add)
+    mask = vals > cutoff
+    order = numpy.argsort(cols[mask], kind="stable")
+    rows = rows[mask][order]
+    cols = cols[mask][order]
+    vals = vals[mask][order]
+    starts = numpy.searchsorted(cols, numpy.arange(len(names) + 1))
+    for i, name in enumerate(names):
+        if starts[i] < starts[i + 1]:
+            yield name, rows[starts[i]:starts[i + 1]], vals[starts[i]:starts[i + 1]]
+
+
+class VGMatrix:
+    """Vertex x group weight matrix in (positions, group indices, weights) format with group names"""
+    __slots__ = "names", "pos", "cols", "weights", "_by_group"
+
+    def __init__(self, names: list, pos: numpy.ndarray, cols: numpy.ndarray, weights: numpy.ndarray):
+        self.names = names
+        self.pos = pos
+        self.cols = cols
+        self.weights = weights
+        self._by_group = None
+
+    @classmethod
+    def from_counts(cls, names: list, cnt: numpy.ndarray, cols: numpy.ndarray, weights: numpy.ndarray):
+        """Create from group entry count of every vertex and flat arrays of group entries"""
+        pos = numpy.zeros(len(cnt), dtype=numpy.int64)
+        numpy.cumsum(cnt[:-1], out=pos[1:])
+        return cls(names, pos, cols, weights)
+
+    @property
+    def nverts(self):
+        return len(self.pos)
+
+    @property
+    def nbytes(self):
+        result = self.pos.nbytes + self.cols.nbytes + self.weights.nbytes
+        if self._by_group is not None:
+            result += sum(a.nbytes for a in self._by_group)
+        return result
+
+    def by_group(self):
+        """Entries sorted by group: (group starts, vertex indices, weights)"""
+        if self._by_group is None:
+            order = numpy.argsort(self.cols, kind="stable")
+            rows = numpy.arange(self.nverts).repeat(row_counts(self.pos, len(self.cols)))
+            starts = numpy.searchsorted(self.cols[order], numpy.arange(len(self.names) + 1))
+            self._by_group = starts, rows[order], self.weights[order]
+        return self._by_group
+
+    def group_index(self, name):
+        try:
+            return self.names.index(name)
+        except ValueError:
+            return None
+
+    def group(self, group):
+        """Get (vertex indices, weights) of group given by name or index, None if group doesn't exist"""
+        if isinstance(group, str):
+            group = self.group_index(group)
+            if group is None:
+                return None
+        starts, rows, weights = self.by_group()
+        return rows[starts[group]:starts[group + 1]], weights[starts[group]:starts[group + 1]]
+
+    def groups(self, name_filter=None):
+        """Get (names, vertex indices, weights) lists of groups accepted by name_filter"""
+        names = []
+        idx = []
+        weights = []
+        for i, name in enumerate(self.names):
+            if name_filter is None or name_filter(name):
+                names.append(name)
+                gi, gw = self.group(i)
+                idx.append(gi)
+                weights.append(gw)
+        return names, idx, weights
+
+    def column(self, group):
+        """Dense weights of the group for all vertices"""
+        result = numpy.zeros(self.nverts, dtype=self.weights.dtype)
+        g = self.group(group)
+        if g is not None:
+            result[g[0]] = g[1]
+        return result
+
+    def dense(self):
+        """Dense vertex x group weight and membership matrices"""
+        rows = numpy.arange(self.nverts).repeat(row_counts(self.pos, len(self.cols)))
+        w = numpy.zeros((self.nverts, len(self.names)), dtype=self.weights.dtype)
+        member = numpy.zeros((self.nverts, len(self.names)), dtype=bool)
+        w[rows, self.cols] = self.weights
+        member[rows, self.cols] = True
+        return w, member
+
+
+class JointRegressor:
+    """
+    Sparse joints x vertices matrix with weights normalized for every joint,
+    positions of all joints are calculated with a single product with vertex array
+    """
+    __slots__ = "names", "pos", "idx", "weights"
+
+    def __init__(self, names: list, pos: numpy.ndarray, idx: numpy.ndarray, weights: numpy.ndarray):
+        self.names = names
+        self.pos = pos
+        self.idx = idx
+        self.weights = weights
+
+    @classmethod
+    def from_groups(cls, groups):
+        """Compile joint_* groups from (name, idx, weights) vertex groups, groups with zero weight are skipped"""
+        names = []
+        idx = []
+        weights = []
+        for name, gidx, gweights in groups:
+            if not name.startswith("joint_"):
+                continue
+            gweights = numpy.asarray(gweights, dtype=numpy.float64).reshape(-1)
+            total = gweights.sum()
+            if total < 1e-10:
+                continue
+            names.append(name)
+            idx.append(numpy.asarray(gidx, dtype=numpy.uint32).reshape(-1))
+            weights.append(gweights / total)
+        pos = numpy.zeros(len(names), dtype=numpy.uint32)
+        if names:
+            numpy.cumsum([len(i) for i in idx[:-1]], out=pos[1:])
+            return cls(names, pos, numpy.concatenate(idx), numpy.concatenate(weights))
+        return cls(names, pos, numpy.empty(0, dtype=numpy.uint32), numpy.empty(0))
+
+    @classmethod
+    def load(cls, file):
+        with numpy.load(file) as z:
+            names = bytes(z["names"]).split(b"\0") if len(z["pos"]) else []
+            return cls([n.decode("utf-8") for n in names], z["pos"], z["idx"], z["weights"])
+
+    def save(self, file):
+        numpy.savez(file, names=b"\0".join(name.encode("utf-8") for name in self.names),
+                    pos=self.pos, idx=self.idx, weights=self.weights)
+
+    @property
+    def nbytes(self):
+        return self.pos.nbytes + self.idx.nbytes + self.weights.nbytes
+
+    def positions(self, verts: numpy.ndarray) -> numpy.ndarray:
+        """Get positions of all joints as array in order of names"""
+        if not self.names:
+            return numpy.empty((0, 3))
+        return numpy.add.reduceat(verts[self.idx] * self.weights[:, None], self.pos)
+
+
+def binding_normalize(positions, wresult):
+    cnt = numpy.empty((len(positions)), dtype=numpy.uint32)
+    cnt[:-1] = positions[1:]
+    cnt[:-1] -= positions[:-1]
+    cnt[-1] = len(wresult) - positions[-1]
+    wresult /= numpy.add.reduceat(wresult, positions).repeat(cnt)
+
+
+class SoftBinder:
+    dists_asset: numpy.ndarray
+    revset: numpy.ndarray
+
+    def __init__(self, char_geom: Geometry, asset_verts: numpy.ndarray):
+        self.char_geom = char_geom
+        self.asset_verts = asset_verts
+        self.rows = []
+        self.cols = []
+        self.vals = []
+
+    def add(self, rows, cols, vals):
+        self.rows.append(rows)
+        self.cols.append(cols)
+        self.vals.append(vals)
+
+    def add_poly_weights(self, geom: Geometry, rows, face, loc, coeff):
+        prow, vi, bw = spatial.poly_weights_flat(geom.verts, geom.polys, face, loc)
+        return rows[prow], vi, bw * coeff[prow]
+
+    def calc_binding_kd(self):
+        idx, dists = self.char_geom.ptree.find_n(self.asset_verts, 16)
+        mindist = dists[:, 0]
+        maxdist = dists[:, -1]
+        close = mindist < epsilon2
+        self.dists_asset = numpy.where(close, -1, mindist)
+        self.revset = numpy.unique(idx[~close])
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            weights = (1 - (dists / maxdist[:, None])) / numpy.maximum(dists, epsilon)
+        weights[close] = bigval
+        mask = ~close[:, None] | (dists < epsilon2)
+        rows = numpy.broadcast_to(numpy.arange(len(idx))[:, None], idx.shape)
+        self.add(rows[mask], idx[mask], weights[mask])
+
+    # calculate binding based on distance from asset vertices to character faces
+    def calc_binding_direct(self):
+        if self.dists_asset.max() < epsilon2:
+            return
+        sel = (self.dists_asset >= epsilon2).nonzero()[0]
+        bdist = self.dists_asset[sel] * 0.75
+        q, loc, face, fdist = self.char_geom.tree.find_nearest_range(self.asset_verts[sel], bdist)
+        rows = sel[q]
+        numpy.minimum.at(self.dists_asset, rows, fdist)
+        coeff = (1 - fdist / bdist[q]) / numpy.maximum(fdist, epsilon)
+        self.add(*self.add_poly_weights(self.char_geom, rows, face, loc, coeff))
+
+    def calc_binding_reverse(self, asset_geom: Geometry):
+        dthresh = min(self.dists_asset.max(), dist_thresh)
+        if dthresh < epsilon2:
+            return
+        revset = self.char_geom.verts_filter(self.revset)
+        loc, face, fdist = asset_geom.tree.find_nearest(self.char_geom.verts[revset], dthresh)
+        hit = (face >= 0).nonzero()[0]
+        fdist = fdist[hit]
+        coeff = (1 - fdist / dthresh) / numpy.maximum(fdist, epsilon2)
+        prow, vi, bw = spatial.poly_weights_flat(asset_geom.verts, asset_geom.polys, face[hit], loc[hit])
+        mask = self.dists_asset[vi] > fdist[prow]
+        self.add(vi[mask], revset[hit[prow[mask]]], (bw * coeff[prow])[mask])
+
+    def initial_bind(self, t):
+        self.calc_binding_kd()
+        t.time("kdtree")
+        self.calc_binding_direct()
+        t.time("bvh direct")
+
+    def get_binding(self):
+        rows = numpy.concatenate(self.rows)
+        cols = numpy.concatenate(self.cols)
+        vals = numpy.maximum(numpy.concatenate(self.vals), 0)
+        positions, idx, wresult = binding_from_coo(len(self.asset_verts), rows, cols, vals)
+        binding_normalize(positions, wresult)
+        return positions, idx, wresult.reshape(-1, 1)
+
+
+class HardBinder(SoftBinder):
+    # calculate binding based on distance from asset vertices to character faces
+    def calc_binding_direct(self):
+        loc, face, fdist = self.char_geom.tree.find_nearest(self.asset_verts)
+        rows = (face >= 0).nonzero()[0]
+        self.dists_asset = fdist
+        rows, vi, bw = self.add_poly_weights(
+            self.char_geom, rows, face[rows], loc[rows], 1 / numpy.maximum(fdist[rows], epsilon))
+        self.revset = numpy.unique(vi)
+        self.add(rows, vi, bw)
+
+    def calc_binding_kd(self):
+        sel = (self.dists_asset >= epsilon2).nonzero()[0]
+        fdist = self.dists_asset[sel]
+        fdist = numpy.minimum(fdist * 1.5, fdist + dist_thresh)
+        # only up to 24 nearest points in range are used, so there is no need to find all of them
+        idx, dist = self.char_geom.ptree.find_n(self.asset_verts[sel], 24)
+        inside = dist <= fdist[:, None]
+        inside[inside.sum(1) < 2] = False
+        q, col = inside.nonzero()
+        idx = idx[q, col]
+        r = fdist[q]
+        coeff = 2 / (r - dist[q, 0])
+        dist = dist[q, col]
+        self.revset = numpy.union1d(self.revset, idx)
+        self.add(sel[q], idx, (r - dist) * coeff / numpy.maximum(dist, epsilon))
+
+    def initial_bind(self, t):
+        self.calc_binding_direct()
+        t.time("bvh direct")
+        self.calc_binding_kd()
+        t.time("kdtree")
+
+
+def calc_binding_rigger(char_geom: Geometry, asset_geom: Geometry, t=None):
+    """
+    Binding for joint transfer to alternative topology. Unlike fitting bindings, weights aren't cut or normalized,
+    and every character vertex is mapped to the new topology to keep all joints.
+    """
+    if t is None:
+        t = _NoTimer()
+    nrows = len(asset_geom.verts)
+    char_idx = char_geom.verts_filter(numpy.arange(len(char_geom.verts)))
+
+    # weights based on nearest character vertices
+    idx, dists = char_geom.ptree.find_n(asset_geom.verts, 16)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        weights = (1 - dists / dists[:, -1:]) / numpy.maximum(dists, 1e-5)
+    rows = [numpy.arange(nrows).repeat(idx.shape[1])]
+    cols = [idx.reshape(-1)]
+    vals = [weights.reshape(-1)]
+    t.time("rigger kd")
+
+    # every character vertex must be mapped to the new topology
+    idx, dists = asset_geom.ptree.find_n(char_geom.verts[char_idx], 4)
+    rows.append(idx.reshape(-1))
+    cols.append(char_idx.repeat(idx.shape[1]))
+    vals.append((1 / numpy.maximum(dists ** 2, 1e-5)).reshape(-1))
+    t.time("rigger kd reverse")
+
+    # weights based on distance from character vertices to asset faces
+    loc, face, fdist = asset_geom.tree.find_nearest(char_geom.verts[char_idx], dist_thresh)
+    hit = (face >= 0).nonzero()[0]
+    fdist = fdist[hit]
+    coeff = (1 - fdist / dist_thresh) / numpy.maximum(fdist, epsilon2)  # using lower epsilon to avoid some artifacts
+    prow, vi, bw = spatial.poly_weights_flat(asset_geom.verts, asset_geom.polys, face[hit], loc[hit])
+    rows.append(vi)
+    cols.append(char_idx[hit[prow]])
+    vals.append(bw * coeff[prow])
+    t.time("rigger reverse")
+
+    result = binding_from_coo(
+        nrows, numpy.concatenate(rows), numpy.concatenate(cols), numpy.concatenate(vals), False, numpy.add)
+    t.time("rigger finalize")
+    return result
+
+
+binders = {
+    "SOFT": SoftBinder,
+    "HARD": HardBinder,
+}
+
+
+class _NoTimer:
+    def time(self, _):
+        pass
+
+
+def calc_binding(binder: str, char_geom: Geometry, asset_verts: numpy.ndarray, asset_geom: Geometry = None, t=None):
+    if t is None:
+        t = _NoTimer()
+    b = binders.get(binder, SoftBinder)(char_geom, asset_verts)
+    b.initial_bind(t)
+    if asset_geom:
+        b.calc_binding_reverse(asset_geom)
+        t.time("bvh reverse")
+    result = b.get_binding()
+    t.time("finalize")
+    return result
@@ -22,7 +22,8 @@ import os, json, collections, logging, traceback, numpy
 
 import bpy  # pylint: disable=import-error
 
-from . import morphs, utils, xml_base_mesh
+from . import binding, morphs, utils, xml_base_mesh
+from .manifest import Manifest
 
 logger = logging.getLogger(__name__)
 
@@ -53,8 +54,14 @@ def load_json_dir(path):
 _empty_dict = object()
 
 
+def _load_yaml_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return utils.load_yaml(f)
+
+
 class DataDir:
     dirpath: str = ""
+    manifest: Manifest = None
 
     def __init__(self, dirpath: str):
         self.dirpath = dirpath
@@ -69,6 +76,8 @@ class DataDir:
             default = {}
         if not self:
             return default
+        if self.manifest is not None:
+            return self.manifest.parse(self.path(file), _load_yaml_file, default)
         return utils.parse_file(self.path(file), utils.load_yaml, default)
 
     def get_np(self, file, readonly=True):
@@ -117,7 +126,7 @@ class Character(DataDir):
         self.lib = lib
         self.title = name
         self.name = name
-        self.__dict__.update(self.get_yaml("config.yaml"))
+        self.__dict__.update(lib.get_yaml(os.path.join("characters", name, "config.yaml")))
         self.name = name
         self.pack_cache = {}
 
@@ -149,7 +158,8 @@ class Character(DataDir):
     def xml_base_mesh(self):
         if not self.xml_base_mesh_id:
             return None
-        return self.lib.base_meshes.get(self.xml_base_mesh_id)
+        header = self.lib.base_meshes.get(self.xml_base_mesh_id)
+        return header.load() if header else None
 
     @utils.lazyproperty
     def fitting_subset(self):
@@ -292,6 +302,11 @@ class Asset(DataDir):
         return morphs.load_noext(self.path("morph"))
 
 
+# Directory scanning is bound by file system latency rather than CPU,
+# so more threads than CPU cores are useful for libraries on network drives
+scan_workers = 16
+
+
 def get_asset(asset_dir: str, name: str):
     path = os.path.join(asset_dir, name)
     if os.path.isdir(path):
@@ -308,8 +323,8 @@ def load_assets_dir(path: str):
     result: dict[str, Asset] = {}
     if not os.path.isdir(path):
         return result
-    for item in sorted(os.listdir(path)):
-        asset = get_asset(path, item)
+    t = utils.Timer()
+    for asset in utils.parallel_map(lambda item: get_asset(path, item), sorted(os.listdir(path)), scan_workers):
         if asset:
             result[asset.name] = asset
     item = os.path.join(path, "authors.yaml")
@@ -321,6 +336,7 @@ def load_assets_dir(path: str):
                 asset = result.get(name)
                 if asset:
                     asset.__dict__.update(yaml)
+    t.time(f"Assets scan {path}, {len(result)} assets")
     return result
 
 
@@ -349,6 +365,40 @@ def _lazy_yaml_props(*prop_lst):
     return modify_class
 
 
+_joint_regressors: dict[str, tuple[float, binding.JointRegressor]] = {}
+
+
+def joint_regressor(file: str) -> binding.JointRegressor:
+    """
+    Get joint regressor compiled from joints npz file.
+    It's cached in memory and in .regressor.npz file next to the joints file, the file cache is rebuilt
+    when joints file is newer. Library directory can be read-only, then only memory cache is used.
+    """
+    if not file or not os.path.isfile(file):
+        return binding.JointRegressor.from_groups(())
+    mtime = os.path.getmtime(file)
+    item = _joint_regressors.get(file)
+    if item and item[0] == mtime:
+        return item[1]
+
+    cache = os.path.splitext(file)[0] + ".regressor.npz"
+    result = None
+    if os.path.isfile(cache) and os.path.getmtime(cache) >= mtime:
+        try:
+            result = binding.JointRegressor.load(cache)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Invalid joint regressor cache %s: %s", cache, e)
+    if result is None:
+        result = binding.JointRegressor.from_groups(utils.vg_read(file))
+        try:
+            result.save(cache)
+        except OSError as e:
+            logger.debug("Can't save joint regressor cache %s: %s", cache, e)
+
+    _joint_regressors[file] = (mtime, result)
+    return result
+
+
 def parse_joints(joints, d: DataDir):
     if isinstance(joints, dict):
         joints = (joints,)
@@ -410,20 +460,25 @@ class Armature:
     def joints(self):
         return list(utils.vg_read(self.joints_file))
 
-    @utils.lazyproperty
+    @property
     def weights_npz(self):
-        return self.parent.get_np(self.weights)
+        return utils.read_weights_file(self.weights)
 
 
 empty_char = Character("", DataDir(""))
 
 
+def _base_mesh_header(path):
+    header = xml_base_mesh.read_header(path)
+    return {"name": header.name, "version": header.version, "metadata": header.metadata, "unit": header.unit}
+
+
 class Library(DataDir):
     chars: dict[str, Character]
     char_aliases: dict[str, str]
     additional_assets: dict[str, Asset]
     hair_colors: dict[str, dict] = {}
-    base_meshes: dict[str, xml_base_mesh.BaseMesh]
+    base_meshes: dict[str, xml_base_mesh.BaseMeshHeader]
 
     def __init__(self, dirpath):
         super().__init__(dirpath)
@@ -443,13 +498,37 @@ class Library(DataDir):
     def update_additional_assets(self, path):
         self.additional_assets = load_assets_dir(path)
 
+    def _load_base_meshes(self):
+        result = {}
+        path = self.path("base_meshes")
+        if not os.path.isdir(path):
+            return result
+        files = [os.path.join(path, entry) for entry in sorted(os.listdir(path)) if entry.lower().endswith(".xml")]
+        headers = utils.parallel_map(lambda file: self.manifest.parse(file, _base_mesh_header), files, scan_workers)
+        for file, header in zip(files, headers):
+            if header:
+                result[header["name"]] = xml_base_mesh.BaseMeshHeader(path=file, **header)
+        return result
+
     def load(self):
         t = utils.Timer()
         logger.debug("Loading character library at %s", self.dirpath)
         if not os.path.isdir(self.dirpath):
             logger.error("Charmorph data is not found at %s", self.dirpath)
+        self.manifest = Manifest(self.dirpath, self.path(".manifest")).load()
+        if self.dirpath:
+            utils.yaml_cache.attach(self.path(".yaml_cache"), self.dirpath)
+        try:
+            self._load()
+            self.manifest.save()
+            utils.yaml_cache.save(False)
+            t.time(f"Library load, manifest: {self.manifest.stats()}, yaml cache: {utils.yaml_cache.stats()}")
+        finally:
+            self.manifest = None
+
+    def _load(self):
         self.chars.clear()
-        self.base_meshes = xml_base_mesh.load_dir(self.path("base_meshes"))
+        self.base_meshes = self._load_base_meshes()
         self.hair_colors = self.get_yaml("hair_colors.yaml")
         aliases = self.get_yaml("characters/aliases.yaml")
         self.char_aliases.clear()
@@ -462,23 +541,25 @@ class Library(DataDir):
             logger.error("Directory %s is not found.", format(chardir))
             return
 
-        for char_name in sorted(os.listdir(chardir)):
-            if not os.path.isdir(os.path.join(chardir, char_name)):
-                continue
-            try:
-                char = Character(char_name, self)
-            except Exception as e:
-                logger.error("Error in character %s: %s", char_name, e)
-                logger.error(traceback.format_exc())
-                continue
-
-            if not os.path.isfile(char.blend_file()):
-                logger.error("Character %s doesn't have char file %s.", char_name, char.blend_file())
-                continue
+        names = sorted(os.listdir(chardir))
+        for char in utils.parallel_map(lambda name: self._load_char(chardir, name), names, scan_workers):
+            if char:
+                self.chars[char.name] = char
 
-            self.chars[char_name] = char
+    def _load_char(self, chardir, char_name):
+        if not os.path.isdir(os.path.join(chardir, char_name)):
+            return None
+        try:
+            char = Character(char_name, self)
+        except Exception as e:
+            logger.error("Error in character %s: %s", char_name, e)
+            logger.error(traceback.format_exc())
+            return None
 
-        t.time("Library load")
+        if not os.path.isfile(char.blend_file()):
+            logger.error("Character %s doesn't have char file %s.", char_name, char.blend_file())
+            return None
+        return char
 
 
 library = Library(os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "data")))
@@ -0,0 +1,259 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Fast loader for the yaml subset used in CharMorph configs: block mappings and sequences,
+# single line flow collections, plain and simple quoted scalars. Results are the same as
+# with yaml SafeLoader, anything outside of the subset raises Unsupported and should be
+# loaded with the full loader. Doesn't depend on bpy.
+
+import re
+
+# Line breaks other than \n, non-printable characters, tabs and BOM are left for the full loader
+_unsupported_chars = re.compile(
+    "[^\x0A\x20-\x7E\xA0-\u2027\u202A-\uD7FF\uE000-\uFEFE\uFF00-\uFFFD\U00010000-\U0010ffff]")
+
+_key = re.compile(r"""('(?:[^']|'')*'|"[^"\\]*"|[^\s'"\[\]{},#&*!|>%@`?:-][^:#]*?|-[^\s:#][^:#]*?) *:(?: +|$)""")
+_single = re.compile(r"'((?:[^']|'')*)'")
+_double = re.compile(r'"([^"\\]*)"')
+_flow_plain = re.compile(r"""[^\s\[\]{},:#'"&*!|>%@`?][^\[\]{},:#]*""")
+_comment = re.compile(r" *(?:#.*)?\Z")
+
+_int = re.compile(r"[-+]?(?:0|[1-9][0-9]*)\Z")
+_float = re.compile(r"(?:[-+]?[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][-+][0-9]+)?\Z")
+_constants = {
+    "~": None, "null": None, "Null": None, "NULL": None,
+    "yes": True, "Yes": True, "YES": True, "true": True, "True": True, "TRUE": True, "on": True, "On": True, "ON": True,
+    "no": False, "No": False, "NO": False, "false": False, "False": False, "FALSE": False,
+    "off": False, "Off": False, "OFF": False,
+}
+# First characters of plain scalars that can resolve to something not handled here
+_numeric_start = frozenset("-+.0123456789")
+_special_start = frozenset("<=")
+
+
+class Unsupported(Exception):
+    pass
+
+
+def resolve(value: str):
+    """Resolve plain scalar the same way as yaml SafeLoader does"""
+    if value in _constants:
+        return _constants[value]
+    c = value[0]
+    if c in _numeric_start:
+        if _int.match(value):
+            return int(value)
+        if _float.match(value):
+            return float(value)
+        raise Unsupported(value)
+    if c in _special_start:
+        raise Unsupported(value)
+    return value
+
+
+def _is_seq_item(content):
+    return content == "-" or content.startswith("- ")
+
+
+def _quoted(m):
+    if m.re is _single:
+        return m.group(1).replace("''", "'")
+    return m.group(1)
+
+
+def _key_value(text):
+    if text[0] == "'":
+        return _single.fullmatch(text).group(1).replace("''", "'")
+    if text[0] == '"':
+        return text[1:-1]
+    return resolve(text)
+
+
+def _skip_spaces(text, pos):
+    while pos < len(text) and text[pos] == " ":
+        pos += 1
+    return pos
+
+
+class _Parser:
+    def __init__(self, lines):
+        self.lines = lines
+        self.i = 0
+
+    def document(self):
+        if not self.lines:
+            return None
+        result = self.node(self.lines[0][0])
+        if self.i < len(self.lines):
+            raise Unsupported("unexpected dedent")
+        return result
+
+    def node(self, indent):
+        content = self.lines[self.i][1]
+        if _is_seq_item(content):
+            return self.sequence(indent)
+        if _key.match(content):
+            return self.mapping(indent)
+        raise Unsupported(content)
+
+    def block(self, parent_indent):
+        """Node nested in the parent, None if the next line isn't indented more"""
+        if self.i < len(self.lines) and self.lines[self.i][0] > parent_indent:
+            return self.node(self.lines[self.i][0])
+        return None
+
+    def check_end(self, indent):
+        if self.i < len(self.lines) and self.lines[self.i][0] > indent:
+            raise Unsupported("multiline scalar")
+
+    def sequence(self, indent):
+        lines = self.lines
+        result = []
+        while self.i < len(lines):
+            n, content = lines[self.i]
+            if n < indent or n == indent and not _is_seq_item(content):
+                break
+            if n > indent:
+                raise Unsupported(content)
+            rest = content[1:].lstrip(" ")
+            if not rest or rest[0] == "#":
+                self.i += 1
+                result.append(self.block(indent))
+            elif _is_seq_item(rest) or _key.match(rest):
+                # Compact nested collection, continue as if it started on its own line
+                lines[self.i] = (n + len(content) - len(rest), rest)
+                result.append(self.node(lines[self.i][0]))
+            else:
+                self.i += 1
+                result.append(self.value(rest))
+                self.check_end(indent)
+        return result
+
+    def mapping(self, indent):
+        lines = self.lines
+        result = {}
+        while self.i < len(lines):
+            n, content = lines[self.i]
+            if n < indent:
+                break
+            m = _key.match(content)
+            if n > indent or not m:
+                raise Unsupported(content)
+            key = _key_value(m.group(1))
+            rest = content[m.end():]
+            self.i += 1
+            if not rest or rest[0] == "#":
+                if self.i < len(lines) and lines[self.i][0] == indent and _is_seq_item(lines[self.i][1]):
+                    value = self.sequence(indent)
+                else:
+                    value = self.block(indent)
+            else:
+                value = self.value(rest)
+                self.check_end(indent)
+            result[key] = value
+        return result
+
+    def value(self, text):
+        c = text[0]
+        if c in "[{":
+            value, pos = self.flow(text, 0)
+        elif c in "'\"":
+            m = (_single if c == "'" else _double).match(text)
+            if not m:
+                raise Unsupported(text)
+            value, pos = _quoted(m), m.end()
+        else:
+            end = text.find(" #")
+            if end >= 0:
+                text = text[:end]
+            text = text.rstrip(" ")
+            if ": " in text or text.endswith(":") or c in "-?:" and (len(text) == 1 or text[1] == " ") \
+                    or c in ",]}#&*!|>%@`":
+                raise Unsupported(text)
+            return resolve(text)
+        if pos < len(text) and (text[pos] != " " or not _comment.match(text, pos)):
+            raise Unsupported(text)
+        return value
+
+    def flow_node(self, text, pos):
+        c = text[pos]
+        if c in "[{":
+            return self.flow(text, pos)
+        if c in "'\"":
+            m = (_single if c == "'" else _double).match(text, pos)
+            if not m:
+                raise Unsupported(text)
+            return _quoted(m), m.end()
+        m = _flow_plain.match(text, pos)
+        if not m:
+            raise Unsupported(text)
+        return resolve(m.group().rstrip(" ")), m.end()
+
+    def flow(self, text, pos):
+        is_map = text[pos] == "{"
+        closer = "}" if is_map else "]"
+        result = {} if is_map else []
+        pos += 1
+        while True:
+            pos = _skip_spaces(text, pos)
+            if pos >= len(text):
+                raise Unsupported("multiline flow collection")
+            if text[pos] == closer:
+                return result, pos + 1
+            node, pos = self.flow_node(text, pos)
+            pos = _skip_spaces(text, pos)
+            if is_map:
+                if not text.startswith(": ", pos) or isinstance(node, (list, dict)):
+                    raise Unsupported(text)
+                value, pos = self.flow_node(text, _skip_spaces(text, pos + 2))
+                result[node] = value
+                pos = _skip_spaces(text, pos)
+            else:
+                result.append(node)
+            if pos >= len(text):
+                raise Unsupported("multiline flow collection")
+            if text[pos] == ",":
+                pos += 1
+            elif text[pos] != closer:
+                raise Unsupported(text)
+
+
+def parse(text: str):
+    """Parse yaml text of the supported subset, raises Unsupported for anything else"""
+    if text.startswith("\ufeff"):
+        text = text[1:]
+    text = text.replace("\r\n", "\n")
+    if _unsupported_chars.search(text):
+        raise Unsupported("special characters")
+    lines = []
+    for line in text.split("\n"):
+        content = line.lstrip(" ")
+        if not content or content[0] == "#":
+            continue
+        if line[0] in "%" or content.startswith("---") or content.startswith("..."):
+            raise Unsupported(line)
+        lines.append((len(line) - len(content), content.rstrip(" ")))
+    return _Parser(lines).document()
+
+
+def load(text: str, fallback):
+    """Parse text with the fast loader, or with fallback(text) if it uses unsupported yaml features"""
+    try:
+        return parse(text)
+    except Unsupported:
+        return fallback(text)
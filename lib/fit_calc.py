@@ -20,86 +20,18 @@
 
 import logging, numpy
 
-import bpy, mathutils  # pylint: disable=import-error
+import bpy  # pylint: disable=import-error
 
-from . import charlib, morphs, utils
+from . import binding, charlib, morphs, utils
+from .binding import FitBinding, Geometry, SubsetGeometry
+from .. import prefs
 
 logger = logging.getLogger(__name__)
 
-dist_thresh = 0.125
-epsilon = 1e-30
-epsilon2 = 1e-15
-bigval = 1/epsilon
-
-
-class FitBinding(tuple):
-    __slots__ = ()
-
-    def __new__(cls, *args):
-        return super().__new__(cls, args)
-
-    def fit(self, arr: numpy.ndarray, is_weights=False):
-        for pos, idx, weights in self:
-            if is_weights:
-                weights = weights.reshape(-1)
-            arr = numpy.add.reduceat(arr[idx] * weights, pos)
-        return arr
-
-
-def _binding_convert(bind_dict, cut=True):
-    positions = numpy.empty((len(bind_dict)), dtype=numpy.uint32)
-    idx = []
-    weights = []
-    thresh = 0
-    for i, d in enumerate(bind_dict):
-        if cut:
-            thresh = max(d.values()) / 32
-        positions[i] = len(idx)
-        for k, v in d.items():
-            if v >= thresh:
-                idx.append(k)
-                weights.append(v)
-    idx = numpy.array(idx, dtype=numpy.uint32)
-    weights = numpy.array(weights)
-    return positions, idx, weights
-
-
-def _binding_normalize(positions, wresult):
-    cnt = numpy.empty((len(positions)), dtype=numpy.uint32)
-    cnt[:-1] = positions[1:]
-    cnt[:-1] -= positions[:-1]
-    cnt[-1] = len(wresult) - positions[-1]
-    wresult /= numpy.add.reduceat(wresult, positions).repeat(cnt)
-
-
-class Geometry:
-    def __init__(self, verts: numpy.ndarray, faces: list):
-        self.verts = verts
-        self.faces = faces
-
-    def copy(self):
-        return Geometry(self.verts, self.faces)
-
-    def verts_cnt(self):
-        return len(self.verts)
-
-    def verts_enum(self):
-        return enumerate(self.verts)
-
-    def verts_filter_set(self, _vset):
-        pass
-
-    @utils.lazyproperty
-    def kd(self):
-        return utils.kdtree_from_verts_enum(self.verts_enum(), self.verts_cnt())
-
-    @utils.lazyproperty
-    def bvh(self):
-        return mathutils.bvhtree.BVHTree.FromPolygons(self.verts, self.faces)
-
-    @utils.lazyproperty
-    def bbox(self):
-        return self.verts.min(axis=0), self.verts.max(axis=0)
+# Asset and fold geometry with search structures, shared between all fitters
+geom_cache = utils.LRUCache(512 * 1048576)
+# Weights transferred to assets, keyed by asset geometry, source weights and binding digests
+weights_cache = utils.LRUCache(256 * 1048576)
 
 
 def mesh_faces(mesh):
@@ -110,24 +42,6 @@ def geom_mesh(mesh):
     return Geometry(charlib.get_basis(mesh, None, False), mesh_faces(mesh))
 
 
-class SubsetGeometry(Geometry):
-    def __init__(self, verts, faces, subset):
-        super().__init__(verts, faces)
-        self.subset = subset
-
-    def copy(self):
-        return SubsetGeometry(self.verts, self.faces, self.subset)
-
-    def verts_cnt(self):
-        return len(self.subset)
-
-    def verts_enum(self):
-        return ((i, self.verts[i]) for i in self.subset)
-
-    def verts_filter_set(self, vset: set):
-        vset.intersection_update(self.subset)
-
-
 def morpher_faces(mcore):
     faces = mcore.char.faces
     return faces if faces is not None else mesh_faces(mcore.obj.data)
@@ -157,123 +71,15 @@ def geom_morph(geom: Geometry, *morph_list):
     return result
 
 
-class SoftBinder:
-    bindings: list[dict[int, float]]
-    dists_asset: list[float]
-
-    def __init__(self, char_geom: Geometry, asset_verts: numpy.ndarray):
-        self.char_geom = char_geom
-        self.asset_verts = asset_verts
-        self.bindings = []
-        self.dists_asset = []
-        self.revset = set()
-
-    def calc_binding_kd(self):
-        kd = self.char_geom.kd
-        for v in self.asset_verts:
-            pdata = kd.find_n(v.tolist(), 16)
-            dists = [p[2] for p in pdata]
-            mindist = min(dists)
-            maxdist = max(dists)
-            if mindist < epsilon2:
-                self.dists_asset.append(-1)
-                self.bindings.append({item[1]: bigval for item in pdata if item[2] < epsilon2})
-            else:
-                self.dists_asset.append(mindist)
-                self.revset.update(p[1] for p in pdata)
-                self.bindings.append({idx: (1 - (dist / maxdist)) / (max(dist, epsilon)) for _, idx, dist in pdata})
-
-    # calculate binding based on distance from asset vertices to character faces
-    def calc_binding_direct(self):
-        if max(self.dists_asset) < epsilon2:
-            return
-        verts = self.char_geom.verts
-        faces = self.char_geom.faces
-        bvh = self.char_geom.bvh
-        for i, (v, bdist, binding) in enumerate(zip(self.asset_verts, self.dists_asset, self.bindings)):
-            if bdist < epsilon2:
-                continue
-            bdist *= 0.75
-            for loc, _, idx, fdist in bvh.find_nearest_range(v.tolist(), bdist):
-                face = faces[idx]
-                self.dists_asset[i] = min(self.dists_asset[i], fdist)
-                fdist = (1 - fdist / bdist) / max(fdist, epsilon)
-                for vi, bw in zip(face, mathutils.interpolate.poly_3d_calc(verts[face].tolist(), loc)):
-                    binding[vi] = max(binding.get(vi, 0), bw*fdist)
-
-    def calc_binding_reverse(self, asset_geom):
-        dthresh = min(max(self.dists_asset), dist_thresh)
-        if dthresh < epsilon2:
-            return
-        self.char_geom.verts_filter_set(self.revset)
-        cverts = self.char_geom.verts
-        verts = asset_geom.verts
-        faces = asset_geom.faces
-        bvh = asset_geom.bvh
-        for i in self.revset:
-            loc, _, idx, fdist = bvh.find_nearest(cverts[i].tolist(), dthresh)
-            if idx is None:
-                continue
-            face = faces[idx]
-            coeff = (1 - fdist / dthresh) / max(fdist, epsilon2)
-            for vi, bw in zip(face, mathutils.interpolate.poly_3d_calc(verts[face].tolist(), loc)):
-                if self.dists_asset[vi] > fdist:
-                    d = self.bindings[vi]
-                    d[i] = max(d.get(i, 0), bw * coeff)
-
-    def initial_bind(self, t: utils.Timer):
-        self.calc_binding_kd()
-        t.time("kdtree")
-        self.calc_binding_direct()
-        t.time("bvh direct")
-
-
-class HardBinder(SoftBinder):
-    # calculate binding based on distance from asset vertices to character faces
-    def calc_binding_direct(self):
-        verts = self.char_geom.verts
-        faces = self.char_geom.faces
-        bvh = self.char_geom.bvh
-        for v in self.asset_verts:
-            loc, _, idx, fdist = bvh.find_nearest(v.tolist())
-            if loc is None:
-                continue
-            face = faces[idx]
-            self.revset.update(face)
-            self.dists_asset.append(fdist)
-            fdist = 1 / max(fdist, epsilon)
-            self.bindings.append({vi: bw*fdist
-                for vi, bw in zip(face, mathutils.interpolate.poly_3d_calc(verts[face].tolist(), loc))})
-
-    def calc_binding_kd(self):
-        kd = self.char_geom.kd
-        for v, fdist, binding in zip(self.asset_verts, self.dists_asset, self.bindings):
-            if fdist < epsilon2:
-                continue
-            fdist = min(fdist * 1.5, fdist + dist_thresh)
-            kdata = kd.find_range(v, fdist)
-            if len(kdata) < 2:
-                continue
-            if len(kdata)>24:
-                kdata = kdata[:24]
-            coeff = 2 / (fdist - min([item[2] for item in kdata]))
-            for _, idx, dist in kdata:
-                self.revset.add(idx)
-                binding[idx] = max(binding.get(idx, 0), (fdist - dist) * coeff / max(dist, epsilon))
-
-    def initial_bind(self, t: utils.Timer):
-        self.calc_binding_direct()
-        t.time("bvh direct")
-        self.calc_binding_kd()
-        t.time("kdtree")
-
-
 class AssetFitData(utils.ObjTracker):
     obj: bpy.types.Object
     conf: charlib.Asset
     morph: morphs.Morph
     geom: Geometry
     binding: FitBinding
+    # last fitted vertex positions and character diff array they were calculated from
+    fitted: numpy.ndarray = None
+    fitted_diff: numpy.ndarray = None
 
     def __init__(self, obj, geom=None):
         super().__init__(obj)
@@ -293,26 +99,26 @@ def get_mesh(data):
 
 
 class FitCalculator:
-    tmp_buf: numpy.ndarray = None
-    geom_cache: dict[str, Geometry]
+    geom_cache: utils.LRUCache
 
     def __init__(self, geom: Geometry, parent: "FitCalculator" = None):
         self.geom = geom
-        self.geom_cache = {} if parent is None else parent.geom_cache
+        if parent is None:
+            geom_cache.max_bytes = prefs.get_geom_cache_size()
+            self.geom_cache = geom_cache
+        else:
+            self.geom_cache = parent.geom_cache
 
     def get_char_geom(self, _):
         return self.geom
 
-    def _cache_get(self, key, get_func):
-        result = self.geom_cache.get(key)
-        if result is None:
-            result = get_func()
-            self.geom_cache[key] = result
-        return result
+    def _cache_get(self, key, get_func, version=None):
+        return self.geom_cache.get_or_create(key, get_func, version)
 
     def _get_asset_geom(self, data) -> Geometry:
         data = get_mesh(data)
-        return self._cache_get("obj_" + data.get("charmorph_fit_id", data.name), lambda: geom_mesh(data))
+        return self._cache_get(
+            "obj_" + data.get("charmorph_fit_id", data.name), lambda: geom_mesh(data), utils.mesh_version(data))
 
     def _get_fold_geom(self, afd: AssetFitData) -> Geometry:
         def get_func():
@@ -336,57 +142,50 @@ class FitCalculator:
             afd.binding = self.get_binding(afd)
         return afd
 
-    def _calc_binding_internal(self, asset_verts, afd=None, asset_geom=None):
-        t = utils.Timer()
-        if bpy.context.window_manager.charmorph_ui.fitting_binder == "HARD":
-            Binder = HardBinder
-        else:
-            Binder = SoftBinder
-        b = Binder(self.get_char_geom(afd), asset_verts)
-        b.initial_bind(t)
-        if asset_geom:
-            b.calc_binding_reverse(asset_geom)
-            t.time("bvh reverse")
-        positions, idx, wresult = _binding_convert(b.bindings)
-        _binding_normalize(positions, wresult)
-        t.time("finalize")
-        return positions, idx, wresult.reshape(-1, 1)
+    @staticmethod
+    def _get_binder():
+        return bpy.context.window_manager.charmorph_ui.fitting_binder
 
-    def _get_binding(self, target, custom_geom=False) -> FitBinding:
+    # Everything that needs bpy is done here, returned function only works with numpy arrays
+    # so it can be run in a worker thread
+    def _binding_task(self, target, custom_geom=False):
         if not isinstance(target, AssetFitData):
             target = AssetFitData(target)
         fold = target.conf.fold
         geom = target.geom if custom_geom or fold is None else self._get_fold_geom(target)
-        binding = self._calc_binding_internal(geom.verts, target, geom)
-        return FitBinding(binding) if fold is None else FitBinding(
-            binding, (fold.pos, fold.idx, fold.weights))
+        char_geom = self.get_char_geom(target)
+        binder = self._get_binder()
+
+        def task():
+            result = binding.calc_binding(binder, char_geom, geom.verts, geom, utils.Timer())
+            return FitBinding(result) if fold is None else FitBinding(
+                result, (fold.pos, fold.idx, fold.weights))
+        return task
+
+    def _get_binding(self, target, custom_geom=False) -> FitBinding:
+        return self._binding_task(target, custom_geom)()
 
     def get_binding(self, target) -> FitBinding:
         return self._get_binding(target)
 
     def calc_binding_hair(self, arr):
-        return FitBinding(self._calc_binding_internal(arr))
-
-    def _transfer_weights_iter_arrays(self, binding: FitBinding, vg_data):
-        if self.tmp_buf is None:
-            self.tmp_buf = numpy.empty(len(self.geom.verts))
-        for name, idx, weights in utils.vg_read(vg_data):
-            self.tmp_buf.fill(0)
-            self.tmp_buf.put(idx, weights)
-            yield name, binding.fit(self.tmp_buf, True)
-
-    def _transfer_weights_get(self, binding, vg_data, cutoff=1e-4):
-        for name, weights in self._transfer_weights_iter_arrays(binding, vg_data):
-            idx = (weights > cutoff).nonzero()[0]
-            if len(idx) > 0:
-                yield name, idx, weights[idx]
+        return FitBinding(binding.calc_binding(self._get_binder(), self.geom, arr, t=utils.Timer()))
+
+    def _transfer_weights_get(self, afd: AssetFitData, vg_data, cutoff=1e-4) -> binding.VGroups:
+        groups = vg_data if isinstance(vg_data, binding.VGroups) else binding.VGroups(utils.vg_read(vg_data))
+        key = (afd.geom.digest(), groups.digest(), afd.binding.digest(), len(self.geom.verts), cutoff)
+        return weights_cache.get_or_create(key, lambda: binding.VGroups(
+            binding.transfer_weights(afd.binding, len(self.geom.verts), groups, cutoff)))
 
     def transfer_weights(self, target, vg_data):
         if not isinstance(target, AssetFitData):
             target = self._get_asset_data(target)
+        t = utils.Timer()
+        groups = self._transfer_weights_get(target, vg_data)
+        t.time(f"weights transfer {target.obj.name}, cache: {weights_cache.stats()}")
+        # transferred weights are interpolated anyway, so they are quantized for faster import
         utils.import_vg(
-            target.obj, self._transfer_weights_get(target.binding, vg_data),
-            bpy.context.window_manager.charmorph_ui.fitting_weights_ovr)
+            target.obj, groups, bpy.context.window_manager.charmorph_ui.fitting_weights_ovr, utils.vg_weight_step)
 
 
 class MorpherFitCalculator(FitCalculator):
@@ -413,54 +212,12 @@ class MorpherFitCalculator(FitCalculator):
         return self.geom
 
 
-# calculate binding based on nearest vertices
-def _calc_binding_kd(kd, verts, _epsilon, n):
-    result = []
-    for v in verts:
-        pdata = kd.find_n(v, n)
-        maxdist = max([p[2] for p in pdata])
-        result.append({idx: (1 - (dist / maxdist)) / (max(dist, _epsilon)) for _, idx, dist in pdata})
-    return result
-
-
-# calculate binding based on distance from character vertices to assset faces
-def _calc_binding_reverse(bind_dict, char_geom, asset_geom):
-    verts = asset_geom.verts
-    faces = asset_geom.faces
-    bvh = asset_geom.bvh
-    for i, cvert in char_geom.verts_enum():
-        loc, _, idx, fdist = bvh.find_nearest(cvert.tolist(), dist_thresh)
-        if idx is None:
-            continue
-        face = faces[idx]
-        fdist = (1 - fdist / dist_thresh) / max(fdist, 1e-15)  # using lower epsilon to avoid some artifacts
-        for vi, bw in zip(face, mathutils.interpolate.poly_3d_calc([verts[i] for i in face], loc)):
-            d = bind_dict[vi]
-            d[i] = d.get(i, 0) + bw * fdist
-
-
 class RiggerFitCalculator(FitCalculator):
     def __init__(self, morpher):
         super().__init__(geom_morpher(morpher.core), morpher.fitter)
 
-    # when transferring joints to another geometry, we need to make sure
-    # that every original vertex will be mapped to new topology
-    def _calc_binding_kd_reverse(self, weights, kd):
-        for i, vert in self.geom.verts_enum():
-            for _, vi, dist in kd.find_n(vert, 4):
-                d = weights[vi]
-                d[i] = d.get(i, 0) + 1 / max(dist**2, 1e-5)
-
     def get_binding(self, target: AssetFitData):
-        t = utils.Timer()
-        cg = self.get_char_geom(target)
-        # calculate weights based on nearest vertices
-        bind_dict = _calc_binding_kd(cg.kd, target.geom.verts, 1e-5, 16)
-        self._calc_binding_kd_reverse(bind_dict, target.geom.kd)
-        _calc_binding_reverse(bind_dict, cg, target.geom)
-        result = _binding_convert(bind_dict, False)
-        t.time("rigger calc time")
-        return FitBinding(result)
+        return FitBinding(binding.calc_binding_rigger(self.get_char_geom(target), target.geom, utils.Timer()))
 
     def transfer_weights_get(self, obj, vg_data, cutoff=1e-4):
-        return self._transfer_weights_get(self._get_asset_data(obj).binding, vg_data, cutoff)
+        return self._transfer_weights_get(self._get_asset_data(obj), vg_data, cutoff)
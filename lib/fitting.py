@@ -20,9 +20,9 @@
 
 import random, logging, numpy
 
-import bpy, bmesh, mathutils  # pylint: disable=import-error
+import bpy  # pylint: disable=import-error
 
-from . import fit_calc, hair, utils
+from . import fit_calc, hair, masking, spatial, utils
 
 logger = logging.getLogger(__name__)
 special_groups = {"corrective_smooth", "corrective_smooth_inv", "preserve_volume", "preserve_volume_inv"}
@@ -60,74 +60,6 @@ def cleanup_masks(obj):
             obj.vertex_groups.remove(vg)
 
 
-def shrink_vertex_set(vset: set, faces):
-    boundary_verts = set()
-    for f in faces:
-        for i in f:
-            if i not in vset:
-                boundary_verts.update(f)
-
-    vset.difference_update(boundary_verts)
-
-
-def get_cast_points(bmin: numpy.ndarray, bmax: numpy.ndarray):
-    center = (bmin + bmax) / 2
-    size = (bmax - bmin).max()
-
-    points = numpy.vstack((center - size, center, center + size))
-    return [
-        mathutils.Vector((points[x][0], points[y][1], points[z][2]))
-        for x in range(3) for y in range(3) for z in range(3)
-        if x != 1 or y != 1 or z != 1
-    ]
-
-
-def calculate_mask(char_geom: fit_calc.Geometry, bvh_asset, match_func=lambda _idx, _co: True):
-    cast_points = get_cast_points(*char_geom.bbox)
-    bvh_char = char_geom.bvh
-
-    def cast_rays(co, direction, max_dist=1e30):
-        nonlocal has_cloth
-        idx = bvh_asset.ray_cast(co, direction, max_dist)[2]
-        if idx is None:
-            # Vertex is not blocked by cloth. Maybe blocked by the body itself?
-            idx = bvh_char.ray_cast(co, direction, max_dist * 0.99)[2]
-            if idx is None:
-                return False  # No ray hit
-        else:
-            has_cloth = True
-        return True  # Have ray hit
-
-    result = set()
-    for i, co in enumerate(char_geom.verts):
-        if not match_func(i, co):
-            continue
-        co = mathutils.Vector(co)
-        has_cloth = False
-        cnt = 0
-
-        # if vertex is too close to cloth, mark it as covered
-        idx = bvh_asset.find_nearest(co, 0.001)[2]
-        if idx is not None:
-            result.add(i)
-            continue
-
-        for cast_point in cast_points:
-            direction = co - cast_point
-            max_dist = direction.length
-            if not cast_rays(cast_point, direction, max_dist):
-                cnt += 1
-                if cnt == 2:
-                    has_cloth = False
-                    break
-
-        if has_cloth:
-            result.add(i)
-
-    shrink_vertex_set(result, char_geom.faces)
-    return result
-
-
 def add_mask(obj, vg_name, verts):
     if not verts:
         return
@@ -142,33 +74,6 @@ def add_mask(obj, vg_name, verts):
     mod.vertex_group = vg.name
 
 
-def obj_bbox(obj):
-    bbox_min = mathutils.Vector((obj.bound_box[0]))
-    bbox_max = mathutils.Vector((obj.bound_box[0]))
-    for v in obj.bound_box[1:]:
-        for i in range(3):
-            bbox_min[i] = min(bbox_min[i], v[i])
-            bbox_max[i] = max(bbox_max[i], v[i])
-    return bbox_min, bbox_max
-
-
-def bbox_match(co, bbox):
-    for i in range(3):
-        if co[i] < bbox[0][i] or co[i] > bbox[1][i]:
-            return False
-    return True
-
-
-def fit_to_bmesh(bm, afd, fitted_diff):
-    try:
-        morphed = afd.geom.verts + fitted_diff
-        afd.obj.data.vertices.foreach_set("co", morphed.reshape(-1))
-        bm.from_mesh(afd.obj.data)
-    finally:
-        afd.obj.data.vertices.foreach_set("co", afd.geom.verts.reshape(-1))
-    return morphed.min(axis=0), morphed.max(axis=0)
-
-
 class EmptyAsset:
     author = ""
     license = ""
@@ -194,12 +99,9 @@ class Fitter(hair.HairFitter):
             add_mask(self.mcore.obj, vg_name, afd.conf.mask.tolist())
             return
 
-        bbox = afd.geom.bbox
-        add_mask(
-            self.mcore.obj, vg_name,
-            calculate_mask(
-                self.get_char_geom(afd), afd.geom.bvh,
-                lambda _, co: bbox_match(co, bbox)))
+        char_geom = self.get_char_geom(afd)
+        mask = masking.calculate_mask(char_geom, afd.geom.tree, masking.bbox_mask(char_geom.verts, afd.geom.bbox))
+        add_mask(self.mcore.obj, vg_name, mask.nonzero()[0].tolist())
 
     def recalc_comb_mask(self):
         t = utils.Timer()
@@ -215,10 +117,10 @@ class Fitter(hair.HairFitter):
 
         morph_cnt = 0
         morph_afd = None
-        mask = set()
+        mask = numpy.zeros(len(self.geom.verts), dtype=bool)
         for afd in assets:
             if afd.conf.mask is not None:
-                mask.update(afd.conf.mask.tolist())
+                mask[afd.conf.mask] = True
             if afd.morph:
                 morph_cnt += 1
                 morph_afd = afd
@@ -230,37 +132,25 @@ class Fitter(hair.HairFitter):
             char_geom = fit_calc.geom_morph(char_geom, *(afd.morph for afd in assets if afd.morph is not None))
             diff = char_geom.verts - self.geom.verts
 
-        bboxes = []
-        try:
-            bm = bmesh.new()
-            for afd in assets:
-                if morph_cnt > 0 and afd is not morph_afd:
-                    cur_diff = diff
-                    if afd.morph:
-                        cur_diff = afd.morph.apply(cur_diff.copy())
-                    fitted_diff = afd.binding.fit(cur_diff)
-                    if (fitted_diff ** 2).sum(1).max() > 0.001:
-                        bboxes.append(fit_to_bmesh(bm, afd, fitted_diff))
-                        continue
-
-                bm.from_mesh(afd.obj.data)
-                bboxes.append(obj_bbox(afd.obj))
-            bvh_assets = mathutils.bvhtree.BVHTree.FromBMesh(bm)
-        finally:
-            bm.free()
-
-        t.time("mask_bvh")
-
-        def check_func(idx, co):
-            if idx in mask:
-                return False
-            for box in bboxes:
-                if bbox_match(co, box):
-                    return True
-            return False
-
-        mask.update(calculate_mask(char_geom, bvh_assets, check_func))
-        add_mask(self.mcore.obj, "cm_mask_combined", mask)
+        meshes = []
+        match = numpy.zeros(len(mask), dtype=bool)
+        for afd in assets:
+            verts = afd.geom.verts
+            if morph_cnt > 0 and afd is not morph_afd:
+                cur_diff = diff
+                if afd.morph:
+                    cur_diff = afd.morph.apply(cur_diff.copy())
+                fitted_diff = afd.binding.fit(cur_diff)
+                if (fitted_diff ** 2).sum(1).max() > 0.001:
+                    verts = verts + fitted_diff
+            meshes.append((verts, afd.geom.polys))
+            match |= masking.bbox_mask(char_geom.verts, (verts.min(axis=0), verts.max(axis=0)))
+        asset_tree = spatial.TriTree(*masking.merge_meshes(meshes))
+
+        t.time("mask_tree")
+
+        mask |= masking.calculate_mask(char_geom, asset_tree, match & ~mask)
+        add_mask(self.mcore.obj, "cm_mask_combined", mask.nonzero()[0].tolist())
         t.time("comb_mask")
 
     def _get_fit_id(self, data):
@@ -288,6 +178,29 @@ class Fitter(hair.HairFitter):
         self.bind_cache[fit_id] = result
         return result
 
+    # Calculate missing bindings for several assets concurrently.
+    # Geometry is extracted on the main thread, then bindings are calculated in a thread pool.
+    def calc_bindings(self, objs):
+        tasks = []
+        for obj in objs:
+            fit_id = self._get_fit_id(obj)
+            if isinstance(self.bind_cache.get(fit_id), fit_calc.FitBinding):
+                continue
+            afd = fit_calc.AssetFitData(obj, self._get_asset_geom(obj))
+            self._add_asset_data(afd)
+            tasks.append((fit_id, obj.name, self._binding_task(afd)))
+        if not tasks:
+            return
+
+        t = utils.Timer()
+        self.geom.prepare()
+        results = utils.parallel_map(lambda task: utils.timed(task[2]), tasks)
+        for (fit_id, name, _), (result, duration) in zip(tasks, results):
+            logger.debug("binding %s: %s", name, duration)
+            self.bind_cache[fit_id] = result
+        t.time(f"bindings for {len(tasks)} assets")
+        logger.debug("geometry cache: %s", self.geom_cache.stats())
+
     def get_diff_arr(self, morph=None):
         if self.diff_arr is None:
             self.diff_arr = self.mcore.get_diff()
@@ -356,7 +269,6 @@ class Fitter(hair.HairFitter):
             return
         for afd in self.get_assets():
             self._transfer_armature(afd)
-        self.tmp_buf = None
         self.transfer_calc = None
 
     def _get_target(self, asset):
@@ -372,16 +284,35 @@ class Fitter(hair.HairFitter):
             self.children = None
             return
         t = utils.Timer()
+        self._fit_apply(afd, self._fit_calc(afd))
+        t.time("fit " + afd.obj.name)
 
-        verts = afd.binding.fit(self.get_diff_arr(afd.morph))
-        verts += afd.geom.verts
+    # If changed mask of character vertices is given, only affected rows are recalculated.
+    # Returns None if the asset isn't affected at all.
+    def _fit_calc(self, afd, changed=None):
+        if changed is None or afd.fitted is None:
+            verts = afd.binding.fit(self.get_diff_arr(afd.morph))
+            verts += afd.geom.verts
+            return verts
+
+        rows = afd.binding.affected(changed).nonzero()[0]
+        if len(rows) == 0:
+            return None
+        if len(rows) * 2 > len(afd.fitted):
+            return self._fit_calc(afd)
+        verts = afd.fitted
+        verts[rows] = afd.binding.fit_rows(self.get_diff_arr(afd.morph), rows) + afd.geom.verts[rows]
+        return verts
+
+    def _fit_apply(self, afd, verts):
+        afd.fitted = verts
+        afd.fitted_diff = self.diff_arr
+        utils.mesh_own_update(afd.obj.data)
         if self.mcore.alt_topo and afd.obj is self.mcore.obj:
             self.mcore.alt_topo_verts = verts
         self._get_target(afd.obj).foreach_set("co", verts.reshape(-1))
         afd.obj.data.update()
 
-        t.time("fit " + afd.obj.name)
-
     def _fit_new_item(self, asset):
         afd = self._get_asset_data(asset)
         if self.children is not None:
@@ -405,6 +336,7 @@ class Fitter(hair.HairFitter):
         return afd
 
     def fit_new(self, assets):
+        self.calc_bindings(assets)
         afd_list = [self._fit_new_item(asset) for asset in assets]
         if bpy.context.window_manager.charmorph_ui.fitting_mask == "COMB":
             for asset in assets:
@@ -441,10 +373,9 @@ class Fitter(hair.HairFitter):
 
     def _get_children(self):
         if self.children is None:
-            self.children = [
-                self._get_asset_data(obj) for obj in self.mcore.obj.children
-                if obj.type == "MESH" and 'charmorph_fit_id' in obj.data
-            ]
+            objs = [obj for obj in self.mcore.obj.children if obj.type == "MESH" and 'charmorph_fit_id' in obj.data]
+            self.calc_bindings(objs)
+            self.children = [self._get_asset_data(obj) for obj in objs]
         return self.children
 
     def get_assets(self):
@@ -471,8 +402,36 @@ class Fitter(hair.HairFitter):
         hair_deform = bpy.context.window_manager.charmorph_ui.hair_deform
         if hair_deform:
             self.fit_obj_hair(self.mcore.obj)
-        for afd in self.get_assets():
-            self.fit(afd)
+
+        assets = self.get_assets()
+        for afd in assets:
+            if not afd.check_obj():
+                logger.warning("Missing fitting object %s, resetting fitter", afd.obj_name)
+                self.children = None
+                assets = [afd for afd in assets if afd.check_obj()]
+                break
+
+        # Compare current diff with ones the assets were fitted with to skip unaffected assets and rows
+        diff = self.get_diff_arr()
+        changed = {}
+        for afd in assets:
+            prev = afd.fitted_diff
+            if prev is not None and id(prev) not in changed and prev.shape == diff.shape:
+                changed[id(prev)] = (diff != prev).any(axis=1)
+
+        def calc(afd):
+            return utils.timed(self._fit_calc, afd, changed.get(id(afd.fitted_diff)))
+
+        # Fitted positions are calculated in parallel, but Blender objects can only be updated from the main thread
+        for afd, (verts, duration) in zip(assets, utils.parallel_map(calc, assets)):
+            if verts is None:
+                afd.fitted_diff = diff
+                logger.debug("fit %s: unchanged", afd.obj.name)
+            else:
+                t = utils.Timer()
+                self._fit_apply(afd, verts)
+                logger.debug("fit %s: calc %s", afd.obj.name, duration)
+                t.time("fit " + afd.obj.name)
             if hair_deform:
                 self.fit_obj_hair(afd.obj)
 
@@ -481,11 +440,8 @@ class Fitter(hair.HairFitter):
         if "charmorph_fit_id" in asset.data:
             keys.append(asset.data["charmorph_fit_id"])
         for key in keys:
-            for cache in (self.bind_cache, self.geom_cache):
-                try:
-                    del cache[key]
-                except KeyError:
-                    pass
+            self.bind_cache.pop(key, None)
+            self.geom_cache.pop("obj_" + key)
 
     def clear_cache(self):
         self.bind_cache.clear()
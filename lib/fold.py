@@ -0,0 +1,86 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Automatic generation of fold (proxy) data for dense assets. This module doesn't use bpy.
+# Asset is decimated into a small proxy mesh and bound to it, then the character is bound only to the proxy.
+
+import numpy
+
+from . import binding, spatial
+
+
+def _cluster(verts: numpy.ndarray, cell: float):
+    keys = numpy.floor((verts - verts.min(axis=0)) / cell).astype(numpy.int64)
+    dims = keys.max(axis=0) + 1
+    _, inverse = numpy.unique((keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2], return_inverse=True)
+    return inverse.reshape(-1)
+
+
+def decimate(verts: numpy.ndarray, faces, target: int):
+    """
+    Vertex clustering decimation to about target vertices.
+    Returns proxy vertices and triangles. Close layers of the mesh can be merged in the proxy,
+    it's fine because proxy is used only for binding
+    """
+    size = float((verts.max(axis=0) - verts.min(axis=0)).max())
+    lo, hi = size * 1e-4, size
+    for _ in range(20):
+        cell = (lo * hi) ** 0.5
+        if _cluster(verts, cell).max() + 1 > target:
+            lo = cell
+        else:
+            hi = cell
+    clusters = _cluster(verts, hi)
+
+    counts = numpy.bincount(clusters)
+    pverts = numpy.zeros((len(counts), 3))
+    numpy.add.at(pverts, clusters, verts)
+    pverts /= counts[:, None]
+
+    tris = clusters[spatial.triangulate(spatial.polygons(faces))[0]]
+    tris = tris[(tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 2] != tris[:, 0])]
+    _, first = numpy.unique(numpy.sort(tris, axis=1), axis=0, return_index=True)
+    tris = tris[numpy.sort(first)]
+
+    # drop proxy vertices which were left without faces
+    used = numpy.zeros(len(pverts), dtype=bool)
+    used[tris.reshape(-1)] = True
+    remap = numpy.cumsum(used) - 1
+    return pverts[used], remap[tris]
+
+
+def min_uint(arr: numpy.ndarray):
+    return arr.astype(numpy.min_scalar_type(int(arr.max(initial=0))), casting="unsafe")
+
+
+def fold_data(verts: numpy.ndarray, faces: numpy.ndarray, fold_binding, dtype=numpy.float32):
+    """Get arrays for fold.npz file from proxy geometry and proxy to asset binding"""
+    return {
+        "verts": verts.astype(dtype),
+        "faces": min_uint(numpy.asarray(faces)),
+        "pos": fold_binding[0],
+        "idx": min_uint(fold_binding[1]),
+        "weights": fold_binding[2].astype(numpy.float32),
+    }
+
+
+def generate_fold(asset_geom: binding.Geometry, target: int, binder="SOFT", dtype=numpy.float32):
+    """Decimate asset geometry into a proxy and bind the asset to it. Returns fold.npz arrays"""
+    pverts, ptris = decimate(asset_geom.verts, asset_geom.faces, target)
+    fold_binding = binding.calc_binding(binder, binding.Geometry(pverts, ptris), asset_geom.verts, asset_geom)
+    return fold_data(pverts, ptris, fold_binding, dtype)
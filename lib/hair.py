@@ -18,40 +18,105 @@
 # ##### END GPL LICENSE BLOCK #####
 #
 # Copyright (C) 2021-2022 Michael Vigovsky
-import logging, numpy
+import os, logging, numpy
 
 import bpy  # pylint: disable=import-error
 
-from . import fit_calc, utils
+from . import binding, fit_calc, utils
 
 logger = logging.getLogger(__name__)
 
-def np_particles_data(obj, particles, precision=numpy.float32):
-    cnt = numpy.empty(len(particles), dtype=numpy.uint8)
-    total = 0
-    mx = 1
-    for i, p in enumerate(particles):
-        c = len(p.hair_keys) - 1
-        cnt[i] = c
-        total += c
-        if c > mx:
-            mx = c
-
-    data = numpy.empty((total, 3), dtype=precision)
-    tmp = numpy.empty(mx * 3 + 3, dtype=precision)
-    i = 0
-    for p in particles:
-        t2 = tmp[:len(p.hair_keys) * 3]
-        p.hair_keys.foreach_get("co_local", t2)
-        t2 = t2[3:].reshape((-1, 3))
-        data[i:i + len(t2)] = t2
-        i += len(t2)
+hair_dtypes = {"16": numpy.float16, "32": numpy.float32, "64": numpy.float64}
 
-    utils.np_matrix_transform(data, obj.matrix_world.inverted())
-    return {"cnt": cnt, "data": data}
 
+# Offsets of strands in a flat array, strand i occupies rows starts[i]:starts[i + 1]
+def strand_starts(cnts):
+    starts = numpy.zeros(len(cnts) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.asarray(cnts, dtype=numpy.int64), out=starts[1:])
+    return starts
+
+
+def np_particles_data(obj, particles, precision=numpy.float32):
+    # Hair keys can't be read for all particles at once,
+    # but at least they're read directly into a single buffer without temporary copies.
+    # Keys are read in the requested precision, so 64-bit export is lossless.
+    keys = numpy.array([len(p.hair_keys) for p in particles], dtype=numpy.int64)
+    starts = strand_starts(keys)
+    buf = numpy.empty((starts[-1], 3), dtype=precision)
+    for p, start, end in zip(particles, starts[:-1].tolist(), starts[1:].tolist()):
+        p.hair_keys.foreach_get("co_local", buf[start:end].reshape(-1))
+
+    mask = numpy.ones(len(buf), dtype=bool)
+    mask[starts[:-1]] = False
+    data = buf[mask].astype(numpy.float64)
+    utils.np_matrix_transform(data, obj.matrix_world.inverted())
 
-def export_hair(obj, psys_idx, filepath, precision):
+    cnt = keys - 1
+    return {"cnt": cnt.astype(numpy.min_scalar_type(int(cnt.max(initial=0)))), "data": data.astype(precision)}
+
+
+# Each strand is stored as its first point in float32 and differences between successive points.
+# Differences are taken from already quantized points, so rounding errors don't accumulate along the strand
+def _delta_encode(cnt, data, precision):
+    starts = strand_starts(cnt)[:-1]
+    strands = (cnt > 0).nonzero()[0]
+    first = numpy.zeros((len(cnt), 3), dtype=numpy.float32)
+    first[strands] = data[starts[strands]]
+    deltas = numpy.zeros((len(data), 3), dtype=precision)
+    point = first[strands].astype(numpy.float64)
+    for k in range(1, int(cnt.max(initial=0))):
+        sel = cnt[strands] > k
+        strands = strands[sel]
+        point = point[sel]
+        rows = starts[strands] + k
+        d = (data[rows] - point).astype(precision)
+        deltas[rows] = d
+        point += d
+    mask = numpy.ones(len(data), dtype=bool)
+    mask[starts[cnt > 0]] = False
+    return first, deltas[mask]
+
+
+def encode_hair(hd: dict, precision=numpy.float32, delta=False):
+    """
+    Prepare hair data from np_particles_data() for saving.
+    Returns arrays to save and maximum absolute error of the points after decoding
+    """
+    cnt = hd["cnt"]
+    data = numpy.asarray(hd["data"], dtype=numpy.float64)
+    result = {"cnt": cnt}
+    if delta:
+        result["first"], result["data"] = _delta_encode(cnt, data, precision)
+    else:
+        result["data"] = data.astype(precision)
+    return result, float(numpy.abs(decode_hair(result)[1] - data).max(initial=0))
+
+
+def decode_hair(z):
+    """Get counts and float64 points from saved hair data"""
+    cnt = numpy.array(z["cnt"])
+    if "first" not in z:
+        return cnt, numpy.array(z["data"], dtype=numpy.float64)
+
+    starts = strand_starts(cnt)
+    firsts = starts[:-1][cnt > 0]
+    data = numpy.empty((starts[-1], 3))
+    mask = numpy.ones(len(data), dtype=bool)
+    mask[firsts] = False
+    data[mask] = z["data"]
+    data[firsts] = z["first"][cnt > 0]
+    numpy.cumsum(data, axis=0, out=data)
+    base = numpy.zeros((len(firsts), 3))
+    base[1:] = data[firsts[1:] - 1]
+    data -= numpy.repeat(base, cnt[cnt > 0], axis=0)
+    return cnt, data
+
+
+def load_hair(filepath):
+    return decode_hair(utils.load_npz(filepath))
+
+
+def export_hair(obj, psys_idx, filepath, precision, delta=False, compress=True):
     pss = obj.particle_systems
     old_psys_idx = pss.active_index
     pss.active_index = psys_idx
@@ -61,12 +126,47 @@ def export_hair(obj, psys_idx, filepath, precision):
     with bpy.context.temp_override(object=obj):
         if not is_global:
             bpy.ops.particle.disconnect_hair()
-        numpy.savez_compressed(filepath, **np_particles_data(obj, psys.particles, precision))
+        hd = np_particles_data(obj, psys.particles, numpy.float64)
         if not is_global:
             bpy.ops.particle.connect_hair()
 
     pss.active_index = old_psys_idx
 
+    # Uncompressed files are memory mapped on loading
+    result, error = encode_hair(hd, precision, delta)
+    (numpy.savez_compressed if compress else numpy.savez)(filepath, **result)
+    return error
+
+
+def _read_roots(particles):
+    # Reading hair_keys[0] of every particle is slow, so try to get roots from particle locations in bulk.
+    # They are used only if they match the roots of sampled particles.
+    count = len(particles)
+    roots = numpy.empty(count * 3, dtype=numpy.float32)
+    particles.foreach_get("location", roots)
+    roots = roots.reshape(-1, 3)
+    sample = numpy.unique(numpy.linspace(0, count - 1, min(count, 8)).astype(int))
+    if all(numpy.allclose(roots[i], particles[int(i)].hair_keys[0].co_local, atol=1e-5) for i in sample):
+        return roots
+    logger.debug("Particle locations don't match hair roots, reading roots one by one")
+    for i, p in enumerate(particles):
+        roots[i] = p.hair_keys[0].co_local
+    return roots
+
+
+def hair_buffer(cnts: numpy.ndarray, morphed: numpy.ndarray, roots: numpy.ndarray):
+    """
+    Assemble keys of all strands including roots into one float32 buffer.
+    Strand i occupies buf[starts[i]:starts[i + 1]]
+    """
+    starts = strand_starts(cnts.astype(numpy.int64) + 1)
+    buf = numpy.empty((starts[-1], 3), dtype=numpy.float32)
+    is_root = numpy.zeros(len(buf), dtype=bool)
+    is_root[starts[:-1]] = True
+    buf[starts[:-1]] = roots
+    buf[~is_root] = morphed[1:len(buf) - len(cnts) + 1]
+    return buf, starts
+
 
 def update_hair(obj, cnts, morphed):
     t = utils.Timer()
@@ -80,17 +180,22 @@ def update_hair(obj, cnts, morphed):
         bpy.ops.particle.disconnect_hair()
     t.time("disconnect")
     try:
-        pos = 0
-        for p, cnt in zip(psys.particles, cnts):
-            if len(p.hair_keys) != cnt + 1:
+        # Particle hair has no API to set keys of all strands at once,
+        # so keys are prepared in a single buffer and every strand is set with one call
+        particles = psys.particles
+        if len(particles) != len(cnts):
+            logger.error("Particle count mismatch %d %d", len(particles), len(cnts))
+        cnts = cnts[:len(particles)]
+        buf, starts = hair_buffer(cnts, morphed, _read_roots(particles)[:len(cnts)])
+        t.time("hair_buffer")
+        for p, start, end in zip(particles, starts[:-1].tolist(), starts[1:].tolist()):
+            keys = p.hair_keys
+            if len(keys) != end - start:
                 if not have_mismatch:
-                    logger.error("Particle mismatch %d %d", len(p.hair_keys), cnt)
+                    logger.error("Particle mismatch %d %d", len(keys), end - start - 1)
                     have_mismatch = True
                 continue
-            marr = morphed[pos:pos + cnt + 1]
-            marr[0] = p.hair_keys[0].co_local
-            pos += cnt
-            p.hair_keys.foreach_set("co_local", marr.reshape(-1))
+            keys.foreach_set("co_local", buf[start:end].reshape(-1))
     finally:
         t.time("hair_set")
         with bpy.context.temp_override(object=obj):
@@ -100,10 +205,11 @@ def update_hair(obj, cnts, morphed):
 
 
 class HairData:
-    __slots__ = "cnts", "data", "binding"
+    __slots__ = "cnts", "data", "binding", "mode"
     cnts: numpy.ndarray
     data: numpy.ndarray
-    binding: fit_calc.FitBinding
+    binding: fit_calc.FitBinding | binding.StrandBinding
+    mode: tuple
 
     def get_morphed(self, diff: numpy.ndarray):
         result = numpy.empty((len(self.data) + 1, 3))
@@ -120,29 +226,41 @@ class HairFitter(fit_calc.MorpherFitCalculator):
     def get_diff_arr(self):
         return self.mcore.get_diff()
 
+    def calc_binding_strands(self, hd: HairData, guides: int, rigid: bool):
+        samples = binding.strand_samples(hd.cnts, guides + 1)
+        result = binding.StrandBinding(self.calc_binding_hair(hd.data[samples.reshape(-1)]),
+                                       hd.cnts, hd.data, samples, rigid)
+        logger.debug("strand binding: %d samples, %d bytes", samples.size, result.nbytes)
+        return result
+
     def get_hair_data(self, psys):
         if not psys.is_edited:
             return None
+        ui = bpy.context.window_manager.charmorph_ui
+        mode = (ui.hair_binding, ui.hair_guides)
         fit_id = psys.settings.get("charmorph_fit_id")
         if fit_id:
             data = self.hair_cache.get(fit_id)
-            if isinstance(data, HairData):
+            if isinstance(data, HairData) and data.mode == mode:
                 return data
 
-        z = self.mcore.char.get_np(f"hairstyles/{psys.settings.get('charmorph_hairstyle','')}.npz")
-        if z is None:
+        path = self.mcore.char.path(f"hairstyles/{psys.settings.get('charmorph_hairstyle','')}.npz")
+        if not os.path.isfile(path):
             logger.error("Hairstyle npz file is not found")
             return None
 
         hd = HairData()
-        hd.cnts = z["cnt"]
-        hd.data = z["data"].astype(dtype=numpy.float64, casting="same_kind")
+        hd.cnts, hd.data = load_hair(path)
 
         if len(hd.cnts) != len(psys.particles):
             logger.error("Mismatch between current hairsyle and .npz!")
             return None
 
-        hd.binding = self.calc_binding_hair(hd.data)
+        hd.mode = mode
+        if mode[0] == "FULL":
+            hd.binding = self.calc_binding_hair(hd.data)
+        else:
+            hd.binding = self.calc_binding_strands(hd, mode[1], mode[0] == "RIGID")
         self.hair_cache[fit_id] = hd
         return hd
 
@@ -0,0 +1,400 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Batched calculation of joint vertex groups for rig authoring. This module doesn't use bpy.
+# All joints are processed at once against array-backed mesh, results are kept as flat sparse arrays.
+
+import numpy
+
+from . import spatial
+from .binding import Geometry, coo_reduce
+
+epsilon = 1e-30
+# limit for temporary arrays of joints x candidates
+batch_size = 1 << 20
+
+msg_no_verts = "No vertices were found by the calc method"
+
+
+class JointGroups:
+    """Vertex groups of a batch of joints as flat (row, vertex index, weight) arrays with per-row errors"""
+    def __init__(self, count: int, rows=None, idx=None, weights=None):
+        self.count = count
+        if rows is None:
+            rows = idx = numpy.empty(0, dtype=numpy.int64)
+            weights = numpy.empty(0)
+        self.rows, self.idx, self.weights = coo_reduce(
+            numpy.asarray(rows, dtype=numpy.int64), numpy.asarray(idx, dtype=numpy.int64),
+            numpy.asarray(weights, dtype=numpy.float64), numpy.add)
+        self.errors = {}
+
+    @classmethod
+    def from_groups(cls, groups):
+        """Create from list of (idx, weights) pairs, None means missing group"""
+        parts = [(numpy.full(len(g[0]), i), g[0], g[1]) for i, g in enumerate(groups) if g is not None]
+        if not parts:
+            return cls(len(groups))
+        return cls(len(groups), *(numpy.concatenate(arrays) for arrays in zip(*parts)))
+
+    @classmethod
+    def from_dicts(cls, dicts):
+        """Create from list of {vertex index: weight} dicts, strings are treated as error messages"""
+        result = cls.from_groups([
+            None if isinstance(d, str) else
+            (numpy.fromiter(d.keys(), numpy.int64, len(d)), numpy.fromiter(d.values(), numpy.float64, len(d)))
+            for d in dicts])
+        for i, d in enumerate(dicts):
+            if isinstance(d, str):
+                result.errors[i] = d
+        return result
+
+    def fail(self, rows, message: str):
+        for row in numpy.asarray(rows).reshape(-1).tolist():
+            self.errors.setdefault(row, message)
+
+    def sums(self):
+        return numpy.bincount(self.rows, self.weights, self.count)
+
+    def group(self, row: int):
+        start, end = numpy.searchsorted(self.rows, (row, row + 1))
+        return self.idx[start:end], self.weights[start:end]
+
+    def mix(self, other: "JointGroups", factor: float):
+        """Batched vg_mix2: mix with other groups at given factor, rows missing in other are kept"""
+        if factor < epsilon:
+            return self
+        bsum = other.sums()
+        has_b = bsum >= epsilon
+        if factor >= 1:
+            keep = ~has_b[self.rows]
+            bmask = has_b[other.rows]
+            a_coeff = numpy.ones(self.count)
+            b_coeff = numpy.ones(self.count)
+        else:
+            keep = numpy.ones(len(self.rows), dtype=bool)
+            bmask = has_b[other.rows]
+            asum = self.sums()
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                a_coeff = numpy.where(has_b, (1 - factor) / asum, 1)
+                b_coeff = numpy.where(has_b, factor / bsum, 0)
+        result = JointGroups(
+            self.count,
+            numpy.concatenate((self.rows[keep], other.rows[bmask])),
+            numpy.concatenate((self.idx[keep], other.idx[bmask])),
+            numpy.concatenate((self.weights[keep] * a_coeff[self.rows[keep]],
+                               other.weights[bmask] * b_coeff[other.rows[bmask]])))
+        result.errors = self.errors
+        return result
+
+    def normalize(self):
+        """Scale every group so its maximal weight is 1, empty groups become errors"""
+        wmax = numpy.zeros(self.count)
+        numpy.maximum.at(wmax, self.rows, self.weights)
+        self.fail((wmax < epsilon).nonzero()[0], "empty vg returned")
+        with numpy.errstate(divide="ignore"):
+            self.weights = self.weights / wmax[self.rows]
+
+    def centers(self, verts: numpy.ndarray):
+        """Weighted average position of every group"""
+        result = numpy.empty((self.count, 3))
+        wsum = self.sums()
+        for i in range(3):
+            result[:, i] = numpy.bincount(self.rows, verts[self.idx, i] * self.weights, self.count)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return result / wsum[:, None]
+
+
+def _make(count, parts, errors=()):
+    result = JointGroups(count, *parts) if parts else JointGroups(count)
+    for rows, message in errors:
+        result.fail(rows, message)
+    return result
+
+
+def _chunks(count, width):
+    step = max(1, batch_size // max(width, 1))
+    return ((i, min(i + step, count)) for i in range(0, count, step))
+
+
+def mean_value_weights(verts: numpy.ndarray, lst: numpy.ndarray, co: numpy.ndarray):
+    """
+    Batched barycentric_weight_calc: mean value weights of co relative to polygons formed by
+    vertex lists padded with -1. Equal weights are used where they can't be calculated.
+    """
+    w = spatial.poly_weights(verts, lst, co)
+    bad = w.sum(1) < 0.5
+    w[bad] = lst[bad] >= 0
+    return w
+
+
+def list_entries(lst: numpy.ndarray, weights: numpy.ndarray, rows=None):
+    """Convert (n, m) vertex lists padded with -1 and their weights to flat (row, index, weight) arrays"""
+    if rows is None:
+        rows = numpy.arange(len(lst))
+    mask = lst >= 0
+    rows = numpy.broadcast_to(numpy.asarray(rows)[:, None], lst.shape)
+    return rows[mask], lst[mask], weights[mask]
+
+
+def list_weights(verts: numpy.ndarray, lst: numpy.ndarray, co: numpy.ndarray, rows=None):
+    """Batched calc_lst for padded vertex lists. Every list must be non-empty"""
+    return list_entries(lst, mean_value_weights(verts, lst, co), rows)
+
+
+def ragged_lists(q: numpy.ndarray, idx: numpy.ndarray, count: int):
+    """Convert flat (query, index) arrays sorted by query to (count, m) lists padded with -1"""
+    cnt = numpy.bincount(q, minlength=count)
+    result = numpy.full((count, max(cnt.max(initial=0), 1)), -1, dtype=numpy.int64)
+    starts = numpy.cumsum(cnt) - cnt
+    result[q, numpy.arange(len(q)) - starts[q]] = idx
+    return result, cnt
+
+
+def _project(co, a, b):
+    """Batched mathutils.geometry.intersect_point_line, returns projected points and line factors"""
+    ab = b - a
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        p = numpy.einsum("...k,...k->...", co - a, ab) / numpy.einsum("...k,...k->...", ab, ab)
+    p = numpy.where(numpy.isfinite(p), p, 0)
+    return a + ab * p[..., None], p
+
+
+def _length(v):
+    return numpy.sqrt(numpy.einsum("...k,...k->...", v, v))
+
+
+def nearest_verts(geom: Geometry, co: numpy.ndarray, n: int):
+    idx, _ = geom.ptree.find_n(co, n)
+    if idx.shape[1] == 0:
+        return _make(len(co), None, ((numpy.arange(len(co)), msg_no_verts),))
+    return _make(len(co), list_weights(geom.verts, idx, co))
+
+
+def verts_in_range(geom: Geometry, co: numpy.ndarray, radius: float):
+    q, idx, _ = geom.ptree.find_range(co, radius)
+    lst, cnt = ragged_lists(q, idx, len(co))
+    ok = (cnt > 0).nonzero()[0]
+    return _make(len(co), list_weights(geom.verts, lst[ok], co[ok], ok), (((cnt == 0).nonzero()[0], msg_no_verts),))
+
+
+def edge_map(nverts: int, edges: numpy.ndarray):
+    """Vertex to edge map as (starts, edge indices) arrays"""
+    flat = edges.reshape(-1)
+    order = numpy.argsort(flat, kind="stable")
+    return numpy.searchsorted(flat[order], numpy.arange(nverts + 1)), order // 2
+
+
+def nearest_edge(geom: Geometry, edges: numpy.ndarray, co: numpy.ndarray, emap=None, search=32):
+    """Batched calc_ne: nearest edge among edges of search nearest vertices"""
+    verts = geom.verts
+    if emap is None:
+        emap = edge_map(len(verts), edges)
+    starts, eidx = emap
+    cand, _ = geom.ptree.find_n(co, search)
+    rows = numpy.arange(len(co)).repeat(cand.shape[1])
+    cand = cand.reshape(-1)
+    cnt = starts[cand + 1] - starts[cand]
+    rows = rows.repeat(cnt)
+    e = eidx[numpy.arange(cnt.sum()) - (numpy.cumsum(cnt) - cnt).repeat(cnt) + starts[cand].repeat(cnt)]
+    a = verts[edges[e, 0]]
+    b = verts[edges[e, 1]]
+    _, p = _project(co[rows], a, b)
+    p = p.clip(0, 1)
+    dist = _length(a + (b - a) * p[:, None] - co[rows])
+
+    order = numpy.lexsort((dist, rows))
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = rows[order[1:]] != rows[order[:-1]]
+    sel = order[first]
+    found = rows[sel]
+    missing = numpy.setdiff1d(numpy.arange(len(co)), found)
+    return _make(len(co), list_weights(verts, edges[e[sel]], co[found], found), ((missing, msg_no_verts),))
+
+
+def face_weights(verts: numpy.ndarray, polys: numpy.ndarray, face: numpy.ndarray, co: numpy.ndarray, snap: float):
+    """
+    Batched calc_face: weights of points co on polygons face.
+    Points closer than snap to a polygon vertex or edge are snapped to it.
+    Returns dense (n, m) weights matching polys[face]
+    """
+    lst = polys[face]
+    w = mean_value_weights(verts, lst, co)
+    if snap <= epsilon:
+        return lst, w
+    n, m = lst.shape
+    valid = lst >= 0
+    cnt = valid.sum(1)
+    rows = numpy.arange(n)[:, None]
+    pts = verts[lst]
+    vsnap = valid & (_length(pts - co[:, None]) < snap)
+    prv = (numpy.arange(m) - 1) % cnt[:, None]
+    pt, p = _project(co[:, None], pts[rows, prv], pts)
+    esnap = valid & (_length(pt - co[:, None]) < snap) & (p >= 0) & (p <= 1)
+
+    vrow = vsnap.any(1)
+    erow = esnap.any(1) & ~vrow
+    vi = vsnap.argmax(1)
+    ei = esnap.argmax(1)
+    w[vrow | erow] = 0
+    r = vrow.nonzero()[0]
+    w[r, vi[r]] = 1
+    r = erow.nonzero()[0]
+    pe = p[r, ei[r]]
+    w[r, prv[r, ei[r]]] = 1 - pe
+    w[r, ei[r]] += pe
+    return lst, w
+
+
+def nearest_face(geom: Geometry, co: numpy.ndarray, snap: float):
+    """Batched calc_nf: weights of the nearest surface point"""
+    loc, face, _ = geom.tree.find_nearest(co)
+    ok = (face >= 0).nonzero()[0]
+    lst, w = face_weights(geom.verts, geom.polys, face[ok], loc[ok], snap)
+    return _make(len(co), list_entries(lst, w, ok), (((face < 0).nonzero()[0], "Face not found"),))
+
+
+def cross_lines(geom: Geometry, co: numpy.ndarray, search: int, n: int):
+    """
+    Batched calc_xl: find segments between pairs of search nearest vertices passing close to the joint.
+    n closest segments are mixed according to joint projection on them.
+    """
+    verts = geom.verts
+    idx, _ = geom.ptree.find_n(co, search)
+    i, j = numpy.triu_indices(idx.shape[1], 1)
+    parts = []
+    found = numpy.zeros(len(co), dtype=bool)
+    for start, end in _chunks(len(co), len(i)):
+        a = verts[idx[start:end, i]]
+        b = verts[idx[start:end, j]]
+        c = co[start:end, None]
+        pt, p = _project(c, a, b)
+        d = _length(pt - c)
+        d[(p < 0) | (p > 1) | (d >= _length(b - a) / 2)] = numpy.inf
+        sel = numpy.argsort(d, axis=1, kind="stable")[:, :n]
+        ok = numpy.isfinite(numpy.take_along_axis(d, sel, 1))
+        found[start:end] = ok.any(1)
+        rows = numpy.arange(start, end)[:, None].repeat(sel.shape[1], 1)[ok]
+        pairs = sel[ok]
+        p = numpy.take_along_axis(p, sel, 1)[ok]
+        parts.append((rows.repeat(2), numpy.stack((idx[rows, i[pairs]], idx[rows, j[pairs]]), 1).reshape(-1),
+                      numpy.stack((1 - p, p), 1).reshape(-1)))
+    parts = [numpy.concatenate(arrays) for arrays in zip(*parts)] if parts else None
+    return _make(len(co), parts, (((~found).nonzero()[0], "No cross lines found"),))
+
+
+def _closest_on_quads(verts, quads, co):
+    # closest points on 4 triangles formed by quad rotations, average of 2 nearest ones is used
+    pts = numpy.stack([
+        spatial.closest_point_on_triangles(
+            co, verts[quads[:, r]], verts[quads[:, (r + 1) % 4]], verts[quads[:, (r + 2) % 4]])
+        for r in range(4)], 1)
+    order = numpy.argsort(_length(pts - co[:, None]), axis=1, kind="stable")[:, :2]
+    return numpy.take_along_axis(pts, order[..., None], 1).mean(1)
+
+
+def bbox_corners(verts: numpy.ndarray, co: numpy.ndarray):
+    """
+    Batched calc_bb: nearest vertex (by L1 distance) in every octant around the joint.
+    Joint is interpolated between front and back faces of the resulting box.
+    """
+    corners = numpy.empty((len(co), 8), dtype=numpy.int64)
+    for start, end in _chunks(len(co), len(verts)):
+        c = co[start:end, None]
+        code = ((verts > c) * (1, 2, 4)).sum(2)
+        dist = numpy.abs(verts - c).sum(2)
+        for bv in range(8):
+            d = numpy.where(code == bv, dist, numpy.inf)
+            best = d.argmin(1)
+            corners[start:end, bv] = numpy.where(numpy.isfinite(d[numpy.arange(end - start), best]), best, -1)
+
+    ok = (corners >= 0).all(1).nonzero()[0]
+    c = co[ok]
+    front = corners[ok][:, [0, 1, 3, 2]]
+    back = corners[ok][:, [4, 5, 7, 6]]
+    wf = mean_value_weights(verts, front, _closest_on_quads(verts, front, c))
+    wb = mean_value_weights(verts, back, _closest_on_quads(verts, back, c))
+    avg_front = numpy.einsum("ij,ijk->ik", wf, verts[front])
+    axis = numpy.einsum("ij,ijk->ik", wb, verts[back]) - avg_front
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        offs = numpy.einsum("ij,ij->i", c - avg_front, axis) / numpy.einsum("ij,ij->i", axis, axis)
+    offs = numpy.where(numpy.isfinite(offs), offs, 0).clip(0, 1)[:, None]
+    return _make(
+        len(co),
+        list_entries(numpy.hstack((front, back)), numpy.hstack((wf * (1 - offs), wb * offs)), ok),
+        (((corners < 0).any(1).nonzero()[0], "Not all bbox points was found"),))
+
+
+def group_tour(verts: numpy.ndarray, groups, co: numpy.ndarray, limit=256):
+    """
+    Batched calc_cu: recalc weights of current group members. Members are ordered into a polygon
+    by nearest neighbour tour, all joints walk their tours simultaneously.
+    """
+    cnt = numpy.array([0 if g is None else len(g) for g in groups], dtype=numpy.int64)
+    ok = ((cnt > 0) & (cnt <= limit)).nonzero()[0]
+    errors = (((cnt == 0).nonzero()[0], "No vertices in current group"),
+              ((cnt > limit).nonzero()[0], "Too many vertices in current group"))
+    if len(ok) == 0:
+        return _make(len(co), None, errors)
+    cnt = cnt[ok]
+    lst = numpy.full((len(ok), cnt.max()), -1, dtype=numpy.int64)
+    for row, i in enumerate(ok):
+        lst[row, :cnt[row]] = groups[i]
+    pts = verts[lst]
+    rows = numpy.arange(len(ok))
+    tour = numpy.zeros_like(lst)
+    visited = lst < 0
+    visited[:, 0] = True
+    cur = numpy.zeros(len(ok), dtype=numpy.int64)
+    for step in range(1, lst.shape[1]):
+        d = _length(pts - pts[rows, cur][:, None])
+        d[visited] = numpy.inf
+        nxt = d.argmin(1)
+        active = step < cnt
+        tour[active, step] = nxt[active]
+        visited[rows[active], nxt[active]] = True
+        cur = numpy.where(active, nxt, cur)
+    lst = numpy.where(numpy.arange(lst.shape[1]) < cnt[:, None], numpy.take_along_axis(lst, tour, 1), -1)
+    return _make(len(co), list_entries(lst, mean_value_weights(verts, lst, co[ok]), ok), errors)
+
+
+def ray_pairs(geom: Geometry, co: numpy.ndarray, rows: numpy.ndarray, d: numpy.ndarray, snap: float):
+    """
+    Batched ray casting for RB/RG modes. Every ray is cast from joint co[rows] in both directions d and -d,
+    weights of two hit polygons are mixed according to joint position between the hits.
+    Results of all rays of a joint are summed.
+    """
+    verts = geom.verts
+    n = len(rows)
+    origin = co[rows]
+    loc, face, _, _, _ = geom.tree.ray_cast(numpy.vstack((origin, origin)), numpy.vstack((d, -d)))
+    ok = ((face[:n] >= 0) & (face[n:] >= 0)).nonzero()[0]
+    loc1 = loc[ok]
+    loc2 = loc[n + ok]
+    _, p = _project(origin[ok], loc1, loc2)
+    p = p.clip(0, 1)[:, None]
+    lst1, w1 = face_weights(verts, geom.polys, face[ok], loc1, snap)
+    lst2, w2 = face_weights(verts, geom.polys, face[n + ok], loc2, snap)
+
+    # vg_mix2 of both hits
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        c1 = numpy.where(p < epsilon, 1, numpy.where(p >= 1, 0, (1 - p) / w1.sum(1, keepdims=True)))
+        c2 = numpy.where(p < epsilon, 0, numpy.where(p >= 1, 1, p / w2.sum(1, keepdims=True)))
+    parts = [numpy.concatenate(arrays) for arrays in zip(
+        list_entries(lst1, w1 * c1, rows[ok]), list_entries(lst2, w2 * c2, rows[ok]))]
+    missing = numpy.setdiff1d(numpy.arange(len(co)), rows[ok])
+    return _make(len(co), parts, ((missing, "Ray cast failed"),))
@@ -0,0 +1,161 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Persistent stores of parsed files, so library loading doesn't need to parse
+# all configs and base meshes at every startup. Doesn't depend on bpy.
+
+import os, sys, marshal, logging, threading
+
+logger = logging.getLogger(__name__)
+
+manifest_version = 1
+
+
+class Manifest:
+    """
+    Parsed values of files kept in a single file. Entries are validated by modification time
+    and size of source files, so only changed files are parsed again. Values are stored marshalled,
+    so every get returns a fresh copy that can be modified by the caller.
+    If root is None, entries are keyed by absolute paths, otherwise by paths relative to root.
+    If scope is set, only entries of files inside the scope directory are saved.
+    """
+
+    def __init__(self, root, file: str):
+        self.root = root
+        self.file = file
+        self.scope = None
+        self.entries = {}  # path -> (mtime_ns, size, marshalled value)
+        self.used = set()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _header(self):
+        return (manifest_version, sys.version_info[:2])
+
+    def _key(self, path):
+        if self.root is None:
+            return os.path.abspath(path)
+        return os.path.relpath(path, self.root)
+
+    def load(self):
+        """Read entries from the file, entries that are already in memory take precedence"""
+        if not self.file:
+            return self
+        try:
+            with open(self.file, "rb") as f:
+                header, entries = marshal.load(f)
+        except FileNotFoundError:
+            return self
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            logger.warning("Invalid manifest %s: %s", self.file, e)
+            return self
+        if header == self._header() and isinstance(entries, dict):
+            entries.update(self.entries)
+            self.entries = entries
+        return self
+
+    def attach(self, file: str, scope=None):
+        """Start using another file for persistent storage, only files inside scope directory are kept in it"""
+        self.scope = None if scope is None else os.path.abspath(scope)
+        if file != self.file:
+            self.file = file
+            self.load()
+        return self
+
+    def _in_scope(self, key):
+        path = key if self.root is None else os.path.join(self.root, key)
+        try:
+            return os.path.commonpath((self.scope, os.path.abspath(path))) == self.scope
+        except ValueError:  # paths on different drives
+            return False
+
+    def save(self, prune_unused=True):
+        """
+        Write the file if anything is changed. Entries that weren't used since loading are dropped
+        if prune_unused is set, otherwise only entries of deleted files are dropped.
+        Entries of files outside of scope are kept in memory, but not written.
+        """
+        if not self.file:
+            return
+        if prune_unused:
+            keep = self.used.__contains__
+        else:
+            keep = os.path.isfile if self.root is None else lambda k: os.path.isfile(os.path.join(self.root, k))
+        entries = {k: v for k, v in self.entries.items() if keep(k)}
+        if len(entries) != len(self.entries):
+            self.entries = entries
+            self.dirty = True
+        if not self.dirty:
+            return
+        if self.scope is not None:
+            entries = {k: v for k, v in entries.items() if self._in_scope(k)}
+        tmp = self.file + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                marshal.dump((self._header(), entries), f)
+            os.replace(tmp, self.file)
+            self.dirty = False
+        except OSError as e:
+            logger.debug("Can't save manifest %s: %s", self.file, e)
+
+    def get(self, path: str, parse_func):
+        """
+        Get parsed file from manifest or parse it with parse_func(path). Parsing errors are raised.
+        Can be called from several threads, parsing itself isn't locked.
+        """
+        st = os.stat(path)
+        key = self._key(path)
+        with self.lock:
+            self.used.add(key)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self.hits += 1
+                return marshal.loads(entry[2])
+            self.misses += 1
+            self.entries.pop(key, None)
+
+        value = parse_func(path)
+        try:
+            data = marshal.dumps(value)
+        except ValueError:
+            logger.debug("%s can't be stored in manifest", path)
+            return value
+        with self.lock:
+            self.entries[key] = (st.st_mtime_ns, st.st_size, data)
+            self.dirty = True
+        return value
+
+    def parse(self, path: str, parse_func, default=None):
+        """Same as get(), but errors are logged and default is returned"""
+        try:
+            return self.get(path, parse_func)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            logger.error("%s: %s", path, e)
+            return default
+
+    @property
+    def nbytes(self):
+        return sum(len(entry[2]) for entry in self.entries.values())
+
+    def stats(self):
+        return f"{len(self.entries)} entries, {self.nbytes / 1024:.0f} KiB, " \
+            f"{self.hits} from cache, {self.misses} parsed"
@@ -0,0 +1,100 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Calculation of character vertices hidden under cloth. This module doesn't use bpy.
+
+import numpy
+
+from . import spatial
+from .binding import Geometry
+
+
+def get_cast_points(bmin: numpy.ndarray, bmax: numpy.ndarray):
+    center = (bmin + bmax) / 2
+    size = (bmax - bmin).max()
+
+    points = numpy.vstack((center - size, center, center + size))
+    return [
+        numpy.array((points[x][0], points[y][1], points[z][2]))
+        for x in range(3) for y in range(3) for z in range(3)
+        if x != 1 or y != 1 or z != 1
+    ]
+
+
+def bbox_mask(verts: numpy.ndarray, bbox):
+    return ((verts >= bbox[0]) & (verts <= bbox[1])).all(1)
+
+
+# Remove vertices of faces that are partially outside of the mask
+def shrink_mask(mask: numpy.ndarray, polys: numpy.ndarray):
+    valid = polys >= 0
+    inside = mask[polys] | ~valid
+    boundary = polys[~inside.all(1)]
+    mask[boundary[boundary >= 0]] = False
+
+
+def merge_meshes(meshes):
+    """Merge list of (verts, polys) pairs into a single mesh"""
+    width = max(polys.shape[1] for _, polys in meshes)
+    verts = []
+    polys = []
+    offset = 0
+    for v, p in meshes:
+        p2 = numpy.full((len(p), width), -1, dtype=numpy.int64)
+        p2[:, :p.shape[1]] = numpy.where(p >= 0, p + offset, -1)
+        verts.append(v)
+        polys.append(p2)
+        offset += len(v)
+    return numpy.concatenate(verts), numpy.concatenate(polys)
+
+
+def calculate_mask(char_geom: Geometry, asset_tree: spatial.TriTree, match: numpy.ndarray = None):
+    """
+    Find character vertices covered by cloth. Only vertices selected by match boolean array are checked.
+    Rays are cast from points around the character to all remaining vertices at once.
+    A vertex stops being checked after two rays reach it unobstructed.
+    """
+    verts = char_geom.verts
+    result = numpy.zeros(len(verts), dtype=bool)
+    idx = numpy.arange(len(verts)) if match is None else match.nonzero()[0]
+
+    # if vertex is too close to cloth, mark it as covered
+    close = asset_tree.find_nearest(verts[idx], 0.001)[1] >= 0
+    result[idx[close]] = True
+    idx = idx[~close]
+
+    has_cloth = numpy.zeros(len(idx), dtype=bool)
+    misses = numpy.zeros(len(idx), dtype=numpy.uint8)
+    active = numpy.arange(len(idx))
+    for cast_point in get_cast_points(*char_geom.bbox):
+        if len(active) == 0:
+            break
+        co = verts[idx[active]]
+        hit = asset_tree.segments_hit(cast_point, co)
+        has_cloth[active[hit]] = True
+        # Vertex is not blocked by cloth. Maybe blocked by the body itself?
+        rest = (~hit).nonzero()[0]
+        miss = active[rest[~char_geom.tree.segments_hit(cast_point, co[rest], 0.99)]]
+        misses[miss] += 1
+        done = miss[misses[miss] >= 2]
+        has_cloth[done] = False
+        active = active[misses[active] < 2]
+
+    result[idx[has_cloth]] = True
+    shrink_mask(result, char_geom.polys)
+    return result
@@ -20,7 +20,7 @@
 
 import re, typing, logging
 
-import bpy, mathutils  # pylint: disable=import-error
+import bpy  # pylint: disable=import-error
 
 from . import charlib, morpher_cores, materials, fitting, fit_calc, sliding_joints, rigging, utils
 
@@ -28,6 +28,9 @@ logger = logging.getLogger(__name__)
 
 sep_re = re.compile(r"[ _-]")
 
+# in live rig mode full rig update runs after morphing is paused for this many seconds
+rig_update_delay = 0.5
+
 def prefixed_prop(prefix, prop):
     return (prefix + prop.keywords["name"], prop)
 
@@ -76,6 +79,7 @@ class Morpher:
     meta_prev: dict[str, float]
     categories: list[tuple[str, str, str]] = []
     rfc: fit_calc.RiggerFitCalculator = None
+    _rig_timer = None
 
     presets: dict[str, dict] = {}
     presets_list = [("_", "(reset)", "")]
@@ -100,7 +104,7 @@ class Morpher:
         self.materials = materials.Materials(core.obj)
         if core.obj:
             self.fitter = fitting.Fitter(self)
-        self.sj_calc = sliding_joints.SJCalc(core.char, self.rig, self.get_co if core.check_vertex_count() else None)
+        self.sj_calc = sliding_joints.SJCalc(core.char, self.rig, core.get_final if core.check_vertex_count() else None)
 
     def __bool__(self):
         return self.core.obj is not None
@@ -108,9 +112,6 @@ class Morpher:
     def __getattr__(self, attr):
         return getattr(self.core, attr)
 
-    def get_co(self, i):
-        return mathutils.Vector(self.core.get_final()[i])
-
     def update_L1_idx(self):
         try:
             self.L1_idx = next((i for i, item in enumerate(self.L1_list) if item[0] == self.core.L1))
@@ -149,6 +150,8 @@ class Morpher:
         if self.core.error:
             return
         self.core.update()
+        # morphing only moves vertices, it shouldn't invalidate vertex groups and other data cached for the character
+        utils.mesh_own_update(self.core.obj.data)
         self.fitter.refit_all()
         self.sj_calc.recalc()
         self.update_rig()
@@ -314,7 +317,36 @@ class Morpher:
     def update_rig(self):
         if self.rig is None:
             return
-        self.run_rigger(run_func=self.rig_handler.on_update)
+        handler = self.rig_handler
+        if bpy.context.window_manager.charmorph_ui.rig_live and handler.supports_follow and not handler.slow:
+            self.run_rigger(run_func=self._rig_follow)
+            self._schedule_rig_update()
+        else:
+            self.run_rigger(run_func=self.rig_handler.on_update)
+
+    def _rig_follow(self, rigger):
+        t = utils.Timer()
+        moved = rigger.follow(self.rig, self.rig_handler.get_bones())
+        t.time(f"rig follow total, {moved} bones moved")
+
+    # Property update callbacks don't tell when slider is released,
+    # so full rig update is delayed until morphing is paused
+    def _schedule_rig_update(self):
+        if self._rig_timer is None:
+            self._rig_timer = self._rig_full_update
+        if bpy.app.timers.is_registered(self._rig_timer):
+            bpy.app.timers.unregister(self._rig_timer)
+        bpy.app.timers.register(self._rig_timer, first_interval=rig_update_delay)
+
+    def _rig_full_update(self):
+        if self.rig is None or not self.check_obj():
+            return None
+        t = utils.Timer()
+        wm = bpy.context.window_manager
+        with bpy.context.temp_override(window=bpy.context.window or next(iter(wm.windows), None)):
+            self.run_rigger(run_func=self.rig_handler.on_update)
+        t.time("rig full update")
+        return None
 
     def _run_rigger(self, rigger):
         bpy.context.view_layer.objects.active = self.rig
@@ -340,21 +372,19 @@ class Morpher:
         rigger = rigging.Rigger(bpy.context)
         conf = self.rig_handler.conf
 
-        def add_char_joints(joints):
+        def add_char_joints(file, groups=None):
+            v = utils.get_morphed_numpy(self.core.obj) if manual_sculpt else verts
             if self.core.alt_topo and manual_sculpt:
                 if self.rfc is None:
                     self.rfc = fit_calc.RiggerFitCalculator(self)
-                joints = self.rfc.transfer_weights_get(self.core.obj, joints)
-                v = verts_alt
+                rigger.joints_from_file(self.rfc.transfer_weights_get(self.core.obj, groups or file), v)
             else:
-                v = verts
-            rigger.joints_from_file(joints,
-                utils.get_morphed_numpy(self.core.obj) if manual_sculpt else v)
+                rigger.joints_from_regressor(charlib.joint_regressor(file), v)
 
         if manual_joints or not conf.joints:
             rigger.joints_from_char(self.core.obj, verts_alt)
         else:
-            add_char_joints(conf.joints)
+            add_char_joints(conf.joints_file, conf.joints)
 
         self.rig_handler.tweaks = rigging.unpack_tweaks(conf.parent.dirpath, conf.tweaks)
         rigger.set_opts(conf.bones)
@@ -366,7 +396,7 @@ class Morpher:
                     if j.verts == "char":
                         add_char_joints(j.file)
                     elif j.verts == "asset":
-                        rigger.joints_from_file(j.file, afd.geom.verts)
+                        rigger.joints_from_regressor(charlib.joint_regressor(j.file), afd.geom.verts)
                     else:
                         logger.error('Unknown verts source "%s" for asset %s', j["verts"], afd.obj.name)
 
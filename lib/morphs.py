@@ -517,9 +517,9 @@ def charmorph_to_mblab(data: dict):
 
 
 def load_morph_data(fn: str):
+    if fn[-5:] == ".yaml":
+        return utils.load_yaml_file(fn)
     with open(fn, "r", encoding="utf-8") as f:
-        if fn[-5:] == ".yaml":
-            return utils.load_yaml(f)
         if fn[-5:] == ".json":
             return mblab_to_charmorph(json.load(f))
     return None
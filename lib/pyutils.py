@@ -0,0 +1,241 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Helpers that don't depend on bpy, so they can be used from worker threads
+# and from scripts running outside of Blender
+
+import os, time, struct, logging, zipfile, hashlib, collections
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    def __init__(self):
+        self.t = time.perf_counter()
+
+    def time(self, name):
+        t2 = time.perf_counter()
+        logger.debug("%s: %s", name, t2 - self.t)
+        self.t = t2
+
+
+# Timer that also keeps stage durations, so a whole profile can be logged at once
+class StageTimer(Timer):
+    def __init__(self, title):
+        super().__init__()
+        self.title = title
+        self.start = self.t
+        self.stages = []
+
+    def time(self, name):
+        t = self.t
+        super().time(name)
+        self.stages.append((name, self.t - t))
+
+    def report(self):
+        logger.info("%s: %.3fs total; %s", self.title, time.perf_counter() - self.start,
+                    ", ".join(f"{name} {t:.3f}s" for name, t in self.stages))
+        return self.stages
+
+
+class named_lazyprop:
+    __slots__ = ("fn", "name")
+
+    def __init__(self, name, fn):
+        self.fn = fn
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return None
+        value = self.fn(instance)
+        setattr(instance, self.name, value)
+        return value
+
+
+class lazyproperty(named_lazyprop):
+    __slots__ = ()
+
+    def __init__(self, fn):
+        super().__init__(fn.__name__, fn)
+
+
+# Least recently used cache with memory accounting.
+# Size of cached values is taken from their nbytes attribute. It is rechecked when an item is accessed
+# because values can build their search structures lazily. Items with different version are treated as missing.
+class LRUCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.items = collections.OrderedDict()  # key -> [value, version, size]
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def _resize(self, item):
+        size = getattr(item[0], "nbytes", 0)
+        self.nbytes += size - item[2]
+        item[2] = size
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self.items) > 1:
+            key, item = self.items.popitem(last=False)
+            self.nbytes -= item[2]
+            self.evictions += 1
+            logger.debug("cache evict %s: %s", key, self.stats())
+
+    def get(self, key, version=None):
+        item = self.items.get(key)
+        if item is None or item[1] != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        self._resize(item)
+        self._evict()
+        return item[0]
+
+    def put(self, key, value, version=None):
+        self.pop(key)
+        item = [value, version, 0]
+        self.items[key] = item
+        self._resize(item)
+        self._evict()
+
+    def get_or_create(self, key, func, version=None):
+        result = self.get(key, version)
+        if result is None:
+            result = func()
+            self.put(key, result, version)
+        return result
+
+    def pop(self, key):
+        item = self.items.pop(key, None)
+        if item is None:
+            return None
+        self.nbytes -= item[2]
+        return item[0]
+
+    def clear(self):
+        self.items.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return f"{len(self.items)} items, {self.nbytes / 1048576:.1f} of {self.max_bytes / 1048576:.0f} MiB, " \
+            f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions"
+
+
+def array_digest(*arrays) -> str:
+    """Hash of array contents, shapes and types for use in cache keys"""
+    h = hashlib.blake2b(digest_size=16)
+    for arr in arrays:
+        arr = numpy.ascontiguousarray(arr)
+        h.update(f"{arr.dtype.str}{arr.shape}".encode())
+        h.update(arr.reshape(-1).view(numpy.uint8))
+    return h.hexdigest()
+
+
+def thread_count():
+    return min(8, os.cpu_count() or 1)
+
+
+# Map func over items using a thread pool. Results are returned in the order of items.
+# Only use it for code that doesn't touch bpy, numpy releases GIL in most heavy operations.
+def parallel_map(func, items, max_workers=None):
+    items = list(items)
+    if max_workers is None:
+        max_workers = thread_count()
+    max_workers = min(max_workers, len(items))
+    if max_workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(func, items))
+
+
+def timed(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t
+
+
+vg_weight_step = 1 / 1024
+
+
+# VertexGroup.add() is slow to call for every vertex,
+# so weights are quantized and vertices with equal weights are added at once.
+# With step=None weights are written exactly, only vertices with exactly equal weights are merged.
+def vg_add_bulk(vg, idx, weights, step=vg_weight_step):
+    idx = numpy.asarray(idx).reshape(-1)
+    weights = numpy.asarray(weights, dtype=numpy.float64).reshape(-1)
+    if step is None:
+        levels = weights.astype(numpy.float32)
+    else:
+        levels = numpy.rint(weights / step).astype(numpy.int64)
+    order = numpy.argsort(levels, kind="stable")
+    levels, starts = numpy.unique(levels[order], return_index=True)
+    for level, group in zip(levels, numpy.split(idx[order], starts[1:])):
+        if step is None:
+            vg.add(group.tolist(), float(level), 'REPLACE')
+        elif level > 0:
+            vg.add(group.tolist(), float(level * step), 'REPLACE')
+
+
+# Load all arrays from .npz file. Arrays stored without compression (numpy.savez) are memory mapped
+# instead of being read, compressed ones are loaded as usual.
+def load_npz(path, mmap=True):
+    result = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if not info.filename.endswith(".npy"):
+                continue
+            key = info.filename[:-4]
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                arr = _npz_mmap_member(path, f, info)
+                if arr is not None:
+                    result[key] = arr
+                    continue
+            with zf.open(info) as member:
+                result[key] = numpy.lib.format.read_array(member)
+    return result
+
+
+def _npz_mmap_member(path, f, info):
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if len(header) < 30 or header[:4] != b"PK\x03\x04":
+        return None
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    f.seek(info.header_offset + 30 + name_len + extra_len)
+    version = numpy.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(f)
+    else:
+        return None
+    if dtype.hasobject or 0 in shape:
+        return None
+    return numpy.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape, order="F" if fortran else "C")
@@ -18,12 +18,12 @@
 #
 # Copyright (C) 2020-2021 Michael Vigovsky
 
-import typing, logging, math, os
+import typing, logging, math, os, numpy
 
 import bpy                                   # pylint: disable=import-error
 from mathutils import Vector, Quaternion     # pylint: disable=import-error, no-name-in-module
 
-from . import sliding_joints, utils
+from . import binding, sliding_joints, utils
 
 logger = logging.getLogger(__name__)
 
@@ -100,6 +100,8 @@ class RigHandler(utils.ObjTracker):
     tweaks = ((), (), ())
     err = None
     slow = False
+    # live follow moves joint bones of the rig itself, so it works only when they are the deform bones
+    supports_follow = True
 
     def __init__(self, morpher, rig, conf):
         super().__init__(rig)
@@ -151,6 +153,7 @@ class RigHandler(utils.ObjTracker):
 
 class ArpRigHandler(RigHandler):
     slow = True
+    supports_follow = False
 
     def get_bones(self):
         return layer_joints(self.obj, self.conf.arp_reference_layer)
@@ -264,18 +267,19 @@ class Rigger:
         self.result = True
         self._bones = None
 
+    def joints_from_regressor(self, regressor: binding.JointRegressor, verts):
+        for name, co in zip(regressor.names, regressor.positions(verts)):
+            self.jdata[name] = Vector(co)
+
     def joints_from_char(self, char, verts=None):
-        self.jdata = utils.get_vg_avg(char, verts)
+        if verts is None:
+            verts = utils.verts_to_numpy(char.data.vertices)
+        names, idx, weights = utils.vg_weights_to_arrays(char, lambda name: name.startswith("joint_"))
+        self.jdata = {}
+        self.joints_from_regressor(binding.JointRegressor.from_groups(zip(names, idx, weights)), verts)
 
     def joints_from_file(self, file, verts):
-        for name, idx, weights in utils.vg_read(file):
-            if not name.startswith("joint_"):
-                continue
-            item = [0, Vector()]
-            self.jdata[name] = item
-            for i, weight in zip(idx, weights):
-                item[0] += weight
-                item[1] += Vector(verts[i]) * weight
+        self.joints_from_regressor(binding.JointRegressor.from_groups(utils.vg_read(file)), verts)
 
     def set_opts(self, opts):
         if not opts:
@@ -330,10 +334,10 @@ class Rigger:
         if attr == "head" and utils.is_true(self.get_opt(bone, "connected")) and bone.parent:
             bone = bone.parent
             attr = "tail"
-        item = self.jdata.get(f"joint_{bone.name}_{attr}")
-        if not item or item[0] < 1e-10:
+        pos = self.jdata.get(f"joint_{bone.name}_{attr}")
+        if pos is None:
             return None
-        pos = item[1] / item[0]
+        pos = pos.copy()
         offs = self.get_opt(bone, "offs_" + attr)
         if offs and len(offs) == 3:
             pos += Vector(tuple(offs))
@@ -408,6 +412,57 @@ class Rigger:
 
         return self.result
 
+    def follow(self, rig, lst=None, tolerance=1e-5):
+        """
+        Fast approximate version of run() for live morphing. Joint positions are written to all bones at once,
+        bone rolls and bbones are left for the full run(). Bones that moved less than tolerance keep
+        their positions, and edit mode isn't entered at all if nothing moved. Returns count of moved bones.
+        """
+        t = utils.Timer()
+        bones = rig.data.bones
+        index = {bone.name: i for i, bone in enumerate(bones)}
+        heads = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+        tails = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+        bones.foreach_get("head_local", heads)
+        bones.foreach_get("tail_local", tails)
+        heads = heads.reshape(-1, 3)
+        tails = tails.reshape(-1, 3)
+        new_heads = heads.copy()
+        new_tails = tails.copy()
+
+        for bone, attr in get_joints(rig) if lst is None else lst:
+            pos = self.joint_position(bone, attr)
+            if pos:
+                (new_heads if attr == "head" else new_tails)[index[bone.name]] = pos
+            else:
+                logger.error("No data for joint %s_%s", bone.name, attr)
+                self.result = False
+        for i, bone in enumerate(bones):
+            if bone.use_connect and bone.parent:
+                new_heads[i] = new_tails[index[bone.parent.name]]
+
+        moved = (numpy.abs(new_heads - heads).max(axis=1) > tolerance) | \
+            (numpy.abs(new_tails - tails).max(axis=1) > tolerance)
+        new_heads[~moved] = heads[~moved]
+        new_tails[~moved] = tails[~moved]
+        t.time("rig follow joints")
+        if not moved.any():
+            return 0
+
+        self.context.view_layer.objects.active = rig
+        bpy.ops.object.mode_set(mode="EDIT")
+        t.time("rig follow edit mode")
+        try:
+            edit_bones = rig.data.edit_bones
+            order = numpy.array([index[bone.name] for bone in edit_bones], dtype=numpy.int64)
+            edit_bones.foreach_set("head", new_heads[order].reshape(-1))
+            edit_bones.foreach_set("tail", new_tails[order].reshape(-1))
+            t.time("rig follow write")
+        finally:
+            bpy.ops.object.mode_set(mode="OBJECT")
+            t.time("rig follow object mode")
+        return int(moved.sum())
+
 
 bbone_attributes = [
     'bbone_segments', 'use_endroll_as_inroll',
@@ -429,29 +484,36 @@ __blender3_bbone_attributes()
 
 
 def rigify_finalize(rig, char):
-    vgs = char.vertex_groups
-    for bone in rig.data.bones:
-        is_org = bone.name.startswith("ORG-")
-        if is_org or bone.name.startswith("MCH-"):
-            if bone.name in vgs:
-                bone.use_deform = True
-            if is_org:
-                handles = [bone.bbone_custom_handle_start, bone.bbone_custom_handle_end]
-                for i, b in enumerate(handles):
-                    if b and b.name.startswith("ORG-"):
-                        handles[i] = rig.data.bones.get("DEF-" + b.name[4:], b)
-
-                if any(handles):
-                    def_bone = rig.data.bones.get("DEF-" + bone.name[4:], bone)
-                    if def_bone is not bone and (
-                            def_bone.bbone_segments == 1
-                            or def_bone.bbone_handle_type_start == "AUTO"):
-                        for attr in bbone_attributes:
-                            setattr(def_bone, attr, getattr(bone, attr))
-                    if handles[0]:
-                        def_bone.bbone_custom_handle_start = handles[0]
-                    if handles[1]:
-                        def_bone.bbone_custom_handle_end = handles[1]
+    vgs = {vg.name for vg in char.vertex_groups}
+    bones = rig.data.bones
+    by_name = {bone.name: bone for bone in bones}
+
+    deform = numpy.empty(len(bones), dtype=bool)
+    bones.foreach_get("use_deform", deform)
+    for i, name in enumerate(by_name):
+        if (name.startswith("ORG-") or name.startswith("MCH-")) and name in vgs:
+            deform[i] = True
+    bones.foreach_set("use_deform", deform)
+
+    for name, bone in by_name.items():
+        if not name.startswith("ORG-"):
+            continue
+        handles = [bone.bbone_custom_handle_start, bone.bbone_custom_handle_end]
+        for i, b in enumerate(handles):
+            if b and b.name.startswith("ORG-"):
+                handles[i] = by_name.get("DEF-" + b.name[4:], b)
+
+        if any(handles):
+            def_bone = by_name.get("DEF-" + name[4:], bone)
+            if def_bone is not bone and (
+                    def_bone.bbone_segments == 1
+                    or def_bone.bbone_handle_type_start == "AUTO"):
+                for attr in bbone_attributes:
+                    setattr(def_bone, attr, getattr(bone, attr))
+            if handles[0]:
+                def_bone.bbone_custom_handle_start = handles[0]
+            if handles[1]:
+                def_bone.bbone_custom_handle_end = handles[1]
     # Set ease in/out for pose bones or not?
 
 
@@ -473,8 +535,7 @@ def unpack_tweaks(path: str, tweaks, stages: tuple[list, list, list] = None, dep
     for tweak in tweaks:
         if isinstance(tweak, str):
             newpath = os.path.join(path, tweak)
-            with open(newpath, "r", encoding="utf-8") as f:
-                unpack_tweaks(os.path.dirname(newpath), utils.load_yaml(f), stages, depth + 1)
+            unpack_tweaks(os.path.dirname(newpath), utils.load_yaml_file(newpath), stages, depth + 1)
         elif tweak.get("stage") == "pre":
             stages[0].append(tweak)
         elif tweak.get("tweak") == "rigify_sliding_joint":
@@ -487,13 +548,6 @@ def unpack_tweaks(path: str, tweaks, stages: tuple[list, list, list] = None, dep
     return stages
 
 
-def find_constraint(bone, rig, typ, target):
-    for c in bone.constraints:
-        if c.type == typ and c.target == rig and (target is None or c.subtarget == target):
-            return c
-    return None
-
-
 def set_bone_layers(rig, bone, val: str):
     is_collections = hasattr(bone, "collections")
     legacy_layers = [False] * 32
@@ -581,91 +635,197 @@ def align_tweak(edit_bones, tweak: dict):
         edit_bones[bone].align_orientation(edit_bones[target])
 
 
-def apply_editmode_tweak(context, tweak):
-    t = tweak.get("tweak")
-    edit_bones = context.object.data.edit_bones
-    if t == "rigify_sliding_joint":
-        logger.warning("Legacy sliding_joint tweak is used")
-        sliding_joints.create(context, tweak["upper_bone"], tweak["lower_bone"], "." + tweak["side"])
-    elif t == "assign_parents":
-        for k, v in tweak["bones"].items():
-            bone = edit_bones.get(k)
-            if not bone:
-                logger.error(f'Bone "{k}" is not found')
-                continue
-            if v is not None:
-                v = edit_bones.get(v)
-                if not v:
-                    logger.error(f'Bone "{v}" is not found')
-                    continue
-            bone.parent = v
-    elif t == "align":
-        align_tweak(edit_bones, tweak)
-    elif tweak.get("select") == "edit_bone":
-        bone = edit_bones.get(tweak.get("bone"))
-        if not bone:
-            logger.error("Tweak bone not found: %s", tweak.get("bone"))
-            return
-        bone = process_bone_actions(edit_bones, bone, tweak)
-        for attr, val in tweak.get("set", {}).items():
-            if attr == "layers":
-                set_bone_layers(context.object.data, bone, val)
-            else:
-                setattr(bone, attr, val)
+def _constraint_index(bone, rig):
+    index = {}
+    for c in bone.constraints:
+        index.setdefault(c.name, c)
+        if getattr(c, "target", None) == rig:
+            index.setdefault((c.type, c.subtarget), c)
+            index.setdefault((c.type, None), c)
+    return index
 
 
-def apply_tweak(rig, tweak):
-    if tweak.get("tweak") == "rigify_sliding_joint":
-        logger.warning("Legacy sliding_joint tweak is used")
-        sliding_joints.finalize(rig, tweak["upper_bone"], tweak["lower_bone"], "." + tweak["side"], tweak["influence"])
-        return
+_constraint_keys = {"name", "target", "subtarget"}
 
-    select = tweak.get("select")
-    if select == "bone":
-        bones = rig.data.bones
-    else:
-        bones = rig.pose.bones
 
-    obj = bones.get(tweak["bone"])
+class TweakEngine:
+    """
+    Applies unpacked tweak stages to a rig. Bones, pose bones and constraints are resolved through name maps
+    that are built once and reused by all tweaks of a stage. Object mode tweaks don't need a mode switch,
+    all edit mode tweaks are applied during a single edit mode session.
+    """
 
-    if select == "pose_bone":
-        add = tweak.get("add")
-        if add is None:
-            pass
-        elif add == "constraint":
-            if not obj:
-                logger.error(f'Bone "{tweak["bone"]}" is not found')
+    def __init__(self, context, rig):
+        self.context = context
+        self.rig = rig
+        self._bones = None
+        self._pose_bones = None
+        self._edit_bones = None
+        self._constraints = {}
+
+    # Bone references become invalid when armature leaves edit mode, so maps are rebuilt after each mode switch
+    def invalidate(self):
+        self._bones = None
+        self._pose_bones = None
+        self._edit_bones = None
+        self._constraints.clear()
+
+    @property
+    def bones(self):
+        if self._bones is None:
+            self._bones = {bone.name: bone for bone in self.rig.data.bones}
+        return self._bones
+
+    @property
+    def pose_bones(self):
+        if self._pose_bones is None:
+            self._pose_bones = {bone.name: bone for bone in self.rig.pose.bones}
+        return self._pose_bones
+
+    @property
+    def edit_bones(self):
+        if self._edit_bones is None:
+            self._edit_bones = {bone.name: bone for bone in self.rig.data.edit_bones}
+        return self._edit_bones
+
+    def set_mode(self, mode):
+        if self.rig.mode == mode:
+            return
+        self.context.view_layer.objects.active = self.rig
+        bpy.ops.object.mode_set(mode=mode)
+        self.invalidate()
+
+    def find_constraint(self, bone, name, typ, target):
+        index = self._constraints.get(bone.name)
+        if index is None:
+            index = _constraint_index(bone, self.rig)
+            self._constraints[bone.name] = index
+        c = index.get(name)
+        if c is None:
+            c = index.get((typ, target))
+        return c
+
+    def run(self, stages, t=None):
+        """Apply (pre, edit, post) stages as returned by unpack_tweaks() and leave the rig in object mode"""
+        pre, edit, post = stages
+        if t is None:
+            t = utils.Timer()
+        if pre:
+            self.set_mode("OBJECT")
+            self.apply_stage(pre)
+            t.time("pre tweaks")
+        if edit:
+            self.set_mode("EDIT")
+            self.apply_edit_stage(edit)
+            t.time("edit mode tweaks")
+        self.set_mode("OBJECT")
+        if post:
+            self.apply_stage(post)
+            t.time("post tweaks")
+
+    def apply_stage(self, tweaks):
+        for tweak in tweaks:
+            self.apply(tweak)
+
+    def apply_edit_stage(self, tweaks):
+        for tweak in tweaks:
+            self.apply_edit(tweak)
+
+    def apply_edit(self, tweak):
+        t = tweak.get("tweak")
+        edit_bones = self.edit_bones
+        if t == "rigify_sliding_joint":
+            logger.warning("Legacy sliding_joint tweak is used")
+            sliding_joints.create(self.context, tweak["upper_bone"], tweak["lower_bone"], "." + tweak["side"])
+            self._edit_bones = None
+        elif t == "assign_parents":
+            for k, v in tweak["bones"].items():
+                bone = edit_bones.get(k)
+                if not bone:
+                    logger.error(f'Bone "{k}" is not found')
+                    continue
+                if v is not None:
+                    v = edit_bones.get(v)
+                    if not v:
+                        logger.error(f'Bone "{v}" is not found')
+                        continue
+                bone.parent = v
+        elif t == "align":
+            align_tweak(edit_bones, tweak)
+        elif tweak.get("select") == "edit_bone":
+            bone = edit_bones.get(tweak.get("bone"))
+            if not bone:
+                logger.error("Tweak bone not found: %s", tweak.get("bone"))
                 return
-            obj = obj.constraints.new(tweak.get("type"))
-            if hasattr(obj, "target"):
-                obj.target = rig
+            new_bone = process_bone_actions(self.rig.data.edit_bones, bone, tweak)
+            for attr, val in tweak.get("set", {}).items():
+                if attr == "layers":
+                    set_bone_layers(self.rig.data, new_bone, val)
+                else:
+                    setattr(new_bone, attr, val)
+            # Keep the map valid for new and renamed bones
+            edit_bones.pop(tweak.get("bone"), None)
+            edit_bones[bone.name] = bone
+            edit_bones[new_bone.name] = new_bone
+
+    def apply(self, tweak):
+        rig = self.rig
+        if tweak.get("tweak") == "rigify_sliding_joint":
+            logger.warning("Legacy sliding_joint tweak is used")
+            sliding_joints.finalize(
+                rig, tweak["upper_bone"], tweak["lower_bone"], "." + tweak["side"], tweak["influence"])
+            self._constraints.clear()
+            return
+
+        select = tweak.get("select")
+        if select == "bone":
+            bones = self.bones
         else:
-            logger.error("Invalid add operator: %s", repr(tweak))
-    elif select == "constraint":
-        bone = obj
-        if not bone:
-            logger.error(f'Bone "{tweak["bone"]}" is not found')
+            bones = self.pose_bones
+
+        bone = bones.get(tweak["bone"])
+        obj = bone
+
+        if select == "pose_bone":
+            add = tweak.get("add")
+            if add is None:
+                pass
+            elif add == "constraint":
+                if not bone:
+                    logger.error(f'Bone "{tweak["bone"]}" is not found')
+                    return
+                obj = bone.constraints.new(tweak.get("type"))
+                if hasattr(obj, "target"):
+                    obj.target = rig
+                self._constraints.pop(bone.name, None)
+            else:
+                logger.error("Invalid add operator: %s", repr(tweak))
+        elif select == "constraint":
+            if not bone:
+                logger.error(f'Bone "{tweak["bone"]}" is not found')
+                return
+            obj = self.find_constraint(bone, tweak.get("name", ""), tweak.get("type"), tweak.get("target_bone"))
+        elif select != "bone":
+            logger.error("Invalid tweak select: %s", repr(tweak))
             return
-        obj = bone.constraints.get(tweak.get("name", ""))
         if not obj:
-            obj = find_constraint(bone, rig, tweak.get("type"), tweak.get("target_bone"))
-    elif select != "bone":
-        logger.error("Invalid tweak select: %s", repr(tweak))
-        return
-    if not obj:
-        logger.error("Tweak object not found: %s", repr(tweak))
-        return
-    if tweak.get("action") == "remove":
-        bone.constraints.remove(obj)
-        return
-    for attr, val in tweak.get("set", {}).items():
-        if val and attr.startswith("bbone_custom_handle_"):
-            val = bones[val]
-        if isinstance(val, dict) and attr == "targets" and isinstance(obj, bpy.types.ArmatureConstraint):
-            for k, v in val.items():
-                t = obj.targets.new()
-                t.target = rig
-                t.subtarget = k
-                t.weight = v
-            continue
-        setattr(obj, attr, val)
+            logger.error("Tweak object not found: %s", repr(tweak))
+            return
+        if tweak.get("action") == "remove":
+            bone.constraints.remove(obj)
+            self._constraints.pop(bone.name, None)
+            return
+        values = tweak.get("set", {})
+        for attr, val in values.items():
+            if val and attr.startswith("bbone_custom_handle_"):
+                val = bones[val]
+            if isinstance(val, dict) and attr == "targets" and isinstance(obj, bpy.types.ArmatureConstraint):
+                for k, v in val.items():
+                    t = obj.targets.new()
+                    t.target = rig
+                    t.subtarget = k
+                    t.weight = v
+                continue
+            setattr(obj, attr, val)
+        if obj is not bone and not _constraint_keys.isdisjoint(values):
+            self._constraints.pop(bone.name, None)
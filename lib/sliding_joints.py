@@ -23,7 +23,7 @@
 # https://www.youtube.com/watch?v=c7csuy-09k8
 #
 
-import re, math, logging
+import re, math, logging, numpy
 
 import bpy  # pylint: disable=import-error
 from rna_prop_ui import rna_idprop_ui_create  # pylint: disable=import-error, no-name-in-module
@@ -43,15 +43,107 @@ def _parse_joint(item: dict):
         yield item["upper_bone"], item["lower_bone"], side
 
 
+class SJProgram:
+    """
+    Influence expressions of sliding joints compiled for batch evaluation.
+    Vertex pairs of all verts_* variables are gathered into index arrays, so all average distances
+    are calculated in one pass over the vertices. Joints sharing the same expression are evaluated
+    at once with numpy arrays as variables.
+    """
+
+    def __init__(self, items):
+        self.targets = []  # (rig, joint name) for every calculated joint
+        self.static = []  # (rig, joint name, value) for joints with fixed influence
+        self.groups = {}  # (calc, variable names) -> (code, target indices, variable indices)
+        pairs = []
+        pair_var = []
+        var_count = 1  # variable 0 is used for empty vertex lists, its value is 1
+
+        for rig, name, data in items:
+            calc = data["calc"]
+            if not isinstance(calc, str) or eval_unsafe.search(calc):
+                logger.error("bad calc: %s", calc)
+                self.static.append((rig, name, 0))
+                continue
+            var_names = []
+            var_idx = []
+            for k, v in data.items():
+                if not k.startswith("verts_"):
+                    continue
+                var_names.append(k)
+                if v:
+                    var_idx.append(var_count)
+                    pairs.extend(v)
+                    pair_var.extend([var_count] * len(v))
+                    var_count += 1
+                else:
+                    var_idx.append(0)
+            key = (calc, tuple(var_names))
+            group = self.groups.get(key)
+            if group is None:
+                try:
+                    code = compile(calc, "", "eval")
+                except SyntaxError as e:
+                    logger.error("bad calc: %s", e)
+                    self.static.append((rig, name, 0))
+                    continue
+                group = (code, [], [])
+                self.groups[key] = group
+            group[1].append(len(self.targets))
+            group[2].append(var_idx)
+            self.targets.append((rig, name))
+
+        pairs = numpy.array(pairs, dtype=numpy.int64).reshape(-1, 2)
+        self.a = pairs[:, 0]
+        self.b = pairs[:, 1]
+        self.pair_var = numpy.array(pair_var, dtype=numpy.int64)
+        self.var_len = numpy.bincount(self.pair_var, minlength=var_count)
+        self.var_len[0] = 1
+        # var_idx is (variable, target) array, int dtype is explicit because calcs without variables have empty lists
+        self.groups = [(code, numpy.array(targets),
+                        numpy.array(var_idx, dtype=numpy.int64).reshape(len(targets), -1).T, names)
+                       for (_, names), (code, targets, var_idx) in self.groups.items()]
+
+    def distances(self, verts: numpy.ndarray):
+        """Average distances for all variables"""
+        d = numpy.linalg.norm(verts[self.a] - verts[self.b], axis=1)
+        result = numpy.bincount(self.pair_var, weights=d, minlength=len(self.var_len)) / self.var_len
+        result[0] = 1
+        return result
+
+    def evaluate(self, verts: numpy.ndarray):
+        """Get influence values in order of targets"""
+        dists = self.distances(verts)
+        result = numpy.zeros(len(self.targets))
+        for code, targets, var_idx, names in self.groups:
+            try:
+                with numpy.errstate(all="raise"):
+                    value = eval(code, {"__builtins__": None}, dict(zip(names, dists[var_idx])))
+                result[targets] = numpy.broadcast_to(numpy.asarray(value, dtype=numpy.float64), targets.shape)
+                continue
+            except Exception:
+                pass
+            # expressions like conditionals can't be evaluated for arrays, fall back to one joint at a time
+            for i, target in enumerate(targets):
+                try:
+                    result[target] = eval(code, {"__builtins__": None},
+                                          {k: float(v) for k, v in zip(names, dists[var_idx[:, i]])})
+                except Exception as e:
+                    logger.error("bad calc: %s", e, exc_info=e)
+                    result[target] = 0
+        return result
+
+
 class SJCalc:
     rig_name = ""
     influence: dict[str, dict[str, float]] = {}
     calc_error = False
+    _program: SJProgram = None
 
-    def __init__(self, char: charlib.Character, rig, get_co):
+    def __init__(self, char: charlib.Character, rig, get_verts):
         self.rig = rig
         self.char = char
-        self.get_co = get_co
+        self.get_verts = get_verts
         if rig:
             self.rig_name = rig.data.get("charmorph_rig_type")
 
@@ -64,49 +156,41 @@ class SJCalc:
                 }
         else:
             self.influence = {
-                name: {k: self._calc_influence(v) for k, v in rig.sliding_joints.items()}
+                name: {k: self._static_influence(v) for k, v in rig.sliding_joints.items()}
                 for name, rig in self.char.armature.items() if rig.sliding_joints
             }
+            self.recalc()
 
     def _rig_joints(self, rig):
         return self.char.armature.get(rig, charlib.Armature).sliding_joints
 
-    def _calc_avg_dists(self, vert_pairs):
-        if not vert_pairs:
-            return 1
-        return sum((self.get_co(a) - self.get_co(b)).length for a, b in vert_pairs) / len(vert_pairs)
-
-    def _calc_influence(self, data):
+    def _static_influence(self, data):
         result = data.get("influence")
         if result is not None:
             return result
-        calc = data["calc"]
-        if not calc or not self.get_co:
+        if not data.get("calc") or not self.get_verts:
             return data.get("default_influence", 0)
+        return None
 
-        if isinstance(calc, str):
-            # Check for eval safety. Attacks like 9**9**9 are still possible, but it's quite useless
-            if eval_unsafe.search(calc):
-                logger.error("bad calc: %s", calc)
-                return 0
-            calc = compile(calc, "", "eval")
-            data["calc"] = calc
-
-        vals = {}
-        for k, v in data.items():
-            if k.startswith("verts_"):
-                vals[k] = self._calc_avg_dists(v)
-        try:
-            return eval(calc, {"__builtins__": None}, vals)
-        except Exception as e:
-            logger.error("bad calc: %s", e, exc_info=e)
-            return 0
-
-    def recalc(self):
+    def _compile(self):
+        items = []
         for rig, influence in self.influence.items():
             for k, v in self._rig_joints(rig).items():
                 if k in influence and "calc" in v:
-                    influence[k] = self._calc_influence(v)
+                    items.append((rig, k, v))
+        program = SJProgram(item for item in items if self._static_influence(item[2]) is None)
+        program.static.extend((rig, k, self._static_influence(v)) for rig, k, v in items
+                              if self._static_influence(v) is not None)
+        return program
+
+    def recalc(self):
+        if self._program is None:
+            self._program = self._compile()
+        for rig, name, value in self._program.static:
+            self.influence[rig][name] = value
+        if self._program.targets:
+            for (rig, name), value in zip(self._program.targets, self._program.evaluate(self.get_verts())):
+                self.influence[rig][name] = float(value)
 
     def _get_influence(self, item):
         for c in self._get_constraints(item):
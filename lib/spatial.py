@@ -0,0 +1,791 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Batched spatial queries in pure numpy.
+# They replace per-vertex mathutils KDTree/BVHTree calls and don't need bpy,
+# so they can be used in worker threads and outside of Blender.
+
+import itertools
+import numpy
+
+chunk_size = 4096
+# maximum number of (query, primitive) candidate pairs processed at once
+pair_chunk = 1 << 18
+# branching factor of box hierarchy
+tree_branch = 8
+# size of nodes used to skip queries that are farther than max_dist from the surface
+near_cull_size = 4096
+# rays per chunk used for ray casting
+ray_chunk = 256
+flt_epsilon = float(numpy.finfo(numpy.float32).eps)
+
+
+def polygons(faces) -> numpy.ndarray:
+    """Convert list of faces to 2D array padded with -1"""
+    if isinstance(faces, numpy.ndarray) and faces.ndim == 2:
+        return faces.astype(numpy.int64, copy=False)
+    lens = numpy.fromiter(map(len, faces), dtype=numpy.int64, count=len(faces))
+    if len(lens) == 0:
+        return numpy.empty((0, 3), dtype=numpy.int64)
+    flat = numpy.fromiter(itertools.chain.from_iterable(faces), dtype=numpy.int64, count=lens.sum())
+    maxlen = lens.max()
+    if lens.min() == maxlen:
+        return flat.reshape(-1, maxlen)
+    result = numpy.full((len(lens), maxlen), -1, dtype=numpy.int64)
+    result[numpy.arange(maxlen) < lens[:, None]] = flat
+    return result
+
+
+def triangulate(polys: numpy.ndarray):
+    """Fan triangulation, returns triangles and polygon index for every triangle"""
+    tris = []
+    tri_face = []
+    for i in range(1, polys.shape[1] - 1):
+        idx = (polys[:, i + 1] >= 0).nonzero()[0]
+        tris.append(numpy.stack((polys[idx, 0], polys[idx, i], polys[idx, i + 1]), axis=1))
+        tri_face.append(idx)
+    if not tris:
+        return numpy.empty((0, 3), dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64)
+    return numpy.concatenate(tris), numpy.concatenate(tri_face)
+
+
+def _dot(a, b):
+    return numpy.einsum("ij,ij->i", a, b)
+
+
+def closest_point_on_triangles(p, a, b, c):
+    ab = b - a
+    ac = c - a
+    ap = p - a
+    d1 = _dot(ab, ap)
+    d2 = _dot(ac, ap)
+    bp = p - b
+    d3 = _dot(ab, bp)
+    d4 = _dot(ac, bp)
+    cp = p - c
+    d5 = _dot(ab, cp)
+    d6 = _dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        denom = 1 / (va + vb + vc)
+        result = a + ab * (vb * denom)[:, None] + ac * (vc * denom)[:, None]
+
+        # Voronoi regions of edges and vertices, from the lowest priority to the highest
+        e1 = d4 - d3
+        e2 = d5 - d6
+        for mask, value in (
+            ((va <= 0) & (e1 >= 0) & (e2 >= 0), lambda: b + (c - b) * (e1 / (e1 + e2))[:, None]),
+            ((vb <= 0) & (d2 >= 0) & (d6 <= 0), lambda: a + ac * (d2 / (d2 - d6))[:, None]),
+            ((d6 >= 0) & (d5 <= d6), lambda: c),
+            ((vc <= 0) & (d1 >= 0) & (d3 <= 0), lambda: a + ab * (d1 / (d1 - d3))[:, None]),
+            ((d3 >= 0) & (d4 <= d3), lambda: b),
+            ((d1 <= 0) & (d2 <= 0), lambda: a),
+        ):
+            if mask.any():
+                result[mask] = value()[mask]
+
+    bad = ~numpy.isfinite(result).all(1)
+    if bad.any():  # degenerate triangles
+        result[bad] = a[bad]
+    return result
+
+
+def _cross(a, b):
+    result = numpy.empty_like(a)
+    result[:, 0] = a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1]
+    result[:, 1] = a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2]
+    result[:, 2] = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    return result
+
+
+def segments_intersect(orig, d, a, b, c, tmax):
+    """Moller-Trumbore test of segments orig + t * d, 0 < t <= tmax against triangles, both sides are hit"""
+    return _segments_intersect(orig, d, a, b - a, c - a, tmax)
+
+
+def _segments_intersect(orig, d, a, e1, e2, tmax):
+    return _rays_intersect(orig, d, a, e1, e2, tmax)[0]
+
+
+def _rays_intersect(orig, d, a, e1, e2, tmax):
+    """Moller-Trumbore test returning (hit mask, t, u, v)"""
+    p = _cross(d, e2)
+    det = _dot(e1, p)
+    s = orig - a
+    q = _cross(s, e1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        inv = 1 / det
+        u = _dot(s, p) * inv
+        v = _dot(d, q) * inv
+        t = _dot(e2, q) * inv
+        return (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0) & (t <= tmax), t, u, v
+
+
+def _rays_boxes(orig, inv_d, lo, hi, tmax):
+    """Slab test of rays against boxes, NaNs from rays parallel to box sides are ignored"""
+    with numpy.errstate(invalid="ignore"):
+        t1 = (lo - orig) * inv_d
+        t2 = (hi - orig) * inv_d
+    tnear = numpy.fmax(numpy.fmax.reduce(numpy.minimum(t1, t2), axis=-1), 0)
+    tfar = numpy.fmin(numpy.fmin.reduce(numpy.maximum(t1, t2), axis=-1), tmax)
+    # boxes at infinity are used as padding, they are never hit
+    return (tnear <= tfar) & (tnear < numpy.inf)
+
+
+def _box_dist2(p, lo, hi):
+    """Squared distances from points to boxes"""
+    d = lo - p
+    numpy.maximum(d, p - hi, out=d)
+    numpy.maximum(d, 0, out=d)
+    return numpy.einsum("...k,...k->...", d, d)
+
+
+def _box_dist2_range(p, lo, hi):
+    """Squared distances from points to boxes and to the farthest corners of boxes"""
+    a = lo - p
+    b = p - hi
+    far = numpy.minimum(a, b)
+    numpy.maximum(a, b, out=a)
+    numpy.maximum(a, 0, out=a)
+    return numpy.einsum("...k,...k->...", a, a), numpy.einsum("...k,...k->...", far, far)
+
+
+def _run_starts(q):
+    """Start positions of runs of equal values in sorted array"""
+    return numpy.flatnonzero(numpy.diff(q, prepend=-1))
+
+
+def _nth_smallest_per_run(d, starts, n):
+    """n-th smallest value of rows of d in every run of rows beginning at starts, inf for runs with fewer values"""
+    if n < d.shape[1]:
+        d = numpy.partition(d, n - 1, axis=1)[:, :n]
+    rows = numpy.diff(starts, append=len(d))
+    result = numpy.full(len(starts), numpy.inf)
+    prev = numpy.full(len(starts), -numpy.inf)
+    # every step finds the next distinct value and the number of values not greater than it
+    for _ in range(n):
+        cur = numpy.where(d > prev.repeat(rows)[:, None], d, numpy.inf)
+        cur = numpy.minimum.reduceat(cur.min(1), starts)
+        cnt = numpy.add.reduceat((d <= cur.repeat(rows)[:, None]).sum(1), starts)
+        found = (cnt >= n) & (result == numpy.inf)
+        result[found] = cur[found]
+        prev = cur
+    return result
+
+
+def _group_starts(keys: numpy.ndarray, n: int):
+    return numpy.searchsorted(keys, numpy.arange(n + 1))
+
+
+def _spread_bits(x):
+    x = (x | (x << 16)) & 0x030000FF
+    x = (x | (x << 8)) & 0x0300F00F
+    x = (x | (x << 4)) & 0x030C30C3
+    return (x | (x << 2)) & 0x09249249
+
+
+def _interleave(q):
+    return _spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << 1) | (_spread_bits(q[:, 2]) << 2)
+
+
+class MortonIndex:
+    """
+    Primitives sorted along Morton curve of their box centers with a box hierarchy over them.
+    Every node of the lowest level covers tree_branch consecutive primitives, every node of upper levels
+    covers tree_branch consecutive nodes of the level below. Boxes are built from boxes of the primitives,
+    so large primitives only enlarge boxes of their own nodes and don't slow down queries elsewhere.
+    """
+    bits = 10
+    _groups = None
+
+    def __init__(self, lo: numpy.ndarray, hi: numpy.ndarray):
+        self.count = len(lo)
+        if self.count:
+            self.box_lo = lo.min(0)
+            extent = hi.max(0) - self.box_lo
+        else:
+            self.box_lo = numpy.zeros(3)
+            extent = numpy.zeros(3)
+        # flat or degenerate axes shouldn't make cells too small
+        extent = numpy.maximum(extent, extent.max() * 1e-3 + 1e-30)
+        self.scale = ((1 << self.bits) - 1) / extent
+        self.codes = _interleave(self.quantize((lo + hi) * 0.5))
+        self.order = numpy.argsort(self.codes, kind="stable")
+        self.codes = self.codes[self.order]
+        self.prim_lo = lo[self.order]
+        self.prim_hi = self.prim_lo if hi is lo else hi[self.order]
+
+    @property
+    def nbytes(self):
+        result = self.codes.nbytes + self.order.nbytes + self.prim_lo.nbytes
+        if self.prim_hi is not self.prim_lo:
+            result += self.prim_hi.nbytes
+        if self._groups is not None:
+            result += sum(lo.nbytes + hi.nbytes for lo, hi in self._groups)
+        return result
+
+    def quantize(self, pts: numpy.ndarray) -> numpy.ndarray:
+        return ((pts - self.box_lo) * self.scale).clip(0, (1 << self.bits) - 1).astype(numpy.uint64)
+
+    @property
+    def groups(self):
+        """
+        Boxes of child nodes for every level from the root to the primitives, as (lo, hi) arrays of
+        (parent count, tree_branch, 3) shape. Child j of node i has index i * tree_branch + j on its level.
+        Missing children are padded with boxes at infinity, so they are never hit.
+        """
+        if self._groups is None:
+            groups = []
+            # Small margin protects from rounding errors at box sides.
+            # Boxes of points need no margin, distances to them are exact distances to the points.
+            pad = 0 if self.prim_hi is self.prim_lo else numpy.abs(self.prim_hi).max(initial=0) * flt_epsilon
+            lo = self.prim_lo - pad
+            hi = self.prim_hi + pad
+            while True:
+                size = -(-len(lo) // tree_branch) * tree_branch
+                groups.append(tuple(
+                    numpy.concatenate((a, numpy.full((size - len(a), 3), numpy.inf))).reshape(-1, tree_branch, 3)
+                    for a in (lo, hi)))
+                if len(lo) <= tree_branch:
+                    break
+                starts = numpy.arange(0, len(lo), tree_branch)
+                lo = numpy.minimum.reduceat(lo, starts)
+                hi = numpy.maximum.reduceat(hi, starts)
+            self._groups = groups[::-1]
+        return self._groups
+
+    def _dive(self, co, bound2, k):
+        """
+        Tighten squared distance bound2 in place by k-th nearest primitive of a single node with at least k primitives.
+        The node is found by greedy descent to the nearest child box, so the bound is usually close to the exact one.
+        """
+        groups = self.groups
+        node = numpy.zeros(len(co), dtype=numpy.int64)
+        size = tree_branch ** len(groups)
+        p = co[:, None]
+        for lo, hi in groups[:-1]:
+            if size // tree_branch < k:
+                break
+            size //= tree_branch
+            node = node * tree_branch + _box_dist2(p, lo[node], hi[node]).argmin(1)
+        prim = node[:, None] * size + numpy.arange(size)
+        valid = prim < self.count
+        prim[~valid] = 0
+        d = _box_dist2_range(p, self.prim_lo[prim], self.prim_hi[prim])[1]
+        d[~valid] = numpy.inf
+        d = numpy.partition(d, k - 1, axis=1)[:, k - 1]
+        # small margin protects from rounding errors
+        numpy.minimum(bound2, d * (1 + 1e-6) + 1e-24, out=bound2)
+
+    def _descend(self, co, bound2, k, min_size=1):
+        """
+        Get (query, node) pairs of the lowest level whose boxes are within squared distance bound2 of queries.
+        The descent stops at the level whose nodes cover min_size primitives or more.
+        If k > 0, bound2 is also tightened in place on every level: nodes of a level have the same size,
+        so any ceil(k / size) of them contain at least k primitives, which are not farther than the farthest
+        point of these node boxes.
+        """
+        groups = self.groups
+        # padding boxes are at infinity, they must not pass the bound
+        numpy.minimum(bound2, numpy.finfo(numpy.float64).max, out=bound2)
+        if k:
+            self._dive(co, bound2, k)
+        q = numpy.arange(len(co))
+        node = numpy.zeros(len(co), dtype=numpy.int64)
+        size = tree_branch ** len(groups)
+        for lo, hi in groups[:-1]:
+            if size // tree_branch < min_size:
+                break
+            size //= tree_branch
+            p = co[q, None]
+            lo = lo[node]
+            hi = hi[node]
+            if k and len(q):
+                near, d = _box_dist2_range(p, lo, hi)
+                # only the last node of a level can be partially filled
+                last = -(-self.count // size) - 1
+                if self.count - last * size < size:
+                    d[node[:, None] * tree_branch + numpy.arange(tree_branch) == last] = numpy.inf
+                # q is sorted, so pairs of every query are contiguous
+                starts = _run_starts(q)
+                qs = q[starts]
+                # small margin protects from rounding errors
+                d = _nth_smallest_per_run(d, starts, -(-k // size)) * (1 + 1e-6) + 1e-24
+                bound2[qs] = numpy.minimum(bound2[qs], d)
+            else:
+                near = _box_dist2(p, lo, hi)
+            row, child = (near <= bound2[q, None]).nonzero()
+            q = q[row]
+            node = node[row] * tree_branch + child
+        return q, node
+
+    def _candidates(self, co: numpy.ndarray, r: numpy.ndarray, k=0):
+        """
+        Yield (query, primitive, squared box distance) for primitives with boxes within distance r of queries,
+        chunk by chunk, so every chunk has a bounded number of candidates.
+        Pairs are sorted by query, primitives are numbered in Morton order.
+        If k > 0, r is an upper bound that is tightened so that at least k primitives remain for every query.
+        """
+        if self.count == 0 or len(co) == 0:
+            return
+        bound2 = numpy.square(r)
+        q, node = self._descend(co, bound2, k)
+        lo, hi = self.groups[-1]
+        step = pair_chunk // tree_branch
+        for i in range(0, len(q), step):
+            cq = q[i:i + step]
+            cnode = node[i:i + step]
+            d = _box_dist2(co[cq, None], lo[cnode], hi[cnode])
+            row, child = (d <= bound2[cq, None]).nonzero()
+            yield cq[row], cnode[row] * tree_branch + child, d[row, child]
+
+
+def _chunked(func, n, *arrays):
+    for i in range(0, n, chunk_size):
+        yield i, func(*(a[i:i + chunk_size] for a in arrays))
+
+
+def _concat_pairs(parts, nfields):
+    parts = list(parts)
+    if not parts:
+        return tuple(numpy.empty(0, dtype=numpy.int64) for _ in range(nfields))
+    result = []
+    for field in range(nfields):
+        arrays = [p[field] + offset if field == 0 else p[field] for offset, p in parts]
+        result.append(numpy.concatenate(arrays))
+    return tuple(result)
+
+
+def _per_query(arr, n):
+    arr = numpy.asarray(arr, dtype=numpy.float64)
+    return numpy.broadcast_to(arr, (n,)) if arr.ndim == 0 else arr
+
+
+def _smallest_per_query(q, d, nq, n):
+    """
+    q is sorted array of query indices, every query has at least n entries.
+    Returns (nq, n) indices of n entries with smallest d for every query, ordered by d.
+    """
+    starts = _group_starts(q, nq)
+    rank = numpy.arange(len(q)) - starts[q]
+    mat = numpy.full((nq, max(n, rank.max(initial=0) + 1)), numpy.inf)
+    mat[q, rank] = d
+    if mat.shape[1] > n:
+        sel = numpy.argpartition(mat, n - 1, axis=1)[:, :n]
+    else:
+        sel = numpy.broadcast_to(numpy.arange(n), (nq, n))
+    sel = numpy.take_along_axis(sel, numpy.take_along_axis(mat, sel, 1).argsort(1), 1)
+    return starts[:-1, None] + sel
+
+
+class PointTree(MortonIndex):
+    """Replacement for mathutils.kdtree.KDTree. index maps tree points to the returned indices"""
+    def __init__(self, pts: numpy.ndarray, index: numpy.ndarray = None):
+        pts = numpy.asarray(pts, dtype=numpy.float64).reshape(-1, 3)
+        super().__init__(pts, pts)
+        self.pts = self.prim_lo
+        self.index = self.order if index is None else index[self.order]
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self.index.nbytes
+
+    def _distances(self, co, r, k=0):
+        for q, p, d in self._candidates(co, r, k):
+            d = numpy.sqrt(d)
+            if not k:
+                mask = d <= r[q]
+                q, p, d = q[mask], p[mask], d[mask]
+            yield 0, (q, p, d)
+
+    def _range(self, co, r):
+        return _concat_pairs(self._distances(co, r), 3)
+
+    def find_range(self, co: numpy.ndarray, r):
+        """
+        Find all points within radius r (scalar or per query) of every co.
+        Returns flat (query, point, distance) arrays sorted by query and distance.
+        """
+        co = numpy.asarray(co, dtype=numpy.float64).reshape(-1, 3)
+        r = _per_query(r, len(co))
+        q, p, d = _concat_pairs(_chunked(self._range, len(co), co, r), 3)
+        order = numpy.lexsort((d, q))
+        return q[order], self.index[p[order]], d[order]
+
+    def _find_n(self, co, n):
+        # Points that are close along Morton curve give an upper bound for n-th distance.
+        # It isn't tight for points near discontinuities of Morton curve or far from the tree,
+        # so it is tightened further during the search, at least n points are left for every query.
+        wsize = min(self.count, n * 4)
+        pos = numpy.searchsorted(self.codes, _interleave(self.quantize(co)))
+        start = (pos - wsize // 2).clip(0, self.count - wsize)
+        d = self.pts[start[:, None] + numpy.arange(wsize)] - co[:, None]
+        d = numpy.einsum("ijk,ijk->ij", d, d)
+        # small margin protects from rounding errors
+        bound = numpy.sqrt(numpy.partition(d, n - 1, axis=1)[:, n - 1]) * (1 + 1e-7) + 1e-12
+        q, p, d = _concat_pairs(self._distances(co, bound, n), 3)
+        sel = _smallest_per_query(q, d, len(co), n)
+        return p[sel], d[sel]
+
+    def find_n(self, co: numpy.ndarray, n: int):
+        """Find n nearest points for every co. Returns (indices, distances) arrays sorted by distance"""
+        co = numpy.asarray(co, dtype=numpy.float64).reshape(-1, 3)
+        n = min(n, self.count)
+        if n == 0:
+            return numpy.empty((len(co), 0), dtype=numpy.int64), numpy.empty((len(co), 0))
+        idx = numpy.empty((len(co), n), dtype=numpy.int64)
+        dist = numpy.empty((len(co), n))
+        for i, (p, d) in _chunked(lambda c: self._find_n(c, n), len(co), co):
+            idx[i:i + len(p)] = p
+            dist[i:i + len(d)] = d
+        return self.index[idx], dist
+
+
+class TriTree(MortonIndex):
+    """Replacement for mathutils.bvhtree.BVHTree built from polygons"""
+    _tri_edges = None
+
+    def __init__(self, verts: numpy.ndarray, polys: numpy.ndarray):
+        self.verts = numpy.asarray(verts, dtype=numpy.float64).reshape(-1, 3)
+        self.polys = polys
+        tris, tri_face = triangulate(polys)
+        v = self.verts[tris]
+        lo = v.min(1)
+        hi = v.max(1)
+        super().__init__(lo, hi)
+        self.tris = tris[self.order]
+        self.tri_face = tri_face[self.order]
+        used = numpy.unique(self.tris)
+        self.vtree = PointTree(self.verts[used])
+
+    @property
+    def nbytes(self):
+        result = super().nbytes + self.tris.nbytes + self.tri_face.nbytes + self.vtree.nbytes
+        if self._tri_edges is not None:
+            result += sum(a.nbytes for a in self._tri_edges)
+        return result
+
+    def _closest(self, co, q, t):
+        tri = self.tris[t]
+        loc = closest_point_on_triangles(co[q], self.verts[tri[:, 0]], self.verts[tri[:, 1]], self.verts[tri[:, 2]])
+        d = loc - co[q]
+        return loc, numpy.sqrt(_dot(d, d))
+
+    def _closest_pairs(self, co, r, k=0):
+        for q, t, _ in self._candidates(co, r, k):
+            loc, d = self._closest(co, q, t)
+            mask = d <= r[q]
+            yield 0, (q[mask], t[mask], loc[mask], d[mask])
+
+    def _range(self, co, r):
+        return _concat_pairs(self._closest_pairs(co, r), 4)
+
+    def find_nearest_range(self, co: numpy.ndarray, r):
+        """
+        Find all triangles within distance r (scalar or per query).
+        Returns flat (query, location, polygon index, distance) arrays.
+        As in BVHTree.find_nearest_range, a polygon can be reported once per its triangle.
+        """
+        co = numpy.asarray(co, dtype=numpy.float64).reshape(-1, 3)
+        r = _per_query(r, len(co))
+        q, t, loc, d = _concat_pairs(_chunked(self._range, len(co), co, r), 4)
+        return q, loc.reshape(-1, 3), self.tri_face[t], d
+
+    def _nearest(self, co, max_dist):
+        # queries without coarse nodes within max_dist are misses, don't search nearest vertices for them
+        near = numpy.unique(self._descend(co, numpy.square(max_dist), 0, near_cull_size)[0])
+        # distance to the nearest vertex is an upper bound for distance to the surface
+        bound = numpy.minimum(self.vtree.find_n(co[near], 1)[1][:, 0], max_dist[near])
+        q, t, loc, d = _concat_pairs(self._closest_pairs(co[near], bound, 1), 4)
+        q = near[q]
+        loc_result = numpy.full((len(co), 3), numpy.nan)
+        face = numpy.full(len(co), -1, dtype=numpy.int64)
+        dist = numpy.full(len(co), numpy.inf)
+        if len(q):
+            order = numpy.lexsort((d, q))
+            q = q[order]
+            first = numpy.ones(len(q), dtype=bool)
+            first[1:] = q[1:] != q[:-1]
+            sel = order[first]
+            q = q[first]
+            loc_result[q] = loc[sel]
+            face[q] = self.tri_face[t[sel]]
+            dist[q] = d[sel]
+        return loc_result, face, dist
+
+    @property
+    def tri_edges(self):
+        if self._tri_edges is None:
+            a = self.verts[self.tris[:, 0]]
+            self._tri_edges = a, self.verts[self.tris[:, 1]] - a, self.verts[self.tris[:, 2]] - a
+        return self._tri_edges
+
+    def _segments_test(self, origin, d, limit, target, tri, result):
+        # skip targets that are already hit by previous chunks
+        mask = ~result[target]
+        target = target[mask]
+        tri = tri[mask]
+        a, e1, e2 = self.tri_edges
+        hit = _segments_intersect(origin, d[target], a[tri], e1[tri], e2[tri], limit)
+        result[target[hit]] = True
+
+    def _segments_brute(self, origin, d, limit, targets, tris, result):
+        step = max(1, (chunk_size * 64) // max(len(tris), 1))
+        for i in range(0, len(targets), step):
+            t = targets[i:i + step]
+            self._segments_test(origin, d, limit, t.repeat(len(tris)), numpy.tile(tris, len(t)), result)
+
+    def _segments_project(self, origin, d, limit, targets, axis, result):
+        u = numpy.cross(axis, (1., 0., 0.) if abs(axis[0]) < 0.9 else (0., 1., 0.))
+        u /= numpy.linalg.norm(u)
+        basis = numpy.stack((u, numpy.cross(axis, u), axis), 1)
+
+        pd = d[targets] @ basis
+        tv = ((self.verts - origin) @ basis)[self.tris]
+        eps = numpy.abs(tv).max() * 1e-9
+        tri_front = (tv[:, :, 2] > eps).all(1)
+        # triangles behind the origin can't be hit, ones crossing the projection plane are tested directly
+        tri_cross = (~tri_front & (tv[:, :, 2] > 0).any(1)).nonzero()[0]
+        if len(tri_cross):
+            self._segments_brute(origin, d, limit, targets, tri_cross, result)
+        tri_front = tri_front.nonzero()[0]
+        if len(tri_front) == 0:
+            return
+
+        xy = pd[:, :2] / pd[:, 2:]
+        txy = tv[tri_front, :, :2] / tv[tri_front, :, 2:]
+        lo = xy.min(0)
+        grid = max(1, int(numpy.sqrt(len(targets) * 2)))
+        cell = numpy.maximum(xy.max(0) - lo, 1e-30) / grid
+        cxy = ((xy - lo) / cell).astype(numpy.int64).clip(0, grid - 1)
+        cell_id = cxy[:, 1] * grid + cxy[:, 0]
+        order = numpy.argsort(cell_id, kind="stable")
+        points = targets[order]
+        starts = numpy.searchsorted(cell_id[order], numpy.arange(grid * grid + 1))
+
+        tmin = numpy.floor((txy.min(1) - lo) / cell)
+        tmax = numpy.floor((txy.max(1) - lo) / cell)
+        visible = ((tmax >= 0) & (tmin < grid)).all(1)
+        tri_front = tri_front[visible]
+        tmin = tmin[visible].clip(0, grid - 1).astype(numpy.int64)
+        tmax = tmax[visible].clip(0, grid - 1).astype(numpy.int64)
+        nx = tmax[:, 0] - tmin[:, 0] + 1
+        ncells = nx * (tmax[:, 1] - tmin[:, 1] + 1)
+
+        # expand triangles to covered cells and then to targets in these cells, chunk by chunk
+        bounds = numpy.searchsorted(numpy.cumsum(ncells), numpy.arange(0, ncells.sum(), chunk_size * 64))
+        for i, j in zip(bounds, numpy.append(bounds[1:], len(ncells))):
+            if i >= j:
+                continue
+            cnt = ncells[i:j]
+            tri = numpy.arange(i, j).repeat(cnt)
+            k = numpy.arange(len(tri)) - (numpy.cumsum(cnt) - cnt).repeat(cnt)
+            c = (tmin[tri, 1] + k // nx[tri]) * grid + tmin[tri, 0] + k % nx[tri]
+            pcnt = starts[c + 1] - starts[c]
+            tri = tri_front[tri].repeat(pcnt)
+            k = numpy.arange(len(tri)) - (numpy.cumsum(pcnt) - pcnt).repeat(pcnt) + starts[c].repeat(pcnt)
+            self._segments_test(origin, d, limit, points[k], tri, result)
+
+    def segments_hit(self, origin: numpy.ndarray, targets: numpy.ndarray, limit=1.0):
+        """
+        Check which segments from common origin to targets intersect any triangle, like BVHTree.ray_cast
+        with max_dist equal to limit fraction of segment length. Returns boolean array.
+        Targets and triangles are projected to a plane in front of the origin and binned in a 2D grid there,
+        so every segment is tested only against triangles whose projection covers its grid cell.
+        """
+        origin = numpy.asarray(origin, dtype=numpy.float64).reshape(3)
+        d = numpy.asarray(targets, dtype=numpy.float64).reshape(-1, 3) - origin
+        result = numpy.zeros(len(d), dtype=bool)
+        if self.count == 0 or len(d) == 0:
+            return result
+
+        # usually all targets are in a narrow cone, otherwise use a projection for every side of a cube
+        length = numpy.sqrt(_dot(d, d))
+        axis = (d / numpy.maximum(length, 1e-30)[:, None]).sum(0)
+        norm = numpy.linalg.norm(axis)
+        narrow = d @ (axis / norm) > length * 0.5 if norm > 0 else numpy.zeros(len(d), dtype=bool)
+        narrow[length == 0] = False
+        if narrow.any():
+            self._segments_project(origin, d, limit, narrow.nonzero()[0], axis / norm, result)
+        rest = (~narrow & (length > 0)).nonzero()[0]
+        if len(rest):
+            dominant = numpy.abs(d[rest]).argmax(1)
+            for i in range(3):
+                for sign in (-1, 1):
+                    targets = rest[(dominant == i) & (numpy.sign(d[rest, i]) == sign)]
+                    if len(targets):
+                        self._segments_project(origin, d, limit, targets, numpy.eye(3)[i] * sign, result)
+        return result
+
+    def _ray_cast(self, co, d, max_dist):
+        with numpy.errstate(divide="ignore"):
+            inv_d = 1 / d
+        r = numpy.arange(len(co))
+        node = numpy.zeros(len(co), dtype=numpy.int64)
+        for lo, hi in self.groups:
+            hit = _rays_boxes(co[r, None], inv_d[r, None], lo[node], hi[node], max_dist[r, None])
+            row, child = hit.nonzero()
+            r = r[row]
+            node = node[row] * tree_branch + child
+
+        a, e1, e2 = self.tri_edges
+        hit, t, u, v = _rays_intersect(co[r], d[r], a[node], e1[node], e2[node], max_dist[r])
+        r = r[hit]
+        t = t[hit]
+        order = numpy.lexsort((t, r))
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = r[order[1:]] != r[order[:-1]]
+        sel = order[first]
+        tri = numpy.full(len(co), -1, dtype=numpy.int64)
+        dist = numpy.full(len(co), numpy.inf)
+        uv = numpy.zeros((len(co), 2))
+        tri[r[sel]] = node[hit][sel]
+        dist[r[sel]] = t[sel]
+        uv[r[sel], 0] = u[hit][sel]
+        uv[r[sel], 1] = v[hit][sel]
+        return tri, dist, uv
+
+    def ray_cast(self, co: numpy.ndarray, direction: numpy.ndarray, max_dist=numpy.inf):
+        """
+        Batched BVHTree.ray_cast: find the first hit of every ray, both sides of triangles are hit.
+        Returns (location, polygon index, distance, triangle vertex indices, barycentric weights),
+        polygon index and triangle vertices are -1 for misses.
+        """
+        co = numpy.asarray(co, dtype=numpy.float64).reshape(-1, 3)
+        d = numpy.broadcast_to(numpy.asarray(direction, dtype=numpy.float64).reshape(-1, 3), co.shape)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            d = d / numpy.sqrt(_dot(d, d))[:, None]
+        max_dist = _per_query(max_dist, len(co))
+        tri = numpy.full(len(co), -1, dtype=numpy.int64)
+        dist = numpy.full(len(co), numpy.inf)
+        uv = numpy.zeros((len(co), 2))
+        if self.count:
+            ok = numpy.isfinite(d).all(1).nonzero()[0]
+            for i in range(0, len(ok), ray_chunk):
+                rows = ok[i:i + ray_chunk]
+                tri[rows], dist[rows], uv[rows] = self._ray_cast(co[rows], d[rows], max_dist[rows])
+
+        hit = tri >= 0
+        face = numpy.full(len(co), -1, dtype=numpy.int64)
+        face[hit] = self.tri_face[tri[hit]]
+        verts = numpy.full((len(co), 3), -1, dtype=numpy.int64)
+        verts[hit] = self.tris[tri[hit]]
+        bary = numpy.zeros((len(co), 3))
+        bary[hit, 0] = 1 - uv[hit].sum(1)
+        bary[hit, 1:] = uv[hit]
+        loc = numpy.full((len(co), 3), numpy.nan)
+        loc[hit] = co[hit] + d[hit] * dist[hit, None]
+        return loc, face, dist, verts, bary
+
+    def find_nearest(self, co: numpy.ndarray, max_dist=numpy.inf):
+        """
+        Find nearest surface point for every co.
+        Returns (location, polygon index, distance), polygon index is -1 for misses.
+        """
+        co = numpy.asarray(co, dtype=numpy.float64).reshape(-1, 3)
+        loc = numpy.empty((len(co), 3))
+        face = numpy.empty(len(co), dtype=numpy.int64)
+        dist = numpy.empty(len(co))
+        if self.count == 0:
+            loc.fill(numpy.nan)
+            face.fill(-1)
+            dist.fill(numpy.inf)
+            return loc, face, dist
+        max_dist = _per_query(max_dist, len(co))
+        for i, (l, f, d) in _chunked(self._nearest, len(co), co, max_dist):
+            loc[i:i + len(l)] = l
+            face[i:i + len(f)] = f
+            dist[i:i + len(d)] = d
+        return loc, face, dist
+
+
+def _half_tan(d1, d2, l1, l2):
+    area = numpy.linalg.norm(numpy.cross(d1, d2), axis=-1)
+    dot = numpy.einsum("...k,...k->...", d1, d2)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        result = (l1 * l2 - dot) / area
+    return numpy.where(numpy.isfinite(result), result, 0)
+
+
+def poly_weights(verts: numpy.ndarray, polys: numpy.ndarray, co: numpy.ndarray) -> numpy.ndarray:
+    """
+    Batched equivalent of mathutils.interpolate.poly_3d_calc (mean value coordinates).
+    polys is (n, m) array of polygon vertex indices padded with -1, co is (n, 3) points on these polygons.
+    Returns (n, m) weights, zero for padding.
+    """
+    n, m = polys.shape
+    valid = polys >= 0
+    cnt = valid.sum(1)
+    cur = numpy.arange(m)
+    nxt = (cur + 1) % cnt[:, None]
+    prv = (cur - 1) % cnt[:, None]
+    rows = numpy.arange(n)[:, None]
+
+    d = verts[polys] - co[:, None]
+    d[~valid] = 0
+    lens = numpy.linalg.norm(d, axis=-1)
+    dn = d[rows, nxt]
+    ln = lens[rows, nxt]
+    ht = _half_tan(d, dn, lens, ln)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        w = (ht[rows, prv] + ht) / lens
+    w[~valid] = 0
+    total = w.sum(1)
+    ok = total != 0
+    w[ok] /= total[ok, None]
+
+    # Mean value coordinates are unstable near polygon border, use linear interpolation there
+    eps = 16 * flt_epsilon * numpy.where(valid[..., None], numpy.abs(d), 0).max(axis=(1, 2))
+    edge = dn - d
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        fac = (-numpy.einsum("ijk,ijk->ij", d, edge) / numpy.einsum("ijk,ijk->ij", edge, edge))
+    fac = numpy.where(numpy.isfinite(fac), fac, 0).clip(0, 1)
+    seg_d = d + edge * fac[..., None]
+    seg_hit = valid & (numpy.einsum("ijk,ijk->ij", seg_d, seg_d) < (eps * eps)[:, None])
+    point_hit = valid & (lens < eps[:, None])
+    if seg_hit.any() or point_hit.any():
+        # the same order of checks as in interp_weights_poly_v3: it starts with the last vertex
+        step = (cur + 1) % cnt[:, None]
+        big = 2 * m + 2
+        keys = numpy.concatenate((numpy.where(point_hit, 2 * step, big), numpy.where(seg_hit, 2 * step + 1, big)), 1)
+        first = keys.argmin(1)
+        hit = keys[numpy.arange(n), first] < big
+        hidx = hit.nonzero()[0]
+        first = first[hidx]
+        is_seg = first >= m
+        vi = first % m
+        w[hidx] = 0
+        w[hidx[~is_seg], vi[~is_seg]] = 1
+        hs = hidx[is_seg]
+        vs = vi[is_seg]
+        f = fac[hs, vs]
+        w[hs, vs] = 1 - f
+        w[hs, nxt[hs, vs]] += f
+    return w
+
+
+def poly_weights_flat(verts, polys, face, co):
+    """poly_weights for polygon indices face, returns flat (row, vertex, weight) arrays"""
+    p = polys[face]
+    w = poly_weights(verts, p, co)
+    mask = p >= 0
+    rows = numpy.broadcast_to(numpy.arange(len(face))[:, None], p.shape)
+    return rows[mask], p[mask], w[mask]
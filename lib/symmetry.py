@@ -0,0 +1,190 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 3
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Mirror maps and X axis symmetry operations over weight matrices. This module doesn't use bpy.
+
+import hashlib
+import numpy
+
+from . import spatial
+from .pyutils import LRUCache
+
+tolerance = 0.00001
+
+# Mirror maps keyed by hash of vertex positions, so they survive everything except actual mesh edits
+mirror_cache = LRUCache(64 * 1048576)
+
+
+def is_deform(group_name):
+    return group_name.startswith("DEF-") or group_name.startswith("MCH-") or group_name.startswith("ORG-")
+
+
+def swap_l_r(name):
+    new_name = name.replace(".L", ".R").replace("_L_", "_R_").replace(".l", ".r").replace("_l_", "_r_")
+    if new_name != name:
+        return new_name
+    return name.replace(".R", ".L").replace("_R_", "_L_").replace(".r", ".l").replace("_r_", "_l_")
+
+
+def group_mirror(names):
+    """Index of L/R counterpart for every group name, -1 if there is no such group"""
+    index = {name: i for i, name in enumerate(names)}
+    return numpy.array([index.get(swap_l_r(name), -1) for name in names], dtype=numpy.int64)
+
+
+def deform_mask(names):
+    return numpy.fromiter(map(is_deform, names), dtype=bool, count=len(names))
+
+
+def verts_hash(verts: numpy.ndarray) -> str:
+    verts = numpy.ascontiguousarray(verts, dtype=numpy.float32)
+    return hashlib.blake2b(verts.tobytes(), digest_size=16).hexdigest()
+
+
+class MirrorMap:
+    """Counterpart of every vertex across X axis: index, -1 if not found or -2 if there are several candidates"""
+    def __init__(self, verts: numpy.ndarray, tol=tolerance):
+        verts = numpy.asarray(verts, dtype=numpy.float64).reshape(-1, 3)
+        q, idx, _ = spatial.PointTree(verts).find_range(verts * (-1, 1, 1), tol)
+        cnt = numpy.bincount(q, minlength=len(verts))
+        self.mirror = numpy.full(len(verts), -1, dtype=numpy.int64)
+        single = cnt[q] == 1
+        self.mirror[q[single]] = idx[single]
+        self.mirror[cnt > 1] = -2
+        self.center = verts[:, 0] == 0
+
+    @property
+    def nbytes(self):
+        return self.mirror.nbytes + self.center.nbytes
+
+    def pairs(self, rows: numpy.ndarray):
+        """Split rows into ones having a counterpart and returned (rows, counterparts) and failed ones"""
+        m = self.mirror[rows]
+        ok = m >= 0
+        return rows[ok], m[ok], rows[~ok]
+
+
+def get_mirror_map(verts: numpy.ndarray) -> MirrorMap:
+    return mirror_cache.get_or_create(verts_hash(verts), lambda: MirrorMap(verts))
+
+
+def counterpart_weights(w, member, gmap, m):
+    """Weights and membership of counterpart groups at counterpart vertices m, columns match original groups"""
+    has = gmap >= 0
+    g2 = numpy.where(has, gmap, 0)
+    return w[m][:, g2] * has, member[m][:, g2] & has
+
+
+def check(w, member, deform, gmap, rows, m):
+    """
+    Find asymmetric vertex groups and non-normalized deform weights at vertices rows with counterparts m.
+    Returns (membership count mismatch rows, missing (row, group) pairs,
+    weight mismatch (row, group) pairs, non-normalized rows with their weight sums)
+    """
+    wv = w[rows]
+    mv = member[rows]
+    w2, m2 = counterpart_weights(w, member, gmap, m)
+    cnt_mismatch = (mv.sum(1) != member[m].sum(1)).nonzero()[0]
+    missing = numpy.stack((mv & ~m2).nonzero(), 1)
+    mismatch = numpy.stack((mv & m2 & (numpy.abs(wv - w2) >= 0.01)).nonzero(), 1)
+    wsum = (wv * (mv & deform)).sum(1)
+    bad = (numpy.abs(wsum - 1) >= 0.0001).nonzero()[0]
+    return cnt_mismatch, missing, mismatch, (bad, wsum[bad])
+
+
+def normalize(w, member, deform, rows):
+    cols = deform.nonzero()[0]
+    wsum = (w[rows] * (member[rows] & deform)).sum(1)
+    need = (numpy.abs(wsum - 1) >= 0.0001) & (wsum > 0)
+    w[numpy.ix_(rows[need], cols)] /= wsum[need, None]
+
+
+class WeightSymmetrizer:
+    """
+    Batched OpSymmetrizeWeights: make weights of selected vertices match their counterparts and normalize them.
+    Weights of both selected counterparts are averaged. Works in place on dense weight and membership matrices.
+    """
+    def __init__(self, w, member, names, locked):
+        self.w = w
+        self.member = member
+        self.names = names
+        self.deform = deform_mask(names)
+        self.locked = locked
+        self.gmap = group_mirror(names)
+        self.messages = []
+
+    def run(self, mirror: MirrorMap, selected: numpy.ndarray):
+        rows = selected.nonzero()[0]
+        center = mirror.center[rows]
+        normalize(self.w, self.member, self.deform, rows[center])
+        rows, m, failed = mirror.pairs(rows[~center])
+        self.messages += [f"no counterpart {i}" for i in failed.tolist()]
+
+        # A vertex whose selected counterpart is processed first gets already symmetrized weights.
+        # Imitate this by processing such vertices in the second pass.
+        second = selected[m] & (m < rows)
+        for sel in ~second, second:
+            if not self._pass(rows[sel], m[sel], selected[m[sel]]):
+                return False
+        return True
+
+    def _pass(self, rows, m, both):
+        w = self.w
+        member = self.member
+        deform = self.deform
+        has = self.gmap >= 0
+        g2 = numpy.where(has, self.gmap, 0)
+
+        # cleanup groups without counterparts before normalizing
+        w2, m2 = counterpart_weights(w, member, self.gmap, m)
+        remove = member[rows] & ~m2 & ~self.locked
+        for r, g in zip(*(remove & ~deform).nonzero()):
+            self.messages.append(f"removing non-deform vg {rows[r]} {m[r]} {self.names[g]}")
+        r, g = remove.nonzero()
+        member[rows[r], g] = False
+        w[rows[r], g] = 0
+
+        wgt2 = (w2 * (m2 & deform)).sum(1)
+        bad = wgt2 < 0.0001
+        self.messages += [f"{i} {j} situation is too bad, please check" for i, j in zip(rows[bad], m[bad])]
+        rows = rows[~bad]
+        m = m[~bad]
+        both = both[~bad]
+        wgt2 = wgt2[~bad]
+        wgt2[numpy.abs(wgt2 - 1) < 0.0001] = 1
+
+        normalize(w, member, deform, rows)
+
+        target = w[m][:, g2] * has
+        target[:, deform[g2] & has] /= wgt2[:, None]
+        active = member[rows] & ~self.locked
+        over = active & (target > 1)
+        if over.any():
+            r, g = numpy.argwhere(over)[0]
+            self.messages.append(f"Bad g2 weight! {rows[r]} {m[r]} {self.names[g2[g]]} {target[r, g]} {wgt2[r]}")
+            return False
+
+        cur = w[rows]
+        diff = active & (numpy.abs(cur - target) >= 0.00001)
+        avg = (cur + target) / 2
+        r, g = (diff & both[:, None]).nonzero()
+        w[m[r], g2[g]] = avg[r, g]
+        w[rows] = numpy.where(diff, numpy.where(both[:, None], avg, target), cur)
+
+        normalize(w, member, deform, rows)
+        return True
@@ -18,9 +18,15 @@
 #
 # Copyright (C) 2021-2022 Michael Vigovsky
 
-import os, time, logging, numpy
+import os, io, atexit, logging, hashlib, itertools, numpy
 import bpy, mathutils  # pylint: disable=import-error
 
+from . import binding, fast_yaml
+from .manifest import Manifest
+from .pyutils import (  # pylint: disable=unused-import
+    Timer, StageTimer, LRUCache, named_lazyprop, lazyproperty, parallel_map, timed, vg_add_bulk, vg_weight_step,
+    load_npz)
+
 logger = logging.getLogger(__name__)
 
 generative_modifiers = frozenset((
@@ -31,9 +37,12 @@ generative_modifiers = frozenset((
 
 try:
     from yaml import load as yload, dump as ydump, CSafeLoader as SafeLoader, Dumper
+    use_fast_yaml = False
 except ImportError:
     from .yaml import load as yload, dump as ydump, SafeLoader, Dumper
     logger.debug("Using bundled yaml library!")
+    # Pure python loader is much slower than the fast loader for the config subset
+    use_fast_yaml = True
 
 
 # set some yaml styles
@@ -49,10 +58,34 @@ MyDumper.add_representer(
         dumper.represent_float(round(value, 5)))
 
 
-def load_yaml(data):
+def _load_yaml_full(data):
     return yload(data, Loader=SafeLoader)
 
 
+def load_yaml(data):
+    if use_fast_yaml:
+        if not isinstance(data, str):
+            data = data.read()
+        return fast_yaml.load(data, _load_yaml_full)
+    return _load_yaml_full(data)
+
+
+def _read_yaml(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return load_yaml(f)
+
+
+# Parsed yaml files keyed by path and validated by modification time and size.
+# It's kept on disk when a file is attached to it (library does it on load).
+# Only files inside of the library are kept there, entries of deleted files are dropped on saving.
+yaml_cache = Manifest(None, "")
+atexit.register(lambda: yaml_cache.save(False))
+
+
+def load_yaml_file(path):
+    return yaml_cache.get(path, _read_yaml)
+
+
 def dump_yaml(data, f):
     return ydump(data, f, Dumper=MyDumper)
 
@@ -73,42 +106,49 @@ class ObjTracker:
         return True
 
 
-#########
-class Timer:
-    def __init__(self):
-        self.t = time.perf_counter()
-
-    def time(self, name):
-        t2 = time.perf_counter()
-        logger.debug("%s: %s", name, t2 - self.t)
-        self.t = t2
+# Mesh data versions are used to invalidate cached data derived from meshes.
+# Version is changed when depsgraph reports geometry update of the mesh,
+# except updates caused by CharMorph itself (like writing fitted shape keys) that are marked with mesh_own_update().
+# Meshes are keyed by session_uid: unlike pointers, it isn't reused for another mesh after the mesh is freed.
+_mesh_versions: dict[int, tuple[int, int]] = {}  # session_uid -> (version, vertex count)
+_mesh_own_updates: set[int] = set()
+_version_counter = itertools.count(1)
 
 
-class named_lazyprop:
-    __slots__ = ("fn", "name")
+def mesh_version(mesh) -> int:
+    cnt = len(mesh.vertices)
+    result = _mesh_versions.get(mesh.session_uid)
+    if result is None or result[1] != cnt:
+        result = (next(_version_counter), cnt)
+        _mesh_versions[mesh.session_uid] = result
+    return result[0]
 
-    def __init__(self, name, fn):
-        self.fn = fn
-        self.name = name
-
-    def __get__(self, instance, owner):
-        if instance is None:
-            return None
-        value = self.fn(instance)
-        setattr(instance, self.name, value)
-        return value
 
+def mesh_own_update(mesh):
+    _mesh_own_updates.add(mesh.session_uid)
 
-class lazyproperty(named_lazyprop):
-    __slots__ = ()
 
-    def __init__(self, fn):
-        super().__init__(fn.__name__, fn)
+def update_mesh_versions(depsgraph):
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry:
+            continue
+        data = update.id.original
+        if isinstance(data, bpy.types.Object):
+            if data.type != "MESH":
+                continue
+            data = data.data
+        elif not isinstance(data, bpy.types.Mesh):
+            continue
+        if data.session_uid not in _mesh_own_updates:
+            _mesh_versions.pop(data.session_uid, None)
+    _mesh_own_updates.clear()
 
 
 def parse_file(path, parse_func, default):
     if not os.path.isfile(path):
         return default
+    if parse_func is load_yaml:
+        return yaml_cache.parse(path, _read_yaml, default)
     try:
         with open(path, "r", encoding="utf-8") as f:
             return parse_func(f)
@@ -188,6 +228,28 @@ def verts_to_numpy(data):
     return arr.reshape(-1, 3)
 
 
+def mesh_edges(mesh):
+    arr = numpy.empty(len(mesh.edges) * 2, dtype=numpy.int32)
+    mesh.edges.foreach_get("vertices", arr)
+    return arr.reshape(-1, 2).astype(numpy.int64)
+
+
+def mesh_polys(mesh):
+    """Polygon vertex indices as 2D array padded with -1"""
+    cnt = len(mesh.polygons)
+    starts = numpy.empty(cnt, dtype=numpy.int32)
+    totals = numpy.empty(cnt, dtype=numpy.int32)
+    mesh.polygons.foreach_get("loop_start", starts)
+    mesh.polygons.foreach_get("loop_total", totals)
+    loops = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+    mesh.loops.foreach_get("vertex_index", loops)
+    width = max(totals.max(initial=0), 3)
+    result = numpy.full((cnt, width), -1, dtype=numpy.int64)
+    mask = numpy.arange(width) < totals[:, None]
+    result[mask] = loops[(starts[:, None] + numpy.arange(width))[mask]]
+    return result
+
+
 def get_basis_numpy(data):
     return verts_to_numpy(get_basis_verts(data))
 
@@ -310,65 +372,50 @@ def np_matrix_transform(arr, mat):
     arr += numpy.array(mat.translation)
 
 
-def get_vg_data(char, new, accumulate, verts=None):
-    if verts is None:
-        verts = char.data.vertices
+# Vertex groups of meshes, keyed by mesh session_uid. Group names are a part of version,
+# so adding, removing or renaming groups invalidates cached data.
+vg_cache = LRUCache(256 * 1048576)
 
-    if isinstance(verts, numpy.ndarray):
-        def get_co(i):
-            return mathutils.Vector(verts[i])
-    else:
-        def get_co(i):
-            return verts[i].co
-
-    data = {}
-    for v in char.data.vertices:
-        for gw in v.groups:
-            vg = char.vertex_groups[gw.group]
-            if not vg.name.startswith("joint_"):
-                continue
-            data_item = data.get(vg.name)
-            if not data_item:
-                data_item = new()
-                data[vg.name] = data_item
-            accumulate(data_item, v, get_co(v.index), gw)
-    return data
+
+def _read_vertex_groups(obj, names):
+    groups = [v.groups for v in obj.data.vertices]
+    cnt = numpy.fromiter(map(len, groups), dtype=numpy.int64, count=len(groups))
+    total = int(cnt.sum())
+    cols = numpy.fromiter((g.group for g in itertools.chain.from_iterable(groups)), dtype=numpy.int64, count=total)
+    weights = numpy.fromiter(
+        (g.weight for g in itertools.chain.from_iterable(groups)), dtype=numpy.float32, count=total)
+    bad = (cols < 0) | (cols >= len(names))
+    if bad.any():
+        logger.warning("%s: %d vertex group entries with invalid group index", obj.name, bad.sum())
+        rows = numpy.arange(len(cnt)).repeat(cnt)[~bad]
+        cnt = numpy.bincount(rows, minlength=len(cnt))
+        cols = cols[~bad]
+        weights = weights[~bad]
+    return binding.VGMatrix.from_counts(list(names), cnt, cols.astype(numpy.uint32), weights)
+
+
+def read_vertex_groups(obj) -> "binding.VGMatrix":
+    """Read all vertex group weights of the mesh object in a single pass, result is cached per mesh version"""
+    mesh = obj.data
+    names = tuple(vg.name for vg in obj.vertex_groups)
+    return vg_cache.get_or_create(
+        mesh.session_uid, lambda: _read_vertex_groups(obj, names), (mesh_version(mesh), names))
 
 
-def get_vg_avg(char, verts=None):
-    def accumulate(data_item, _, co, gw):
-        data_item[0] += gw.weight
-        data_item[1] += co * gw.weight
-    return get_vg_data(char, lambda: [0, mathutils.Vector()], accumulate, verts)
+# Call it after changing weights in existing vertex groups
+def vg_changed(obj):
+    vg_cache.pop(obj.data.session_uid)
 
 
 def vg_weights_to_arrays(obj, name_filter):
-    m = {}
-    names = []
-    idx = []
-    weights = []
-    for vg in obj.vertex_groups:
-        if name_filter(vg.name):
-            m[vg.index] = len(idx)
-            names.append(vg.name)
-            idx.append([])
-            weights.append([])
-
-    if len(names) > 0:
-        for v in obj.data.vertices:
-            for g in v.groups:
-                i = m.get(g.group)
-                if i is None:
-                    continue
-                idx[i].append(v.index)
-                weights[i].append(g.weight)
-
-    return names, idx, weights
+    return read_vertex_groups(obj).groups(name_filter)
 
 
 def np_names(file):
     if not file:
         return ()
+    if isinstance(file, binding.VGroups):
+        return file.names
     if isinstance(file, str):
         file = numpy.load(file)
     return [n.decode("utf-8") for n in bytes(file["names"]).split(b'\0')]
@@ -396,16 +443,36 @@ def vg_read(z):
     raise Exception("Invalid type for vg_read: " + z)
 
 
-def import_vg(obj, file, overwrite):
+# Parsed weight files keyed by path, modification time and size are a part of version
+weights_file_cache = LRUCache(128 * 1048576)
+
+
+def _read_weights_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return binding.VGroups(
+        vg_read_npz(numpy.load(io.BytesIO(data))), hashlib.blake2b(data, digest_size=16).hexdigest())
+
+
+def read_weights_file(path) -> "binding.VGroups":
+    """Read vertex groups from .npz weights file, the file is parsed again only if it is changed on disk"""
+    if not path or not os.path.isfile(path):
+        return None
+    st = os.stat(path)
+    return weights_file_cache.get_or_create(
+        path, lambda: _read_weights_file(path), (st.st_mtime_ns, st.st_size))
+
+
+# Weights are written exactly by default, pass step to quantize them for faster import (see vg_add_bulk)
+def import_vg(obj, file, overwrite, step=None):
     for name, idx, weights in vg_read(file):
         if name in obj.vertex_groups:
             if overwrite:
                 obj.vertex_groups.remove(obj.vertex_groups[name])
             else:
                 continue
-        vg = obj.vertex_groups.new(name=name)
-        for i, weight in zip(idx, weights):
-            vg.add([int(i)], weight, 'REPLACE')
+        vg_add_bulk(obj.vertex_groups.new(name=name), idx, weights, step)
+    vg_changed(obj)
 
 
 def bone_get_collections(bone):
@@ -294,6 +294,47 @@ def load_base_mesh(path: str) -> BaseMesh:
     )
 
 
+@dataclass(slots=True)
+class BaseMeshHeader:
+    """Identification data of a base mesh file that is available without parsing the whole mesh."""
+
+    name: str
+    version: str
+    metadata: Dict[str, str]
+    unit: str
+    path: str
+
+    def load(self) -> BaseMesh:
+        return load_base_mesh(self.path)
+
+
+def read_header(path: str) -> BaseMeshHeader:
+    """Read root attributes, metadata and topology unit, stopping before the geometry when possible."""
+    name = version = None
+    metadata: Optional[Dict[str, str]] = None
+    unit = None
+    depth = 0
+    for event, node in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                if node.tag != "BaseMesh":
+                    raise ValueError(f"Root element must be <BaseMesh>, got <{node.tag}> in {path}")
+                name = node.get("name") or os.path.splitext(os.path.basename(path))[0]
+                version = node.get("version", "1.0")
+            elif depth == 2 and node.tag == "Topology":
+                unit = node.get("unit", "meters")
+        else:
+            depth -= 1
+            if depth == 1 and node.tag == "Metadata":
+                metadata = _parse_metadata(node)
+        if unit is not None and metadata is not None:
+            break
+    if unit is None:
+        raise ValueError(f"<Topology> element missing in {path}")
+    return BaseMeshHeader(name, version, metadata or {}, unit, path)
+
+
 def load_dir(path: str) -> Dict[str, BaseMesh]:
     """Load all XML base meshes from the given directory."""
     result: Dict[str, BaseMesh] = {}
@@ -139,6 +139,10 @@ class UIProps:
         get=lambda _: manager.morpher.core.clamp,
         set=lambda _, value: manager.morpher.set_clamp(value),
         update=lambda _ui, _: manager.morpher.update())
+    rig_live: bpy.props.BoolProperty(
+        name="Live rig follow",
+        description="Only move bones while morphing a rigged character, bone rolls are updated after a short pause",
+        default=False)
     morph_l1: bpy.props.EnumProperty(
         name="Type",
         description="Choose character type",
@@ -257,6 +261,8 @@ class CHARMORPH_PT_Morphing(bpy.types.Panel):
                 col.prop(morphs, "meta_" + prop, slider=True)
 
         self.layout.prop(ui, "morph_clamp")
+        if mm.rig:
+            self.layout.prop(ui, "rig_live")
 
         self.layout.separator()
 
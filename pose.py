@@ -18,11 +18,12 @@
 #
 # Copyright (C) 2020 Michael Vigovsky
 
-import logging, re
+import logging, re, numpy
 import bpy  # pylint: disable=import-error
 
-from mathutils import Matrix, Vector  # pylint: disable=import-error
+from mathutils import Matrix  # pylint: disable=import-error
 
+from .lib import utils
 from .lib.charlib import library
 
 logger = logging.getLogger(__name__)
@@ -76,6 +77,68 @@ for side in ["L", "R"]:
             bone_map[f"{finger}0{i}_{side}"] = (f"f_{finger}.0{i}{is_master}.{side}", m2)
 del side
 
+bone_keys = list(bone_map)
+bone_targets = [bone_map[k][0] for k in bone_keys]
+bone_matrices = numpy.array([[tuple(row) for row in bone_map[k][1]] for k in bone_keys])
+
+
+def quat_mul(a, b):
+    w1, x1, y1, z1 = a
+    w2, x2, y2, z2 = b
+    return (
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+    )
+
+
+def pose_rotations(pose: dict):
+    """Get target bone names and their rotation quaternions for the pose from library"""
+    rows = [i for i, k in enumerate(bone_keys) if k in pose]
+    for k in pose.keys() - bone_map.keys():
+        logger.debug("no target for %s", k)
+    quats = numpy.array([pose[bone_keys[i]] for i in rows], dtype=numpy.float64).reshape(-1, 4)
+    return [bone_targets[i] for i in rows], numpy.einsum("nij,nj->ni", bone_matrices[rows], quats)
+
+
+class RigIndex:
+    """Pose bone name to index map of a rig"""
+
+    def __init__(self, rig):
+        names = rig.pose.bones.keys()
+        self.index = {name: i for i, name in enumerate(names)}
+        self.org = numpy.array([name.startswith("ORG-") for name in names], dtype=bool)
+
+    @property
+    def nbytes(self):
+        return self.org.nbytes * 64
+
+    def rows(self, bones, names):
+        """Get bone indices, None for missing bones. Returns None if the index is outdated"""
+        result = [self.index.get(name) for name in names]
+        for i, name in zip(result, names):
+            if i is not None and bones[i].name != name:
+                return None
+        return result
+
+
+# Bone indices of rigs keyed by session_uid, bone count is a part of version
+rig_indices = utils.LRUCache(16 * 1048576)
+
+
+def bone_rows(rig, names):
+    bones = rig.pose.bones
+    key = rig.session_uid
+    index = rig_indices.get_or_create(key, lambda: RigIndex(rig), len(bones))
+    rows = index.rows(bones, names)
+    if rows is None:
+        index = RigIndex(rig)
+        rig_indices.put(key, index, len(bones))
+        rows = index.rows(bones, names)
+    return index, rows
+
+
 # Different rigify versions use different parameters for IK2FK so we need to scan its modules
 
 ik2fk_map = {}
@@ -147,36 +210,45 @@ def apply_pose(ui, context):
     finally:
         bpy.ops.object.mode_set(mode=old_mode)
 
-    for k, v in pose.items():
-        name, matrix = bone_map.get(k, ("", None))
-        target_bone = rig.pose.bones.get(name)
-        if not target_bone:
-            logger.debug("no target for %s", k)
-            continue
-        target_bone.rotation_mode = "QUATERNION"
-        target_bone.rotation_quaternion = matrix @ Vector(v)
-
-    spine_fk = rig.pose.bones.get("spine_fk")
-    spine_fk1 = rig.pose.bones.get("spine_fk.001")
-    spine_fk2 = rig.pose.bones.get("spine_fk.002")
-
-    if spine_fk and spine_fk1 and spine_fk2:
-        q = spine_fk1.rotation_quaternion
-        spine_fk.rotation_quaternion = [-q[0], q[1], q[2], q[3]]
-        spine_fk2.rotation_quaternion @= q
+    bones = rig.pose.bones
+    names, quats = pose_rotations(pose)
+    index, rows = bone_rows(rig, names + ["spine_fk", "spine_fk.001", "spine_fk.002"])
+    spine = rows[len(names):]
+    found = []
+    for i, row in enumerate(rows[:len(names)]):
+        if row is None:
+            logger.debug("no target for %s", names[i])
+        else:
+            found.append(i)
+    rows = [rows[i] for i in found]
+    quats = quats[found]
+
+    for i in rows:
+        bone = bones[i]
+        if bone.rotation_mode != "QUATERNION":
+            bone.rotation_mode = "QUATERNION"
+    arr = numpy.empty(len(bones) * 4, dtype=numpy.float32)
+    bones.foreach_get("rotation_quaternion", arr)
+    arr = arr.reshape(-1, 4)
+    arr[rows] = quats
+
+    if None not in spine:
+        q = arr[spine[1]].copy()
+        arr[spine[0]] = (-q[0], q[1], q[2], q[3])
+        arr[spine[2]] = quat_mul(arr[spine[2]], q)
+    bones.foreach_set("rotation_quaternion", arr.reshape(-1))
 
     if hasattr(context, "evaluated_depsgraph_get"):
         # Calculate lowest point for sitting and similiar poses
         erig = rig.evaluated_get(context.evaluated_depsgraph_get())
-        torso = rig.pose.bones.get("torso")
+        torso = bones.get("torso")
         min_z = torso.head[2]
-        for bone in erig.pose.bones:
-            if not bone.name.startswith("ORG-"):
-                continue
-            for attr in ["head", "tail"]:
-                val = getattr(bone, attr)
-                if val[2] < min_z:
-                    min_z = val[2]
+        if index.org.any():
+            ebones = erig.pose.bones
+            co = numpy.empty(len(ebones) * 3, dtype=numpy.float32)
+            for attr in ("head", "tail"):
+                ebones.foreach_get(attr, co)
+                min_z = min(min_z, float(co.reshape(-1, 3)[index.org, 2].min()))
         min_z = max(min_z, 0)
         if torso:
             torso.location = (0, 0, -min_z)
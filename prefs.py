@@ -26,6 +26,13 @@ class CharMorphPrefs(bpy.types.AddonPreferences):
         description="No censors, enable adult assets (genitails, pubic hair)",
         default=False,
     )
+    geom_cache_size: bpy.props.IntProperty(
+        name="Fitting cache size (MiB)",
+        description="Memory limit for cached asset geometry and search structures used in fitting",
+        default=512,
+        min=16,
+        update=lambda ui, _ctx: _update_geom_cache_size(ui),
+    )
     # addon updater preferences
     auto_check_update = bpy.props.BoolProperty(
         name="Auto-check for Update",
@@ -62,6 +69,9 @@ class CharMorphPrefs(bpy.types.AddonPreferences):
     def draw(self, context):
         self.layout.prop(self, "undo_mode")
         self.layout.prop(self, "adult_mode")
+        self.layout.prop(self, "geom_cache_size")
+        from .lib import fit_calc  # pylint: disable=import-outside-toplevel
+        self.layout.label(text="Fitting cache: " + fit_calc.geom_cache.stats())
         addon_updater_ops.update_settings_ui(self,context)
         
         
@@ -71,6 +81,16 @@ def get_prefs():
     return bpy.context.preferences.addons.get(__package__)
 
 
+def get_geom_cache_size():
+    prefs = get_prefs()
+    return (prefs.preferences.geom_cache_size if prefs else 512) * 1048576
+
+
+def _update_geom_cache_size(ui):
+    from .lib import fit_calc  # pylint: disable=import-outside-toplevel
+    fit_calc.geom_cache.max_bytes = ui.geom_cache_size * 1048576
+
+
 def is_adult_mode():
     prefs = get_prefs()
     if not prefs:
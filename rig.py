@@ -38,11 +38,14 @@ def add_rig(ui):
         raise rigging.RigException(
             f"Vertex count mismatch: {len(m.core.obj.data.vertices)} != {len(m.core.char.np_basis)}")
 
+    t = utils.StageTimer("Rig build")
     old_handler = m.rig_handler
     rig = m.add_rig(conf)
+    t.time("rig import")
     try:
         bpy.context.view_layer.objects.active = rig
         rigger = m.run_rigger(ui.rig_manual_sculpt, None, ui.rig_manual_joints)
+        t.time("joints")
 
         if not ui.rig_manual_weights:
             if old_handler:
@@ -51,13 +54,16 @@ def add_rig(ui):
                 m.fitter.transfer_weights(m.core.obj, conf.weights_npz)
             else:
                 utils.import_vg(m.core.obj, conf.weights_npz, False)
+            t.time("weights")
 
         m.rig_handler.finalize(rigger)
+        t.time("finalize")
 
         if conf.drivers:
             drivers.dimport(
                 utils.parse_file(m.core.char.path(conf.drivers), json.load, {}), False,
                 char=m.core.obj, rig=m.rig_handler.obj)
+            t.time("drivers")
 
         m.rig_handler.obj.data["charmorph_template"] =\
             m.core.char.name or m.core.obj.data.get("charmorph_template", "")
@@ -70,6 +76,7 @@ def add_rig(ui):
 
     if old_handler:
         old_handler.delete_rig()
+    t.report()
     return m.rig_handler.err
 
 
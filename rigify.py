@@ -107,6 +107,9 @@ def add_mixin(char, conf, rig):
 
 
 class RigifyHandler(rigging.RigHandler):
+    # generated rig bones are derived from metarig, they can't follow joints directly
+    supports_follow = False
+
     def __init__(self, morpher, rig, conf):
         super().__init__(morpher, rig, conf)
         self.slow = not conf.no_legacy
@@ -116,7 +119,7 @@ class RigifyHandler(rigging.RigHandler):
         return not self.conf.mixin and hasattr(self.obj.data, "rigify_target_rig")
 
     def on_update(self, rigger):
-        t = utils.Timer()
+        t = utils.StageTimer("Rigify update")
         metarig = bpy.data.objects.get(self.backup_metarig_name)
         if not metarig:
             metarig = bpy.data.armatures.get(self.backup_metarig_name)
@@ -152,8 +155,8 @@ class RigifyHandler(rigging.RigHandler):
             vl.layer_collection.collection.objects.unlink(metarig)
         t.time("rigify part")
 
-        self._do_rig(rigger)
-        t.time("rigify after part")
+        self._do_rig(rigger, t)
+        t.report()
 
     def delete_rig(self):
         try:
@@ -163,50 +166,55 @@ class RigifyHandler(rigging.RigHandler):
         finally:
             super().delete_rig()
 
-    def _do_rig(self, rigger: rigging.Rigger):
+    def _do_rig(self, rigger: rigging.Rigger, t: utils.Timer):
         rig = self.obj
         obj = self.morpher.core.obj
         conf = self.conf
 
         rigging.rigify_finalize(rig, obj)
         apply_rig_parameters(rig, conf)
+        t.time("rigify finalize")
 
         new_bones, new_joints = add_mixin(self.morpher.core.char, conf, rig)
+        t.time("mixin import")
 
-        for tweak in self.tweaks[0]:
-            rigging.apply_tweak(rig, tweak)
+        engine = rigging.TweakEngine(bpy.context, rig)
+        engine.apply_stage(self.tweaks[0])
+        t.time("pre tweaks")
 
         sj_list: typing.Iterable[tuple[str, str, str, float]] = ()
         if len(self.tweaks[1]) > 0 or len(conf.sliding_joints) > 0 or new_joints:
-            bpy.ops.object.mode_set(mode="EDIT")
+            engine.set_mode("EDIT")
 
             if new_joints:
                 rigger.set_opts(conf.mixin_bones)
                 if not rigger.run(new_joints):
                     raise rigging.RigException("Mixin fitting failed")
 
-            for tweak in self.tweaks[1]:
-                rigging.apply_editmode_tweak(bpy.context, tweak)
+            engine.apply_edit_stage(self.tweaks[1])
 
             sj_list = sliding_joints.create_from_conf(self.morpher.sj_calc, conf)
 
-            bpy.ops.object.mode_set(mode="OBJECT")
+            engine.set_mode("OBJECT")
+            t.time("edit mode tweaks")
 
-        for tweak in self.tweaks[2]:
-            rigging.apply_tweak(rig, tweak)
+        engine.apply_stage(self.tweaks[2])
+        t.time("post tweaks")
 
         for data in sj_list:
             sliding_joints.finalize(rig, *data)
 
         # adjust bone constraints for mixin
         if new_bones:
+            pose_bones = engine.pose_bones
             for name in new_bones:
-                bone = rig.pose.bones.get(name)
+                bone = pose_bones.get(name)
                 if not bone:
                     continue
                 for c in bone.constraints:
                     if c.type == "STRETCH_TO":
                         c.rest_length = bone.length
+        t.time("sliding joints and mixin constraints")
 
     def finalize(self, rigger: rigging.Rigger):
         ui = bpy.context.window_manager.charmorph_ui
@@ -224,7 +232,7 @@ class RigifyHandler(rigging.RigHandler):
             metarig.data.rigify_generate_mode = "new"
         if hasattr(metarig.data, "rigify_target_rig"):
             metarig.data.rigify_target_rig = None
-        t = utils.Timer()
+        t = utils.StageTimer("Rigify finalize")
         try:
             if hasattr(bpy.ops.armature, "rigify_upgrade_layers") and metarig.data.get("rigify_layers"):
                 bpy.ops.armature.rigify_upgrade_layers()
@@ -245,7 +253,7 @@ class RigifyHandler(rigging.RigHandler):
             else:
                 bpy.data.armatures.remove(metarig.data)
             self.obj.name = self.morpher.core.obj.name + "_rig"
-            self._do_rig(rigger)
+            self._do_rig(rigger, t)
         except Exception:
             try:
                 bpy.data.armatures.remove(metarig.data)
@@ -254,6 +262,8 @@ class RigifyHandler(rigging.RigHandler):
             raise
 
         super().finalize(rigger)
+        t.time("attach rig")
+        t.report()
 
 
 class UIProps: